@@ -92,14 +92,15 @@ def import_nodes_from_csv(extra_vars=[],networkFile="finalTMP_TP2_pm.tmp"):
     F.close()
     return nodes
     
-def nodes_zones_links_connectors_fromCSV(extra_vars=[],networkFile="finalTMP_TP2_pm.tmp"):
+def nodes_zones_links_connectors_fromCSV(extra_vars=[],networkFile="finalTMP_TP2_pm.tmp",maxZone=2475):
     
-    """imports cube network from network file and returns a list of each
+    """imports cube network from network file and returns a list of each of the nodes, zones,
+       links and connectors, where the nodes numbered up to maxZone are zones and the links
+       to or from them are connectors
     """
     if not os.path.exists('node.csv') and os.path.exists('link.csv'):
         cubeNet2CSV(file=networkFile,extra_vars=extra_vars)
 
-    MAXZONE=2475
     zones=[]
     nodes=[]
     F=open('node.csv',mode='r')
@@ -108,7 +109,7 @@ def nodes_zones_links_connectors_fromCSV(extra_vars=[],networkFile="finalTMP_TP2
         n=int(r[0])
         x=float(r[1])
         y=float(r[2])
-        if n<=MAXZONE:
+        if n<=maxZone:
             zones.append({"N":n,"x":x,"y":y})
         else:
             nodes.append({"N":n,"x":x,"y":y})
@@ -122,7 +123,7 @@ def nodes_zones_links_connectors_fromCSV(extra_vars=[],networkFile="finalTMP_TP2
         link={'A':int(r[0]),'B':int(r[1])}
         for v in extra_vars:
             link[v] = r[extra_vars.index(v)+2]
-        if a<=MAXZONE or b<=MAXZONE:
+        if a<=maxZone or b<=maxZone:
             connectors.append(link)
         else:
             links.append(link)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+""" adds skim travel attributes to CHAMP4 disaggregate trip or tour HDF5 tables """
+
+import getopt
+import multiprocessing
+import sys
+import os
+import numpy
+from champUtil import SkimUtil, TOURSKIMS
+from time import time,localtime,strftime
+from tables import openFile,Filters,Float32Col
+
+__license__= "GPL"
+
+USAGE = """
+usage: python addSkimAttributes.py -t [TYPE] [-j workers] [-c chunkrows] [skimdir] [inputfile.H5] [outputfile.H5]
+
+ Reads the records table of the input file (written by convertDisaggregateTextToHdf5.py)
+ a chunk of rows at a time, looks up the skim distance, time, out-of-pocket cost, operating
+ cost and parking cost for each record with SkimUtil, and writes the records with those columns
+ added to the records table of the output file.
+
+ Trips reroll paysToPark from each person's randseed (see champUtil.tripRandom), so the
+ results don't depend on the chunk size or number of workers.
+
+ TYPE is TRIPMC or TOURMC.  For tours, the outbound (todepart) and return (tddepart) halves
+ are added together; tours start at the homestaz, or the workstaz for work-based tours.
+
+ -j workers   : number of processes to compute chunks in (default 1)
+ -c chunkrows : rows per chunk (default 100000)
+"""
+
+# Columns added to the records, in the order SkimUtil returns them
+SKIMCOLS = ["skimDist", "skimTime", "skimCost", "skimOpCost", "skimPkCost"]
+
+# Work-based tour purpose; these start at the workstaz
+WORKBASED = 6
+
+# set by initWorker in each worker process
+workerSkims = None
+
+def initWorker(skimdir, type):
+    """
+    Opens the skims in a worker process.
+    """
+    global workerSkims
+    workerSkims = openSkims(skimdir, type)
+
+def openSkims(skimdir, type):
+    """
+    Returns the SkimUtil for the given record *type*.
+    """
+    if type == "TOURMC":
+        return SkimUtil(skimdir, skimtype="tour", trnskims=TOURSKIMS)
+    return SkimUtil(skimdir)
+
+def readChunk(table, start, stop):
+    """
+    Returns the records from *start* to *stop*, plus the one before *start* (if there is one)
+    so that trips can find the previous trip on their tour.
+    """
+    return table.read(max(start-1, 0), stop), (1 if start > 0 else 0)
+
+def tripAttrs(skims, recs, first):
+    """
+    Returns the skim attributes for the trip records *recs*, skipping the first *first* rows
+    (which are only there to be the previous trip).
+    """
+    # the time period of the previous trip on the same tour
+    sametour       = numpy.zeros(len(recs), dtype=bool)
+    sametour[1:]   = ((recs["hhid"][1:]   == recs["hhid"][:-1]) &
+                      (recs["persid"][1:] == recs["persid"][:-1]) &
+                      (recs["tour"][1:]   == recs["tour"][:-1]))
+    lasttimeperiod = recs["mOdt"].copy()
+    lasttimeperiod[1:][sametour[1:]] = recs["mOdt"][:-1][sametour[1:]]
+
+    recs           = recs[first:]
+    lasttimeperiod = lasttimeperiod[first:]
+    totalstops     = numpy.where(recs["mSegDir"]==1, recs["tnstopsb"], recs["tnstopsa"])
+    return skims.getTripTravelAttrs(recs["mChosenmode"], recs["mSegDir"], recs["mOtaz"], recs["mDtaz"],
+                                    recs["mOdt"], lasttimeperiod, recs["mcurrseg"], recs["paysToPark"],
+                                    recs["purpose"], totalstops, recs["todepart"], recs["tddepart"],
+                                    recs["primdest"], recs["randseed"], recs["tour"])
+
+def tourAttrs(skims, recs, first):
+    """
+    Returns the skim attributes for the tour records *recs*, skipping the first *first* rows.
+    The outbound and return attributes are added together, except parking cost, which is
+    for the whole tour.
+    """
+    recs   = recs[first:]
+    origin = numpy.where(recs["purpose"]==WORKBASED, recs["workstaz"], recs["homestaz"])
+    args   = (recs["paysToPark"], recs["purpose"], recs["todepart"], recs["tddepart"])
+    ob     = skims.getTourTravelAttrs(recs["tourmode"], 1, origin, recs["primdest"], recs["todepart"], *args)
+    ib     = skims.getTourTravelAttrs(recs["tourmode"], 2, recs["primdest"], origin, recs["tddepart"], *args)
+    return tuple(ob[i] + ib[i] for i in range(4)) + (ob[4],)
+
+def computeChunk(args):
+    """
+    Returns (start, tuple of the SKIMCOLS arrays) for the rows from *start* to *stop* of the
+    records table in *infilename*.  Runs in a worker, or in this process with *skims*.
+    """
+    (infilename, type, start, stop, skims) = args
+    infile = openFile(infilename, mode="r")
+    (recs, first) = readChunk(infile.root.records, start, stop)
+    infile.close()
+
+    if skims == None: skims = workerSkims
+    if type == "TOURMC":
+        return (start, tourAttrs(skims, recs, first))
+    return (start, tripAttrs(skims, recs, first))
+
+def addSkimAttributes(skimdir, type, infilename, outfilename, numWorkers=1, chunkRows=100000):
+    """
+    Writes the records of *infilename* with the SKIMCOLS added to *outfilename*.
+    """
+    starttime = time()
+
+    # make or check the temp transit skims once, before any workers use them
+    skims     = openSkims(skimdir, type)
+
+    infile    = openFile(infilename, mode="r")
+    intable   = infile.root.records
+    numrows   = intable.nrows
+
+    # the output description is the input one plus the skim columns
+    desc      = dict(intable.description._v_colObjects)
+    for colname in SKIMCOLS:
+        desc[colname] = Float32Col(pos=len(desc))
+
+    outfile   = openFile(outfilename, mode="w")
+    compfilt  = Filters(complevel=1,complib='zlib')
+    outtable  = outfile.createTable("/", "records", desc, intable.title, filters=compfilt, expectedrows=numrows)
+    outrows   = numpy.zeros(0, dtype=outtable.description._v_dtype)
+
+    chunks    = [(infilename, type, start, min(start+chunkRows, numrows), None)
+                 for start in range(0, numrows, chunkRows)]
+    if numWorkers > 1:
+        skims.close()   # the workers open their own
+        pool    = multiprocessing.Pool(processes=numWorkers, initializer=initWorker, initargs=(skimdir, type))
+        results = pool.imap(computeChunk, chunks)
+    else:
+        pool    = None
+        results = (computeChunk(chunk[:4] + (skims,)) for chunk in chunks)
+
+    # results come back in order, so append them as they arrive
+    rowsdone  = 0
+    for (start, attrs) in results:
+        recs    = intable.read(start, start+len(attrs[0]))
+        if len(outrows) != len(recs): outrows = numpy.zeros(len(recs), dtype=outtable.description._v_dtype)
+        for colname in recs.dtype.names:
+            outrows[colname] = recs[colname]
+        for (colname, values) in zip(SKIMCOLS, attrs):
+            outrows[colname] = values
+        outtable.append(outrows)
+        outtable.flush()
+
+        rowsdone += len(recs)
+        print strftime("%x %X", localtime()) + "%10d rows done" % (rowsdone)
+        sys.stdout.flush()
+
+    if pool:
+        pool.close()
+        pool.join()
+    skims.close()
+
+    infile.close()
+    outfile.close()
+
+    endtime   = time()
+    print "%10d rows written" % (rowsdone)
+    print "Completed at " + strftime("%x %X", localtime(endtime)) + "; took " + str((endtime-starttime)/60.0) + " mins"
+
+if __name__ == '__main__':
+
+    #### Parse options and arguments
+    type       = ""
+    numWorkers = 1
+    chunkRows  = 100000
+    optlist,args = getopt.getopt(sys.argv[1:],'t:j:c:')
+    for o,a in optlist:
+        if o=="-t":
+            type = a
+        elif o=="-j":
+            numWorkers = int(a)
+        elif o=="-c":
+            chunkRows = int(a)
+
+    if type != "TRIPMC" and type != "TOURMC":
+        print USAGE
+        print "Supported types include TRIPMC and TOURMC currently."
+        exit(1)
+
+    if (len(args) != 3):
+        print USAGE
+        exit(1)
+
+    print "SKIMDIR = " + args[0]
+    print "INFILE = " + args[1]
+    print "OUTFILE = " + args[2]
+    addSkimAttributes(args[0], type, args[1], args[2], numWorkers, chunkRows)
@@ -3,13 +3,16 @@
 '''Generic trip record class, plus some extra functions that will likely come up.
 '''
 
+import multiprocessing
 import os
 import random
 import re
+import struct
 import sys
+import threading
+from collections import OrderedDict, deque
 from time import time,localtime,strftime
 import numpy
-from dbfpy import dbf
 from tables import IsDescription,Int32Col,Float32Col,openFile,Float32Atom,Filters
 
 __author__ = "Lisa Zorn, San Francisco County Transportation Authority"
@@ -17,7 +20,8 @@ __license__= "GPL"
 __email__  = "lisa@sfcta.org"
 __date__   = "Jan 25, 2010"
 
-__all__ = [ 'readDistrictsEqv', 'createExpressionForValue', 'Trip', 'SkimUtil', 'TIMEPERIODS' ]
+__all__ = [ 'readDistrictsEqv', 'createExpressionForValue', 'tazMask', 'createRangeExpression',
+            'readRecordsInMask', 'Trip', 'SkimUtil', 'TIMEPERIODS' ]
 
 recordKeys = list()  # Callers can access these by importing these variables
 
@@ -82,6 +86,14 @@ TRNSKIMKEY      = { "ABW":{"IVT_LOC":1, "IVT_MUN":2, "IVT_PRE":3, "IVT_BAR":4, "
                            "TIM_WEG":6, "TIM_IWT":7, "TIM_XWT":8, "DIS_TRN":9, "FAR_TOT":10,
                            "BOR_TOT":11,"DIS_DRV":12,"TIM_AUX":13},
                 }
+# highway skim matrices for trip/tour modes 1-6: (time, distance, [tolls], toll divisor)
+# the divisor is for the 1989 cents to dollars conversion and the shared ride occupancy
+HWYSKIMMATS     = { 1:("1", "2", ["3"],       100.0),
+                    2:("4", "5", ["6"],       100.0*2.0),
+                    3:("7", "8", ["9"],       100.0*3.5),
+                    4:("10","11",["12","13"], 100.0),
+                    5:("14","15",["16","17"], 100.0*2.0),
+                    6:("18","19",["20","21"], 100.0*3.5) }
 TRN_TIMES = set(["IVT_LOC","IVT_MUN","IVT_PRE","IVT_BAR","TIM_DAC","TIM_WAC","TIM_DEG","TIM_WEG","TIM_IWT","TIM_XWT","TIM_AUX"])
 TRN_DISTS = set(["DIS_TRN","DIS_DRV"])
 TRN_COSTS = set(["FAR_TOT"])
@@ -106,6 +118,10 @@ DURATION_TOUR = [
                                 [     10.2,       8.7,     3.1,       0.5,     2.1],
                                 [      2.4,       6.8,     9.4,      13.8,     1.4] ]
 
+# the same, as arrays indexed by [todepart-1, tddepart-1]
+DURATION_TRIP_ARRAY = numpy.array(DURATION_TRIP)
+DURATION_TOUR_ARRAY = numpy.array(DURATION_TOUR)
+
 eqvline_re      = re.compile("^DIST (\d+)=(\d+)\s*((.+)\s*)?$")
 
 def readDistrictsEqv(eqvfile):
@@ -136,9 +152,10 @@ def createExpressionForValue(tazmapping, var, value):
     """
     Creates an expression for a var (e.g. workstaz) and a mapping value (e.g. Cupertino).
     tazmapping should be a dictionary mapping tazes to names (including the given value)
+    For districts with scattered TAZs, createRangeExpression(tazMask(...), var) is shorter.
     """
     retstr = '('
-    tazes = tazmapping.keys()
+    tazes = sorted(tazmapping.keys())
     gtlt  = 0
     for i in range(len(tazes)):
         taz = tazes[i]
@@ -163,6 +180,60 @@ def createExpressionForValue(tazmapping, var, value):
     retstr += ')'
     return retstr
 
+def tazMask(tazmapping, value, maxtaz=None):
+    """
+    Returns a boolean array indexed by TAZ that's True for the TAZs that *tazmapping* (a dictionary
+    mapping tazes to names or districts) maps to *value*.  The array covers TAZs up to *maxtaz*,
+    or the highest TAZ in the mapping.
+    """
+    if maxtaz == None: maxtaz = max(tazmapping.keys())
+    mask = numpy.zeros(maxtaz+1, dtype=bool)
+    mask[[taz for (taz, v) in tazmapping.iteritems() if v == value and taz <= maxtaz]] = True
+    return mask
+
+def tazRanges(mask):
+    """
+    Returns the list of (first taz, last taz) for each run of consecutive TAZs in the boolean *mask*.
+    """
+    edges  = numpy.diff(numpy.concatenate(([0], mask.astype(numpy.int8), [0])))
+    starts = numpy.nonzero(edges == 1)[0]
+    ends   = numpy.nonzero(edges == -1)[0] - 1
+    return zip(starts.tolist(), ends.tolist())
+
+def createRangeExpression(mask, var):
+    """
+    Creates a PyTables where() condition for a var (e.g. workstaz) being one of the TAZs in the
+    boolean *mask* (see tazMask), with one clause per run of consecutive TAZs.
+    """
+    clauses = []
+    for (first, last) in tazRanges(mask):
+        if first == last:
+            clauses.append('(%s == %d)' % (var, first))
+        else:
+            clauses.append('((%s >= %d) & (%s <= %d))' % (var, first, var, last))
+    if len(clauses) == 0: return '(%s < 0)' % var
+    return '(' + ' | '.join(clauses) + ')'
+
+def maskValues(mask, taz):
+    """
+    Returns mask[taz] for the array of TAZs *taz*, with False for TAZs outside the mask.
+    """
+    taz     = numpy.asarray(taz)
+    inmask  = (taz >= 0) & (taz < len(mask))
+    values  = numpy.zeros(len(taz), dtype=bool)
+    values[inmask] = mask[taz[inmask]]
+    return values
+
+def readRecordsInMask(table, var, mask, chunkRows=100000):
+    """
+    Generator yielding the records of *table* (e.g. the records table) with var in the boolean
+    TAZ *mask*, reading *chunkRows* rows at a time.  Unlike a where() condition there's nothing
+    to parse, so this is quick however scattered the TAZs are.
+    """
+    for start in range(0, table.nrows, chunkRows):
+        recs = table.read(start, min(start+chunkRows, table.nrows))
+        yield recs[maskValues(mask, recs[var])]
+
 
 class Trip(IsDescription):
     """
@@ -282,176 +353,567 @@ class Trip(IsDescription):
     recordKeys.append("tripTod");       tripTod     = Int32Col(pos=len(recordKeys))
     
 
+def readDbfColumns(dbffile, fieldnames):
+    """
+    Reads the numeric fields *fieldnames* from the DBF file *dbffile* all at once, rather than
+    record by record.  Returns a dictionary of fieldname -> float64 array; deleted records are
+    dropped and blank values are 0.
+    """
+    f = open(dbffile, "rb")
+    try:
+        header = f.read(32)
+        (numrecs, headerlen, reclen) = struct.unpack("<IHH", header[4:12])
+
+        # field descriptors, 32 bytes each, up to the 0x0D terminator
+        fields = [("deleted", "S1")]
+        for i in range((headerlen - 33) // 32):
+            desc = f.read(32)
+            if desc[0:1] == "\r": break
+            fields.append((desc[:11].split("\0")[0], "S%d" % ord(desc[16])))
+
+        f.seek(headerlen)
+        recs = numpy.fromfile(f, dtype=numpy.dtype(fields), count=numrecs)
+    finally:
+        f.close()
+
+    recs    = recs[recs["deleted"] != "*"]
+    columns = {}
+    for fieldname in fieldnames:
+        values = numpy.char.strip(recs[fieldname])
+        values[values == ""] = "0"
+        columns[fieldname] = values.astype(numpy.float64)
+    return columns
+
+def tazArray(taz, values, maxtaz=0):
+    """
+    Returns an array of *values* indexed by *taz*, so arr[taz] is the value for taz.
+    The array goes up to at least *maxtaz* (e.g. the number of zones in the skims), and
+    TAZs that aren't given get 0.
+    """
+    taz = numpy.asarray(taz, dtype=numpy.int64)
+    arr = numpy.zeros(max(taz.max() if len(taz) else 0, maxtaz)+1)
+    arr[taz] = values
+    return arr
+
+def mixBits(x):
+    """
+    The splitmix64 finalizer: scrambles the uint64 array *x*.
+    """
+    x = (x ^ (x >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return x ^ (x >> numpy.uint64(31))
+
+def tripRandom(randseed, tour, segdir, curr_seg):
+    """
+    Returns random numbers in [0,1) for trips, derived from the person's *randseed* and the trip's
+    *tour*, *segdir* and *curr_seg*, so a trip gets the same number however (and in whatever
+    order or process) the trips are processed.  Arguments may be arrays or scalars.
+    """
+    with numpy.errstate(over='ignore'):
+        x = numpy.asarray(randseed).astype(numpy.int64).astype(numpy.uint64)
+        for key in [tour, segdir, curr_seg]:
+            x = mixBits(x + numpy.uint64(0x9E3779B97F4A7C15)) ^ numpy.asarray(key).astype(numpy.int64).astype(numpy.uint64)
+        x = mixBits(x + numpy.uint64(0x9E3779B97F4A7C15))
+    return (x >> numpy.uint64(11)) * (1.0/(1 << 53))
+
+# Rows of each transit skim component read at a time by collapseTransitSkim
+COLLAPSE_ROWS = 256
+# Target chunk size for the temp transit skims
+TEMPSKIM_CHUNKBYTES = 64*1024
+# Most rows of a skim read at a time by SkimUtil.readSkimValues
+SKIM_READ_ROWS = 256
+# HDF5 usually isn't built thread-safe, so concurrent calls can crash even on separate file handles.
+# SkimUtil holds this around everything it does with the skim files.
+HDF5_LOCK = threading.RLock()
+
+def collapseTransitSkim(args):
+    """
+    Collapses a transit skim into total time, distance (including walk access and egress),
+    fare and drive distance matrices, summing the component matrices in memory.
+    *args* is (time period key, submode, transit skim filename, shape).
+    Returns (time period key, submode, dictionary of "time","dist","fare","drvdist" -> float32 array).
+    """
+    (tkey, sval, trnfile, shape) = args
+    trnskim   = openFile(trnfile, mode="r")
+    collapsed = {}
+    for attr in ["time", "dist", "fare", "drvdist"]:
+        collapsed[attr] = numpy.zeros(shape, dtype=numpy.float32)
+
+    # read the components a block of rows at a time so big zone systems don't need
+    # a full double precision copy of each one
+    for row in xrange(0, shape[0], COLLAPSE_ROWS):
+        rows = slice(row, min(row+COLLAPSE_ROWS, shape[0]))
+
+        def component(matnum):
+            return trnskim.root._f_getChild(str(matnum))[rows, 0:shape[1]]
+
+        # go through each of the matrices
+        for matname,matnum in TRNSKIMKEY[sval].iteritems():
+            if matname in TRN_TIMES:
+                collapsed["time"][rows] += component(matnum)
+            elif matname in TRN_DISTS:
+                collapsed["dist"][rows] += component(matnum)
+            elif matname in TRN_COSTS:
+                collapsed["fare"][rows] += component(matnum)
+
+        # operating cost from auto
+        if "DIS_DRV" in TRNSKIMKEY[sval]:
+            collapsed["drvdist"][rows] += component(TRNSKIMKEY[sval]["DIS_DRV"])
+
+        # walk egress and access times aren't included in the distance
+        for matname in ["TIM_WAC", "TIM_WEG"]:
+            if matname in TRNSKIMKEY[sval]:
+                collapsed["dist"][rows] += component(TRNSKIMKEY[sval][matname])*WALKSPEED/60.0
+
+    trnskim.close()
+    return (tkey, sval, collapsed)
+
+def imapBounded(pool, func, jobs, maxPending):
+    """
+    Like pool.imap(func, jobs), but with at most *maxPending* jobs submitted whose results haven't
+    been taken yet, so big results (like collapseTransitSkim's) don't pile up in this process.
+    """
+    pending = deque()
+    for job in jobs:
+        if len(pending) >= maxPending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (job,)))
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+class LockedMatrix(object):
+    """
+    Wraps a PyTables matrix *node* so that reading from it (by indexing) holds HDF5_LOCK.
+    """
+    def __init__(self, node):
+        self.node  = node
+        self.shape = node.shape
+
+    def __getitem__(self, key):
+        with HDF5_LOCK:
+            return self.node[key]
+
+def skimZones(filename):
+    """
+    Returns the number of zones in the H5 skim file *filename*, from its ``zones`` attribute
+    (see hdf5.H5Matrix).
+    """
+    h5file = openFile(filename, mode="r")
+    try:
+        zones = int(h5file.getNodeAttr('/','zones')[0])
+    finally:
+        h5file.close()
+    return zones
+
+def rowChunkShape(shape, itemsize=4):
+    """
+    Returns a chunk shape for a matrix of *shape* that holds whole rows, about TEMPSKIM_CHUNKBYTES
+    at a time, since skims are read by origin row.
+    """
+    rows = max(1, min(shape[0], TEMPSKIM_CHUNKBYTES // (itemsize*shape[1])))
+    return (rows, shape[1])
+
+
 class SkimUtil:
     """
     Helper class to read Skim files and lookup time/cost/distance for given O-D pairs.
     This class is written for low-memory, not for speed.  So it'll take forever to go
     through a trip file and do the skim lookups but you won't be hitting memory limits.
+    For many trips, use the array versions (e.g. getTripTravelAttrs), which read each
+    matrix once per time period and pick the O-D values out with fancy indexing.
     """
     
     def __init__(self, skimdir, useTempTrn = True,
-                 timeperiods=TIMEPERIODS.keys(), trnskims=TRIPSKIMS, skimtype="trip", skimprefix=""):
+                 timeperiods=TIMEPERIODS.keys(), trnskims=TRIPSKIMS, skimtype="trip", skimprefix="",
+                 cacheMB=0, tempTrnWorkers=1, zones=None):
         '''
-        Opens all the skim files for use.  skimtype="trip" or "tour".
+        Sets up the skims in *skimdir* for use.  skimtype="trip" or "tour".
+        The skim files are opened on first use, separately for each thread, so a SkimUtil can be
+        shared by a pool of threads; close() them when done, or use the SkimUtil in a with statement.
+        The file reads themselves are one at a time (see HDF5_LOCK); the lookups around them run in parallel.
         If makeTemp is specified, then makes temporary transit versions with just time/cost/distance. 
         timeperiods can be specified to limit the time periods loaded (an array of numbers).
         trnskims likewise.
+        Pass cacheMB to keep up to that many MB of the matrices used in memory (least recently used
+        go first); see pinSkim() to keep specific matrices in memory.
+        Pass tempTrnWorkers to make the temporary transit skims with that many processes.
         Note: tazdata.dbf is also read from the skimdir.
+        The number of zones comes from the first time period's HWYALL skim the first time it's
+        needed (see getMaxTAZnum()), unless it's passed as *zones*.
         '''
-        self.skimtype = skimtype
+        self.skimtype       = skimtype
+        self.skimdir        = skimdir
+        self.skimprefix     = skimprefix
+        self.threadFiles    = threading.local()     # .files is this thread's filename -> open file
+        self.openFiles      = []                    # every thread's open files, for close()
+        self.fileLock       = threading.Lock()
+        self.zones          = zones
+        self.zoneTimeperiod = sorted(timeperiods)[0]
+        self.cacheBytes     = cacheMB*1024*1024
+        self.skimCache      = OrderedDict()     # (skimtype, timeperiod, matname) -> float32 array, oldest first
+        self.skimCacheUsed  = 0
+        self.pinnedSkims    = set()
+        self.cacheLock      = threading.RLock()
+        self.useTempTrn     = useTempTrn
         if useTempTrn:
-            self.useTempTrn = True
             if skimtype=="trip":
                 self.tempTrnFile = os.path.join(skimdir, "TRN_temp.h5")
             else:
                 self.tempTrnFile = os.path.join(skimdir, "TRN_tourtemp.h5")
 
-            self.trnDist = { 1:{}, 2:{}, 3:{}, 4:{}, 5:{} }
-            self.trnTime = { 1:{}, 2:{}, 3:{}, 4:{}, 5:{} }
-            self.trnFare = { 1:{}, 2:{}, 3:{}, 4:{}, 5:{} } # fare
-            self.trnDrvDist = { 1:{}, 2:{}, 3:{}, 4:{}, 5:{} } # opcost
             self.filters = Filters(complevel=5, complib='zlib')
-            self.shape = (2475, 2475) # todo: base this on the skim file
             self.atom = Float32Atom()
             self.tempTrnFileExists = False
             if os.path.exists(self.tempTrnFile):
-                print "Using existing temp transit skim %s" % (self.tempTrnFile)
-                self.tempTrnFileExists = True
                 self.trnTemp = openFile(self.tempTrnFile, 'r')
-            else:
+                if self.tempSkimsComplete(timeperiods, trnskims):
+                    print "Using existing temp transit skim %s" % (self.tempTrnFile)
+                    self.tempTrnFileExists = True
+                self.trnTemp.close()
+                if not self.tempTrnFileExists:
+                    print "Existing temp transit skim %s is incomplete; remaking it" % (self.tempTrnFile)
+            if not self.tempTrnFileExists:
                 self.trnTemp = openFile(self.tempTrnFile, 'w')
-        else:
-            self.trnTemp = False
-            
-        self.skimdir         = skimdir
-        self.trnskims        = { 1:{}, 2:{}, 3:{}, 4:{}, 5:{} }
-        self.hwyskims        = { 1:{}, 2:{}, 3:{}, 4:{}, 5:{} }
-        for tkey in timeperiods:
-            for sval in trnskims:
-                if sval not in self.trnskims[tkey]:
-                    if useTempTrn and self.tempTrnFileExists:
-                        self.readTempSkims(tkey,TIMEPERIODS[tkey],sval)
-                    else:
-                        # open skims
-                        self.trnskims[tkey][sval] = openFile(os.path.join(skimdir,skimprefix+"TRN" + sval + TIMEPERIODS[tkey] + ".h5"),mode="r")
-                    
-                        if useTempTrn:
-                            self.makeTempSkims(tkey,TIMEPERIODS[tkey],sval)
-                            # we're done with the big-skim - close it
-                            self.trnskims[tkey][sval].close()
-                            del self.trnskims[tkey][sval]
-        
-            self.hwyskims[tkey] = openFile(os.path.join(skimdir,skimprefix+"HWYALL" + TIMEPERIODS[tkey] + ".h5"), mode="r")
+                self.makeTempSkims(skimdir, skimprefix, timeperiods, trnskims, tempTrnWorkers)
+                self.trnTemp.close()
 
-        # print trnskims[3]["APW"].root._f_getChild("1")[0,:]
-        self.nonmotskims     = openFile(os.path.join(skimdir,"NONMOT.h5"), mode="r")
-        self.termtime        = openFile(os.path.join(skimdir,"OPTERM.h5"), mode="r")
-        
-        # read tazdata for parking costs
-        tazdatadbf    = dbf.Dbf(os.path.join(skimdir,"tazdata.dbf"), readOnly=True, new=False)
-        self.prkcstwh  = {}
-        self.prkcstoh  = {}
-        self.ppaying   = {}
+        # read tazdata for parking costs; see tazdataArray()
         print "Reading tazdata.dbf"
-        for rec in tazdatadbf:
-            self.prkcstwh[rec["SFTAZ"]] = rec["PRKCSTWH"]
-            self.prkcstoh[rec["SFTAZ"]] = rec["PRKCSTOH"]
-            self.ppaying[rec["SFTAZ"]]  = rec["PPAYING"]
-        tazdatadbf.close()
-        
-        if useTempTrn and not self.tempTrnFileExists: self.trnTemp.flush()
+        self.tazdata   = readDbfColumns(os.path.join(skimdir,"tazdata.dbf"), ["SFTAZ", "PRKCSTWH", "PRKCSTOH", "PPAYING"])
+        self.tazArrays = {}
 
         print "SkimUtil initialized for %s" % (skimdir)
-    
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def __del__(self):
         """
         Close the skim files we opened
         """
-        if self.trnTemp:
-            self.trnTemp.close()
-        else:
-           for tkey in self.trnskims.iterkeys():
-                for skey in self.trnskims[tkey].iterkeys():
-                    self.trnskims[tkey][skey].close()
-                self.trnskims[tkey].clear()
+        if hasattr(self, "openFiles"): self.close()
 
-        for key in self.hwyskims.keys():
-            self.hwyskims[key].close()
-        
-        self.nonmotskims.close()
-        self.termtime.close()
+    def close(self):
+        """
+        Closes the skim files opened by every thread.  They're reopened if the SkimUtil is used again.
+        """
+        with HDF5_LOCK:
+            with self.fileLock:
+                for h5file in self.openFiles:
+                    if h5file.isopen: h5file.close()
+                del self.openFiles[:]
 
-                
-    def readTempSkims(self, tkey, tval, sval):
-        ''' tkey is for timeperiod, one of 1,2,3,4,5
-            sval is for the submode, one of ABW, WPA, etc
-        '''
-        self.trnDist[tkey][sval] = self.trnTemp.root._f_getChild(sval + tval + "_dist")
-        self.trnTime[tkey][sval] = self.trnTemp.root._f_getChild(sval + tval + "_time")
-        self.trnFare[tkey][sval] = self.trnTemp.root._f_getChild(sval + tval + "_fare")
-        self.trnDrvDist[tkey][sval] = self.trnTemp.root._f_getChild(sval + tval + "_drvdist")
-        
-    def makeTempSkims(self, tkey, tval, sval):
-        ''' tkey is for timeperiod, one of 1,2,3,4,5
-            sval is for the submode, one of ABW, WPA, etc
+    def skimFilename(self, skimtype, timeperiod=None):
+        """
+        Returns the file for the given *skimtype* (see :py:meth:`skimMatrix`) and *timeperiod*.
+        """
+        if skimtype == "HWY":
+            return os.path.join(self.skimdir, self.skimprefix+"HWYALL" + TIMEPERIODS[timeperiod] + ".h5")
+        if skimtype == "NONMOT":
+            return os.path.join(self.skimdir, "NONMOT.h5")
+        if skimtype == "TERM":
+            return os.path.join(self.skimdir, "OPTERM.h5")
+        if skimtype == "TRN":
+            if not self.useTempTrn:
+                raise Exception("Transit skim attributes need the temp transit skims (useTempTrn)")
+            return self.tempTrnFile
+        raise Exception("Unknown skim type %s" % str(skimtype))
+
+    def skimFile(self, filename):
+        """
+        Returns this thread's open handle on *filename*, opening it if needed.
+        """
+        files = getattr(self.threadFiles, "files", None)
+        if files == None:
+            files = self.threadFiles.files = {}
+        if filename not in files or not files[filename].isopen:
+            with HDF5_LOCK:
+                h5file = openFile(filename, mode="r")
+            with self.fileLock:
+                self.openFiles.append(h5file)
+            files[filename] = h5file
+        return files[filename]
+
+    def tempSkimsComplete(self, timeperiods, trnskims):
+        """
+        Returns True if the open temp transit skim file's manifest (written when it's finished)
+        includes all of the given time periods and transit skims.
+        """
+        if "TEMPSKIMS" not in self.trnTemp.root._v_attrs._v_attrnames: return False
+        manifest = set(self.trnTemp.root._v_attrs.TEMPSKIMS)
+        for tkey in timeperiods:
+            for sval in trnskims:
+                if sval + TIMEPERIODS[tkey] not in manifest: return False
+        zones = self.tempTrnZones(self.skimdir, self.skimprefix, timeperiods, trnskims)
+        return int(self.trnTemp.getNodeAttr('/','zones')[0]) == zones
+
+    def tempTrnZones(self, skimdir, skimprefix, timeperiods, trnskims):
+        """
+        Returns the number of zones for the temp transit skims: getMaxTAZnum() if it's known already,
+        and otherwise that of the first transit skim they're made from, so the HWYALL skim isn't
+        opened just for this.
+        """
+        if self.zones != None: return self.zones
+        return skimZones(os.path.join(skimdir, skimprefix+"TRN" + trnskims[0] + TIMEPERIODS[sorted(timeperiods)[0]] + ".h5"))
+
+    def makeTempSkims(self, skimdir, skimprefix, timeperiods, trnskims, numWorkers=1):
+        ''' Makes the temporary transit skims, with just time/dist/fare/drvdist, for the given
+            time periods (1,2,3,4,5) and submodes (ABW, WPA, etc).  Each (time period, submode) is
+            collapsed in memory by collapseTransitSkim(), in *numWorkers* processes, and written once,
+            chunked by rows (see rowChunkShape()).  The manifest of what's in the file is written last.
+            At most *numWorkers* collapsed skims are waiting to be written at a time (see imapBounded()).
         '''
-        print strftime("%x %X", localtime()) + ": Making temp skim for %s %s" % (tval, sval)
-        self.trnDist[tkey][sval] = self.trnTemp.createCArray(self.trnTemp.root, sval + tval + "_dist", self.atom, self.shape, filters=self.filters)
-        self.trnTime[tkey][sval] = self.trnTemp.createCArray(self.trnTemp.root, sval + tval + "_time", self.atom, self.shape, filters=self.filters)
-        self.trnFare[tkey][sval] = self.trnTemp.createCArray(self.trnTemp.root, sval + tval + "_fare", self.atom, self.shape, filters=self.filters)
-        self.trnDrvDist[tkey][sval] = self.trnTemp.createCArray(self.trnTemp.root, sval + tval + "_drvdist", self.atom, self.shape, filters=self.filters)
-        
-        # zero it out
-        self.trnDist[tkey][sval][0:self.shape[0], 0:self.shape[1]] = numpy.zeros((self.shape[0],self.shape[1]))
-        self.trnTime[tkey][sval][0:self.shape[0], 0:self.shape[1]] = numpy.zeros((self.shape[0],self.shape[1]))
-        self.trnFare[tkey][sval][0:self.shape[0], 0:self.shape[1]] = numpy.zeros((self.shape[0],self.shape[1]))
-        self.trnDrvDist[tkey][sval][0:self.shape[0], 0:self.shape[1]] = numpy.zeros((self.shape[0],self.shape[1]))
+        zones      = self.tempTrnZones(skimdir, skimprefix, timeperiods, trnskims)
+        shape      = (zones, zones)
+        chunkshape = rowChunkShape(shape, self.atom.itemsize)
+        jobs = []
+        for tkey in timeperiods:
+            for sval in trnskims:
+                jobs.append((tkey, sval,
+                             os.path.join(skimdir,skimprefix+"TRN" + sval + TIMEPERIODS[tkey] + ".h5"),
+                             shape))
 
-        # go through each of the matrices
-        for matname,matnum in TRNSKIMKEY[sval].iteritems():
-            print strftime("%x %X", localtime()) + ":   %s" % (matname)
+        if numWorkers > 1:
+            pool    = multiprocessing.Pool(processes=numWorkers)
+            results = imapBounded(pool, collapseTransitSkim, jobs, numWorkers)
+        else:
+            pool    = None
+            results = (collapseTransitSkim(job) for job in jobs)
 
-            if matname in TRN_TIMES:
-                self.trnTime[tkey][sval][0:self.shape[0],0:self.shape[1]] = \
-                    self.trnTime[tkey][sval][0:self.shape[0], 0:self.shape[1]] + \
-                    self.trnskims[tkey][sval].root._f_getChild(str(matnum))[0:self.shape[0], 0:self.shape[1]]
-            elif matname in TRN_DISTS:
-                self.trnDist[tkey][sval][0:self.shape[0],0:self.shape[1]] = \
-                    self.trnDist[tkey][sval][0:self.shape[0], 0:self.shape[1]] + \
-                    self.trnskims[tkey][sval].root._f_getChild(str(matnum))[0:self.shape[0], 0:self.shape[1]]
-            elif matname in TRN_COSTS:
-                self.trnFare[tkey][sval][0:self.shape[0],0:self.shape[1]] = \
-                    self.trnFare[tkey][sval][0:self.shape[0], 0:self.shape[1]] + \
-                    self.trnskims[tkey][sval].root._f_getChild(str(matnum))[0:self.shape[0], 0:self.shape[1]]
-            else:
-                print "Ignoring %s" % (matname)
+        manifest = []
+        for (tkey, sval, collapsed) in results:
+            tval = TIMEPERIODS[tkey]
+            print strftime("%x %X", localtime()) + ": Writing temp skim for %s %s" % (tval, sval)
+            for attr in ["dist", "time", "fare", "drvdist"]:
+                carray = self.trnTemp.createCArray(self.trnTemp.root, sval + tval + "_" + attr, self.atom, shape,
+                                                   filters=self.filters, chunkshape=chunkshape)
+                carray[:] = collapsed[attr]
+            manifest.append(sval + tval)
 
-        # operating cost from auto
-        if "DIS_DRV" in TRNSKIMKEY[sval]:
-            matnum = TRNSKIMKEY[sval]["DIS_DRV"]
-            self.trnDrvDist[tkey][sval][0:self.shape[0],0:self.shape[1]] = \
-                self.trnDrvDist[tkey][sval][0:self.shape[0], 0:self.shape[1]] + \
-                self.trnskims[tkey][sval].root._f_getChild(str(matnum))[0:self.shape[0], 0:self.shape[1]]
+        if pool:
+            pool.close()
+            pool.join()
 
-        # walk egress and access times aren't included in the distance
-        if "TIM_WAC" in TRNSKIMKEY[sval]:
-            matnum = TRNSKIMKEY[sval]["TIM_WAC"]
-            print "TIM_WAC before: tkey=%d tval=%s sval=%s trnDIST[1255,22] = %d" % (tkey, tval, sval, self.trnDist[tkey][sval][1254,21])
-            self.trnDist[tkey][sval][0:self.shape[0],0:self.shape[1]] = \
-                self.trnDist[tkey][sval][0:self.shape[0], 0:self.shape[1]] + \
-                (self.trnskims[tkey][sval].root._f_getChild(str(matnum))[0:self.shape[0], 0:self.shape[1]]*WALKSPEED/60.0)
-            print "TIM_WAC after: tkey=%d tval=%s sval=%s trnDIST[1255,22] = %d" % (tkey, tval, sval, self.trnDist[tkey][sval][1254,21])
-
-        if "TIM_WEG" in TRNSKIMKEY[sval]:
-            matnum = TRNSKIMKEY[sval]["TIM_WEG"]
-            print "TIM_WEG before: tkey=%d tval=%s sval=%s trnDIST[1255,22] = %d" % (tkey, tval, sval, self.trnDist[tkey][sval][1254,21])
-            self.trnDist[tkey][sval][0:self.shape[0],0:self.shape[1]] = \
-                self.trnDist[tkey][sval][0:self.shape[0], 0:self.shape[1]] + \
-                (self.trnskims[tkey][sval].root._f_getChild(str(matnum))[0:self.shape[0], 0:self.shape[1]]*WALKSPEED/60.0)
-            print "TIM_WEG after: tkey=%d tval=%s sval=%s trnDIST[1255,22] = %d" % (tkey, tval, sval, self.trnDist[tkey][sval][1254,21])
+        self.trnTemp.setNodeAttr('/','zones', numpy.array([zones], numpy.int32))
+        self.trnTemp.root._v_attrs.TEMPSKIMS = sorted(manifest)
+        self.trnTemp.flush()
 
     def getMaxTAZnum(self):
-        return self.shape[0]
+        """
+        Returns the number of zones, reading it from the first time period's HWYALL skim the first time.
+        """
+        if self.zones == None:
+            with HDF5_LOCK:
+                self.zones = skimZones(self.skimFilename("HWY", self.zoneTimeperiod))
+        return self.zones
+
+    shape = property(lambda self: (self.getMaxTAZnum(), self.getMaxTAZnum()))
+
+    def tazdataArray(self, field):
+        """
+        Returns the tazdata *field* as an array indexed by SFTAZ, covering all of the skim zones (those
+        not in tazdata are zero).  It's made on first use, since it needs the number of zones.
+        """
+        if field not in self.tazArrays:
+            self.tazArrays[field] = tazArray(self.tazdata["SFTAZ"], self.tazdata[field], self.getMaxTAZnum())
+        return self.tazArrays[field]
+
+    # parking costs and share of drivers paying, by SFTAZ
+    prkcstwh = property(lambda self: self.tazdataArray("PRKCSTWH"))
+    prkcstoh = property(lambda self: self.tazdataArray("PRKCSTOH"))
+    ppaying  = property(lambda self: self.tazdataArray("PPAYING"))
+
+    def skimMatrix(self, skimtype, timeperiod, matname):
+        """
+        Returns the matrix *matname* (which can be indexed like a numpy array) for the given *skimtype*:
+          * "HWY" for HWYALL, "NONMOT" or "TERM" (for OPTERM), where *matname* is the matrix number as a string
+          * "TRN" for the temp transit skims, where *matname* is (skim, attribute), e.g. ("WBW","time");
+            attribute is one of "time", "dist", "fare" or "drvdist"
+        *timeperiod* is only used for HWY and TRN.
+        If the cache is on, the matrix is returned from (or loaded into) memory.
+        """
+        key = (skimtype, timeperiod, matname)
+        if self.cacheBytes <= 0 and not self.pinnedSkims:
+            return self.skimFileMatrix(skimtype, timeperiod, matname)
+
+        with self.cacheLock:
+            if key in self.skimCache:
+                matrix = self.skimCache.pop(key)
+                self.skimCache[key] = matrix    # most recently used
+                return matrix
+
+            matrix = self.skimFileMatrix(skimtype, timeperiod, matname)
+            if self.cacheBytes > 0:
+                return self.cacheSkim(key, matrix)
+            return matrix
+
+    def cacheSkim(self, key, matrix):
+        """
+        Loads *matrix* into the cache as a float32 array under *key*, evicting the least recently used
+        unpinned matrices to stay within the budget.  Returns the array, or *matrix* if it doesn't fit.
+        """
+        matrixBytes = numpy.dtype(numpy.float32).itemsize*numpy.prod(matrix.shape)
+        if key not in self.pinnedSkims:
+            pinnedUsed = sum([array.nbytes for (k, array) in self.skimCache.iteritems() if k in self.pinnedSkims])
+            if pinnedUsed + matrixBytes > self.cacheBytes:
+                return matrix
+            self.evictSkims(matrixBytes)
+
+        array = numpy.array(matrix[:], dtype=numpy.float32)
+        self.skimCache[key]  = array
+        self.skimCacheUsed  += array.nbytes
+        return array
+
+    def evictSkims(self, neededBytes=0):
+        """
+        Evicts the least recently used unpinned matrices until *neededBytes* more fit in the budget.
+        """
+        for oldkey in [key for key in self.skimCache.keys() if key not in self.pinnedSkims]:
+            if self.skimCacheUsed + neededBytes <= self.cacheBytes: break
+            self.skimCacheUsed -= self.skimCache.pop(oldkey).nbytes
+
+    def pinSkim(self, skimtype, timeperiod, matname):
+        """
+        Loads the matrix (see :py:meth:`skimMatrix` for the arguments) into memory and keeps it there
+        until :py:meth:`unpinSkim`, whatever the cache budget.
+        """
+        key = (skimtype, timeperiod, matname)
+        with self.cacheLock:
+            self.pinnedSkims.add(key)
+            if key not in self.skimCache:
+                self.cacheSkim(key, self.skimFileMatrix(skimtype, timeperiod, matname))
+
+    def unpinSkim(self, skimtype, timeperiod, matname):
+        """
+        Lets the matrix be evicted from the cache like any other.
+        """
+        with self.cacheLock:
+            self.pinnedSkims.discard((skimtype, timeperiod, matname))
+            self.evictSkims()
+
+    def skimFileMatrix(self, skimtype, timeperiod, matname):
+        """
+        Like :py:meth:`skimMatrix`, but always returns the matrix in the file (as a :py:class:`LockedMatrix`).
+        """
+        h5file = self.skimFile(self.skimFilename(skimtype, timeperiod))
+        if skimtype == "TRN":
+            (skimname, attr) = matname
+            matname = skimname + TIMEPERIODS[timeperiod] + "_" + attr
+        with HDF5_LOCK:
+            return LockedMatrix(h5file.root._f_getChild(matname))
+
+    def readSkimValues(self, matrix, rows, cols):
+        """
+        Returns matrix[rows, cols] for the arrays of zero-based *rows* and *cols*, as a float64 array.
+        Only the distinct rows are read from the file, in runs of consecutive rows (at most
+        SKIM_READ_ROWS at a time), and the values are picked out of each run.
+        """
+        if isinstance(matrix, numpy.ndarray): return matrix[rows, cols].astype(numpy.float64)
+
+        values     = numpy.zeros(len(rows))
+        order      = numpy.argsort(rows, kind='mergesort')
+        sortedRows = rows[order]
+        distinct   = numpy.unique(sortedRows)
+        for run in numpy.split(distinct, numpy.nonzero(numpy.diff(distinct) != 1)[0] + 1):
+            for first in range(0, len(run), SKIM_READ_ROWS):
+                start = run[first]
+                stop  = run[min(first+SKIM_READ_ROWS, len(run))-1] + 1
+                block = numpy.asarray(matrix[start:stop, :])
+                recs  = order[numpy.searchsorted(sortedRows, start):numpy.searchsorted(sortedRows, stop)]
+                values[recs] = block[rows[recs] - start, cols[recs]]
+        return values
+
+    def lookupSkimArray(self, skimtype, matname, otaz, dtaz, timeperiod=None):
+        """
+        Batch lookup of the matrix from :py:meth:`skimMatrix` for the arrays *otaz* and *dtaz* (and
+        *timeperiod*, for HWY and TRN skims).  There's one read per time period.
+        """
+        if timeperiod is None:
+            return self.readSkimValues(self.skimMatrix(skimtype, None, matname), otaz-1, dtaz-1)
+
+        values = numpy.zeros(len(otaz))
+        for tp in numpy.unique(timeperiod):
+            sel = (timeperiod == tp)
+            values[sel] = self.readSkimValues(self.skimMatrix(skimtype, tp, matname), otaz[sel]-1, dtaz[sel]-1)
+        return values
+
+    def batchArrays(self, *args):
+        """
+        Returns the args as equal-length int64 arrays; scalars are repeated.
+        """
+        return [numpy.array(arg, dtype=numpy.int64) for arg in numpy.broadcast_arrays(*args)]
+
+    def termTimes(self, segdir, otaz, dtaz):
+        """
+        Batch terminal times from OPTERM; oriented by *segdir*, and zero for zones outside it (e.g. PNR zones).
+        """
+        termtime  = numpy.zeros(len(otaz))
+        numzones  = self.skimMatrix("TERM", None, "1").shape[0]
+        inside    = (otaz < numzones) & (dtaz < numzones)
+        outbound  = inside & (segdir == 1)
+        inbound   = inside & (segdir != 1)
+        termtime[outbound] = self.lookupSkimArray("TERM", "1", otaz[outbound], dtaz[outbound])
+        termtime[inbound]  = self.lookupSkimArray("TERM", "1", dtaz[inbound],  otaz[inbound])
+        return termtime
+
+    def roadwayAttrs(self, mode, segdir, otaz, dtaz, timeperiod):
+        """
+        Batch roadway (modes 1-6) distance, time (with terminal time) and tolls, for the arrays of arguments.
+        Like the scalar versions, modes 1-3 without a distance use the toll-paying version instead.
+        Returns (d, t, f) arrays.
+        """
+        mode = mode.copy()
+        for m in [1,2,3]:
+            sel = (mode == m)
+            if not sel.any(): continue
+            d = self.lookupSkimArray("HWY", HWYSKIMMATS[m][1], otaz[sel], dtaz[sel], timeperiod[sel])
+            mode[numpy.nonzero(sel)[0][d < 0.01]] += 3
+
+        (d, t, f) = (numpy.zeros(len(mode)), numpy.zeros(len(mode)), numpy.zeros(len(mode)))
+        for m in [1,2,3,4,5,6]:
+            sel = (mode == m)
+            if not sel.any(): continue
+            (timemat, distmat, tollmats, tolldivisor) = HWYSKIMMATS[m]
+            t[sel] = self.lookupSkimArray("HWY", timemat, otaz[sel], dtaz[sel], timeperiod[sel])
+            d[sel] = self.lookupSkimArray("HWY", distmat, otaz[sel], dtaz[sel], timeperiod[sel])
+            for tollmat in tollmats:
+                f[sel] += self.lookupSkimArray("HWY", tollmat, otaz[sel], dtaz[sel], timeperiod[sel])
+            f[sel] /= tolldivisor
+        t += self.termTimes(segdir, otaz, dtaz)
+        return (d, t, f)
+
+    def checkSkimMap(self, skimmap, mode, segdir):
+        """
+        Raises a KeyError for the first (mode, segdir) of the arrays that isn't in *skimmap*, like
+        the scalar versions do, rather than leaving those trips with zeros.
+        """
+        mapped = numpy.zeros(len(mode), dtype=bool)
+        for (m, sd) in skimmap.iterkeys():
+            mapped |= (mode == m) & (segdir == sd)
+        if not mapped.all():
+            first = numpy.nonzero(numpy.logical_not(mapped))[0][0]
+            raise KeyError((int(mode[first]), int(segdir[first])))
+
+    def transitAttrs(self, skimmap, mode, segdir, otaz, dtaz, timeperiod):
+        """
+        Batch transit lookups from the temp skims for the arrays of arguments, using *skimmap*
+        (TRIPTRNSKIMMAP or TOURTRNSKIMMAP).  Returns (d, t, f, drvdist) arrays, in the skim units.
+        """
+        if not self.useTempTrn:
+            raise Exception("Transit skim lookups are only implemented with useTempTrn")
+        self.checkSkimMap(skimmap, mode, segdir)
+        (d, t, f, drvdist) = (numpy.zeros(len(mode)), numpy.zeros(len(mode)), numpy.zeros(len(mode)), numpy.zeros(len(mode)))
+        for ((m, sd), skimname) in skimmap.iteritems():
+            sel = (mode == m) & (segdir == sd)
+            if not sel.any(): continue
+            d[sel]       = self.lookupSkimArray("TRN", (skimname,"dist"),    otaz[sel], dtaz[sel], timeperiod[sel])
+            t[sel]       = self.lookupSkimArray("TRN", (skimname,"time"),    otaz[sel], dtaz[sel], timeperiod[sel])
+            f[sel]       = self.lookupSkimArray("TRN", (skimname,"fare"),    otaz[sel], dtaz[sel], timeperiod[sel])
+            drvdist[sel] = self.lookupSkimArray("TRN", (skimname,"drvdist"), otaz[sel], dtaz[sel], timeperiod[sel])
+        return (d, t, f, drvdist)
         
     def getTripTravelTime(self, tripmode, segdir, otaz, dtaz, timeperiod):
         """
@@ -460,36 +922,36 @@ class SkimUtil:
         """
         if tripmode <= 6:
             # this is ok because of the PNR zones            
-            if (otaz >= self.termtime.root._f_getChild("1").shape[0] or
-                dtaz >= self.termtime.root._f_getChild("1").shape[0]):
+            if (otaz >= self.skimMatrix("TERM", None, "1").shape[0] or
+                dtaz >= self.skimMatrix("TERM", None, "1").shape[0]):
                 termtime = 0               
             elif segdir == 1:
-                termtime = self.termtime.root._f_getChild("1")[otaz-1][dtaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[otaz-1][dtaz-1]
             else:
-                termtime = self.termtime.root._f_getChild("1")[dtaz-1][otaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[dtaz-1][otaz-1]
             
             if tripmode == 1:
-                return self.hwyskims[timeperiod].root._f_getChild("1")[otaz-1,dtaz-1] + termtime
+                return self.skimMatrix("HWY", timeperiod, "1")[otaz-1,dtaz-1] + termtime
             if tripmode == 2:
-                return self.hwyskims[timeperiod].root._f_getChild("4")[otaz-1,dtaz-1] + termtime
+                return self.skimMatrix("HWY", timeperiod, "4")[otaz-1,dtaz-1] + termtime
             if tripmode == 3:
-                return self.hwyskims[timeperiod].root._f_getChild("7")[otaz-1,dtaz-1] + termtime
+                return self.skimMatrix("HWY", timeperiod, "7")[otaz-1,dtaz-1] + termtime
             if tripmode == 4:
-                return self.hwyskims[timeperiod].root._f_getChild("10")[otaz-1,dtaz-1] + termtime
+                return self.skimMatrix("HWY", timeperiod, "10")[otaz-1,dtaz-1] + termtime
             if tripmode == 5:
-                return self.hwyskims[timeperiod].root._f_getChild("14")[otaz-1,dtaz-1] + termtime
+                return self.skimMatrix("HWY", timeperiod, "14")[otaz-1,dtaz-1] + termtime
             if tripmode == 6:
-                return self.hwyskims[timeperiod].root._f_getChild("18")[otaz-1,dtaz-1] + termtime
+                return self.skimMatrix("HWY", timeperiod, "18")[otaz-1,dtaz-1] + termtime
             
         if tripmode == 10:
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return d/WALKSPEED
         if (tripmode == 11):
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return d/BIKESPEED
 
         if tripmode >= 12:
-            return self.trnTime[timeperiod][TRIPTRNSKIMMAP[(tripmode,segdir)]][otaz-1,dtaz-1]/100.0
+            return self.skimMatrix("TRN", timeperiod, (TRIPTRNSKIMMAP[(tripmode,segdir)],"time"))[otaz-1,dtaz-1]/100.0
 
         return 0
     
@@ -501,25 +963,25 @@ class SkimUtil:
         if tripmode <= 6:
             
             if tripmode == 1:
-                return self.hwyskims[timeperiod].root._f_getChild("2")[otaz-1,dtaz-1]
+                return self.skimMatrix("HWY", timeperiod, "2")[otaz-1,dtaz-1]
             if tripmode == 2:
-                return self.hwyskims[timeperiod].root._f_getChild("5")[otaz-1,dtaz-1]
+                return self.skimMatrix("HWY", timeperiod, "5")[otaz-1,dtaz-1]
             if tripmode == 3:
-                return self.hwyskims[timeperiod].root._f_getChild("8")[otaz-1,dtaz-1]
+                return self.skimMatrix("HWY", timeperiod, "8")[otaz-1,dtaz-1]
             if tripmode == 4:
-                return self.hwyskims[timeperiod].root._f_getChild("11")[otaz-1,dtaz-1]
+                return self.skimMatrix("HWY", timeperiod, "11")[otaz-1,dtaz-1]
             if tripmode == 5:
-                return self.hwyskims[timeperiod].root._f_getChild("15")[otaz-1,dtaz-1]
+                return self.skimMatrix("HWY", timeperiod, "15")[otaz-1,dtaz-1]
             if tripmode == 6:
-                return self.hwyskims[timeperiod].root._f_getChild("19")[otaz-1,dtaz-1]
+                return self.skimMatrix("HWY", timeperiod, "19")[otaz-1,dtaz-1]
             
         if tripmode == 10:
-            return self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            return self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
         if (tripmode == 11):
-            return self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            return self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
 
         if tripmode >= 12:
-            return self.trnDist[timeperiod][TRIPTRNSKIMMAP[(tripmode,segdir)]][otaz-1,dtaz-1]/100.0        # hundredths of miles
+            return self.skimMatrix("TRN", timeperiod, (TRIPTRNSKIMMAP[(tripmode,segdir)],"dist"))[otaz-1,dtaz-1]/100.0        # hundredths of miles
 
         return 0
     
@@ -531,20 +993,20 @@ class SkimUtil:
         """
        # Roadway                
         if tripmode == 1: # drive alone
-            return self.hwyskims[timeperiod].root._f_getChild("3")[otaz-1,dtaz-1]/100.0
+            return self.skimMatrix("HWY", timeperiod, "3")[otaz-1,dtaz-1]/100.0
         if tripmode == 2: # shared ride 2
-            return self.hwyskims[timeperiod].root._f_getChild("6")[otaz-1,dtaz-1]/(100.0*2.0)
+            return self.skimMatrix("HWY", timeperiod, "6")[otaz-1,dtaz-1]/(100.0*2.0)
         if tripmode == 3: # shared ride 3
-            return self.hwyskims[timeperiod].root._f_getChild("9")[otaz-1,dtaz-1]/(100.0*3.5)          
+            return self.skimMatrix("HWY", timeperiod, "9")[otaz-1,dtaz-1]/(100.0*3.5)          
         if tripmode == 4: # toll-paying drive alone
-            return  (self.hwyskims[timeperiod].root._f_getChild("12")[otaz-1,dtaz-1] + \
-                     self.hwyskims[timeperiod].root._f_getChild("13")[otaz-1,dtaz-1])/100.0
+            return  (self.skimMatrix("HWY", timeperiod, "12")[otaz-1,dtaz-1] + \
+                     self.skimMatrix("HWY", timeperiod, "13")[otaz-1,dtaz-1])/100.0
         if tripmode == 5: # toll-paying SR2
-            return (self.hwyskims[timeperiod].root._f_getChild("16")[otaz-1,dtaz-1] + \
-                    self.hwyskims[timeperiod].root._f_getChild("17")[otaz-1,dtaz-1])/(100.0*2.0)
+            return (self.skimMatrix("HWY", timeperiod, "16")[otaz-1,dtaz-1] + \
+                    self.skimMatrix("HWY", timeperiod, "17")[otaz-1,dtaz-1])/(100.0*2.0)
         if tripmode == 6: # toll-paying SR3
-            return (self.hwyskims[timeperiod].root._f_getChild("20")[otaz-1,dtaz-1] + \
-                    self.hwyskims[timeperiod].root._f_getChild("21")[otaz-1,dtaz-1])/(100.0*3.5)
+            return (self.skimMatrix("HWY", timeperiod, "20")[otaz-1,dtaz-1] + \
+                    self.skimMatrix("HWY", timeperiod, "21")[otaz-1,dtaz-1])/(100.0*3.5)
         if tripmode <= 9:
             print "Don't know how to handle mode " + str(tripmode)
             return (0,0,0,0,0)       
@@ -555,7 +1017,7 @@ class SkimUtil:
             return 0
         
         skimname = TRIPTRNSKIMMAP[(tripmode,segdir)]
-        return self.trnFare[timeperiod][skimname][otaz-1,dtaz-1]
+        return self.skimMatrix("TRN", timeperiod, (skimname,"fare"))[otaz-1,dtaz-1]
 
 
     def getTourTravelAttr(self, tourmode, segdir, otaz, dtaz, timeperiod,
@@ -573,13 +1035,13 @@ class SkimUtil:
         # some roadway specific stuff
         if tourmode <= 6:
             # this is ok because of the PNR zones
-            if (otaz >= self.termtime.root._f_getChild("1").shape[0] or
-                dtaz >= self.termtime.root._f_getChild("1").shape[0]):
+            if (otaz >= self.skimMatrix("TERM", None, "1").shape[0] or
+                dtaz >= self.skimMatrix("TERM", None, "1").shape[0]):
                 termtime = 0            
             elif segdir == 1:
-                termtime = self.termtime.root._f_getChild("1")[otaz-1][dtaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[otaz-1][dtaz-1]
             else:
-                termtime = self.termtime.root._f_getChild("1")[dtaz-1][otaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[dtaz-1][otaz-1]
         
             tdur = DURATION_TOUR[todepart-1][tddepart-1]
             tdur = min(tdur, 8.0)
@@ -593,18 +1055,18 @@ class SkimUtil:
             trippkcst = pkcst*tdur
             
         if tourmode == 1: # drive alone
-            t = self.hwyskims[timeperiod].root._f_getChild("1")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("2")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("3")[otaz-1,dtaz-1]/100.0
+            t = self.skimMatrix("HWY", timeperiod, "1")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "2")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "3")[otaz-1,dtaz-1]/100.0
             opc = d*OPCOST
             if d < 0.01: # toll-paying?
                 tourmode += 3
             else:
                 return (d,t,f,opc,trippkcst)
         if tourmode == 2: # shared ride 2
-            t = self.hwyskims[timeperiod].root._f_getChild("4")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("5")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("6")[otaz-1,dtaz-1]/(100.0*2.0)
+            t = self.skimMatrix("HWY", timeperiod, "4")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "5")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "6")[otaz-1,dtaz-1]/(100.0*2.0)
             opc = d*OPCOST
             if d < 0.01: # toll-paying?
                 tourmode += 3
@@ -612,9 +1074,9 @@ class SkimUtil:
                 return (d,t,f,opc,trippkcst)
             
         if tourmode == 3: # shared ride 3
-            t = self.hwyskims[timeperiod].root._f_getChild("7")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("8")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("9")[otaz-1,dtaz-1]/(100.0*3.5)
+            t = self.skimMatrix("HWY", timeperiod, "7")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "8")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "9")[otaz-1,dtaz-1]/(100.0*3.5)
             opc = d*OPCOST
             if d < 0.01: # toll-paying?
                 tourmode += 3
@@ -622,33 +1084,33 @@ class SkimUtil:
                 return (d,t,f,opc,trippkcst)
             
         if tourmode == 4: # toll-paying drive alone
-            t = self.hwyskims[timeperiod].root._f_getChild("10")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("11")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("12")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("13")[otaz-1,dtaz-1])/100.0
+            t = self.skimMatrix("HWY", timeperiod, "10")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "11")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "12")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "13")[otaz-1,dtaz-1])/100.0
             opc = d*OPCOST
             return (d,t,f,opc,trippkcst)
         if tourmode == 5: # toll-paying SR2
-            t = self.hwyskims[timeperiod].root._f_getChild("14")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("15")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("16")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("17")[otaz-1,dtaz-1])/(100.0*2.0)
+            t = self.skimMatrix("HWY", timeperiod, "14")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "15")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "16")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "17")[otaz-1,dtaz-1])/(100.0*2.0)
             opc = d*OPCOST
             return (d,t,f,opc,trippkcst)
         if tourmode == 6: # toll-paying SR3
-            t = self.hwyskims[timeperiod].root._f_getChild("18")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("19")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("20")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("21")[otaz-1,dtaz-1])/(100.0*3.5)
+            t = self.skimMatrix("HWY", timeperiod, "18")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "19")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "20")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "21")[otaz-1,dtaz-1])/(100.0*3.5)
             opc = d*OPCOST
             return (d,t,f,opc,trippkcst)
 
         # Walk
         if tourmode == 7:
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return (d, (d/WALKSPEED)*60, 0, 0, 0);
         if (tourmode == 8):
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return (d, (d/BIKESPEED)*60, 0, 0, 0)
 
         # Transit
@@ -657,18 +1119,21 @@ class SkimUtil:
             raise
         
         skimname = TOURTRNSKIMMAP[(tourmode,segdir)]
-        d = self.trnDist[timeperiod][skimname][otaz-1,dtaz-1]              # hundredths of miles
-        f = self.trnFare[timeperiod][skimname][otaz-1,dtaz-1]              # cents
-        opc = self.trnDrvDist[timeperiod][skimname][otaz-1,dtaz-1]*OPCOST  # hundredths of miles x dollars = cents
-        t = self.trnTime[timeperiod][skimname][otaz-1,dtaz-1]              # hundredths of minutes
+        d = self.skimMatrix("TRN", timeperiod, (skimname,"dist"))[otaz-1,dtaz-1]              # hundredths of miles
+        f = self.skimMatrix("TRN", timeperiod, (skimname,"fare"))[otaz-1,dtaz-1]              # cents
+        opc = self.skimMatrix("TRN", timeperiod, (skimname,"drvdist"))[otaz-1,dtaz-1]*OPCOST  # hundredths of miles x dollars = cents
+        t = self.skimMatrix("TRN", timeperiod, (skimname,"time"))[otaz-1,dtaz-1]              # hundredths of minutes
             
         return (d/100.0, t/100.0, f/100.0, opc/100.0, 0)
         
     def getTripTravelAttr(self, tripmode, segdir, otaz, dtaz, timeperiod, lasttimeperiod,
-                            curr_seg, paysToPark, purpose, totalstops, todepart, tddepart, primdest):
+                            curr_seg, paysToPark, purpose, totalstops, todepart, tddepart, primdest,
+                            randseed=None, tour=0):
         """ Returns the distance, time, out-of-pocket cost (fares, bridge & value tolls), 
             operating cost, parking cost.  Units: miles, minutes, 1989 dollars.
             lasttimeperiod is the time of the last trip (same tour)
+            Pass the person's randseed and the tour number to reroll paysToPark with
+            tripRandom() rather than the random module, so the result is repeatable.
         """
 
         (d,t,f, opc, trippkcst) = (0,0,0,0,0)
@@ -678,13 +1143,13 @@ class SkimUtil:
         # some roadway specific stuff
         if tripmode <= 6:
             # this is ok because of the PNR zones
-            if (otaz >= self.termtime.root._f_getChild("1").shape[0] or
-                dtaz >= self.termtime.root._f_getChild("1").shape[0]):
+            if (otaz >= self.skimMatrix("TERM", None, "1").shape[0] or
+                dtaz >= self.skimMatrix("TERM", None, "1").shape[0]):
                 termtime = 0            
             elif segdir == 1:
-                termtime = self.termtime.root._f_getChild("1")[otaz-1][dtaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[otaz-1][dtaz-1]
             else:
-                termtime = self.termtime.root._f_getChild("1")[dtaz-1][otaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[dtaz-1][otaz-1]
 
             # based on persdata.cpp. Uses the duration at the last stop, it seems to me...
             if segdir == 1:
@@ -700,7 +1165,10 @@ class SkimUtil:
             # reroll paysToPark -- the passed one is for tours
             paysToPark = 0
             if purpose<=4:
-                rnum = random.random()
+                if randseed == None:
+                    rnum = random.random()
+                else:
+                    rnum = float(tripRandom(randseed, tour, segdir, curr_seg))
                 if rnum < self.ppaying[primdest]:
                     paysToPark = 1
             
@@ -732,18 +1200,18 @@ class SkimUtil:
                         
         # Roadway                
         if tripmode == 1: # drive alone
-            t = self.hwyskims[timeperiod].root._f_getChild("1")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("2")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("3")[otaz-1,dtaz-1]/100.0
+            t = self.skimMatrix("HWY", timeperiod, "1")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "2")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "3")[otaz-1,dtaz-1]/100.0
             opc = d*OPCOST
             if d < 0.01: # toll-paying?
                 tripmode += 3
             else:
                 return (d,t,f,opc,trippkcst)
         if tripmode == 2: # shared ride 2
-            t = self.hwyskims[timeperiod].root._f_getChild("4")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("5")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("6")[otaz-1,dtaz-1]/(100.0*2.0)
+            t = self.skimMatrix("HWY", timeperiod, "4")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "5")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "6")[otaz-1,dtaz-1]/(100.0*2.0)
             opc = d*OPCOST
             if d < 0.01: # toll-paying?
                 tripmode += 3
@@ -751,9 +1219,9 @@ class SkimUtil:
                 return (d,t,f,opc,trippkcst)
             
         if tripmode == 3: # shared ride 3
-            t = self.hwyskims[timeperiod].root._f_getChild("7")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("8")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("9")[otaz-1,dtaz-1]/(100.0*3.5)
+            t = self.skimMatrix("HWY", timeperiod, "7")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "8")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "9")[otaz-1,dtaz-1]/(100.0*3.5)
             opc = d*OPCOST
             if d < 0.01: # toll-paying?
                 tripmode += 3
@@ -761,24 +1229,24 @@ class SkimUtil:
                 return (d,t,f,opc,trippkcst)
             
         if tripmode == 4: # toll-paying drive alone
-            t = self.hwyskims[timeperiod].root._f_getChild("10")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("11")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("12")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("13")[otaz-1,dtaz-1])/100.0
+            t = self.skimMatrix("HWY", timeperiod, "10")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "11")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "12")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "13")[otaz-1,dtaz-1])/100.0
             opc = d*OPCOST
             return (d,t,f,opc,trippkcst)
         if tripmode == 5: # toll-paying SR2
-            t = self.hwyskims[timeperiod].root._f_getChild("14")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("15")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("16")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("17")[otaz-1,dtaz-1])/(100.0*2.0)
+            t = self.skimMatrix("HWY", timeperiod, "14")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "15")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "16")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "17")[otaz-1,dtaz-1])/(100.0*2.0)
             opc = d*OPCOST
             return (d,t,f,opc,trippkcst)
         if tripmode == 6: # toll-paying SR3
-            t = self.hwyskims[timeperiod].root._f_getChild("18")[otaz-1,dtaz-1] + termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("19")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("20")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("21")[otaz-1,dtaz-1])/(100.0*3.5)
+            t = self.skimMatrix("HWY", timeperiod, "18")[otaz-1,dtaz-1] + termtime
+            d = self.skimMatrix("HWY", timeperiod, "19")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "20")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "21")[otaz-1,dtaz-1])/(100.0*3.5)
             opc = d*OPCOST
             return (d,t,f,opc,trippkcst)
         if tripmode <= 9:
@@ -786,10 +1254,10 @@ class SkimUtil:
             return (0,0,0,0,0)       
         # Walk
         if tripmode == 10:
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return (d, (d/WALKSPEED)*60, 0, 0, 0);
         if (tripmode == 11):
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return (d, (d/BIKESPEED)*60, 0, 0, 0)
         
         # Transit
@@ -799,10 +1267,10 @@ class SkimUtil:
         
         while (t<0.01 and tripmode >= 12):
             skimname = TRIPTRNSKIMMAP[(tripmode,segdir)]
-            d = self.trnDist[timeperiod][skimname][otaz-1,dtaz-1]
-            f = self.trnFare[timeperiod][skimname][otaz-1,dtaz-1]
-            opc = self.trnDrvDist[timeperiod][skimname][otaz-1,dtaz-1]*OPCOST
-            t = self.trnTime[timeperiod][skimname][otaz-1,dtaz-1]
+            d = self.skimMatrix("TRN", timeperiod, (skimname,"dist"))[otaz-1,dtaz-1]
+            f = self.skimMatrix("TRN", timeperiod, (skimname,"fare"))[otaz-1,dtaz-1]
+            opc = self.skimMatrix("TRN", timeperiod, (skimname,"drvdist"))[otaz-1,dtaz-1]*OPCOST
+            t = self.skimMatrix("TRN", timeperiod, (skimname,"time"))[otaz-1,dtaz-1]
             
             if t>0.01:
                 return (d/100.0, t/100.0, f/100.0, opc/100.0, 0)
@@ -823,8 +1291,10 @@ class SkimUtil:
         #return (d/100.0, t/100.0, f)
         
     def getTripTravelAttr2(self, tripmode, segdir, otaz, dtaz, timeperiod, lasttimeperiod,
-                      curr_seg, paysToPark, purpose, totalstops, todepart, tddepart, primdest):
+                      curr_seg, paysToPark, purpose, totalstops, todepart, tddepart, primdest,
+                      randseed=None, tour=0):
         """ separates OVT and IVT and combines cost to return d,ivt,ovt,c
+            randseed and tour are as for getTripTravelAttr
         """
 
         (d,ivt,ovt,c) = (0,0,0,0)
@@ -834,13 +1304,13 @@ class SkimUtil:
         # some roadway specific stuff
         if tripmode <= 6:
             # this is ok because of the PNR zones
-            if (otaz >= self.termtime.root._f_getChild("1").shape[0] or
-               dtaz >= self.termtime.root._f_getChild("1").shape[0]):
+            if (otaz >= self.skimMatrix("TERM", None, "1").shape[0] or
+               dtaz >= self.skimMatrix("TERM", None, "1").shape[0]):
                 termtime = 0
             elif segdir == 1:
-                termtime = self.termtime.root._f_getChild("1")[otaz-1][dtaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[otaz-1][dtaz-1]
             else:
-                termtime = self.termtime.root._f_getChild("1")[dtaz-1][otaz-1]
+                termtime = self.skimMatrix("TERM", None, "1")[dtaz-1][otaz-1]
 
             # based on persdata.cpp. Uses the duration at the last stop, it seems to me...
             if segdir == 1:
@@ -856,7 +1326,10 @@ class SkimUtil:
             # reroll paysToPark -- the passed one is for tours
             paysToPark = 0
             if purpose<=4:
-                rnum = random.random()
+                if randseed == None:
+                    rnum = random.random()
+                else:
+                    rnum = float(tripRandom(randseed, tour, segdir, curr_seg))
                 if rnum < self.ppaying[primdest]:
                     paysToPark = 1
                                 
@@ -888,10 +1361,10 @@ class SkimUtil:
                         
         # Roadway                
         if tripmode == 1: # drive alone
-            ivt = self.hwyskims[timeperiod].root._f_getChild("1")[otaz-1,dtaz-1]
+            ivt = self.skimMatrix("HWY", timeperiod, "1")[otaz-1,dtaz-1]
             ovt = termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("2")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("3")[otaz-1,dtaz-1]/100.0
+            d = self.skimMatrix("HWY", timeperiod, "2")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "3")[otaz-1,dtaz-1]/100.0
             opc = d*OPCOST
             c = f + opc + trppkcst
             if d < 0.01: # toll-paying?
@@ -899,10 +1372,10 @@ class SkimUtil:
             else:
                 return (d,ivt,ovt,c)
         if tripmode == 2: # shared ride 2
-            ivt = self.hwyskims[timeperiod].root._f_getChild("4")[otaz-1,dtaz-1]
+            ivt = self.skimMatrix("HWY", timeperiod, "4")[otaz-1,dtaz-1]
             ovt = termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("5")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("6")[otaz-1,dtaz-1]/(100.0*2.0)
+            d = self.skimMatrix("HWY", timeperiod, "5")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "6")[otaz-1,dtaz-1]/(100.0*2.0)
             opc = d*OPCOST
             c = f + opc + trppkcst
             if d < 0.01: # toll-paying?
@@ -911,10 +1384,10 @@ class SkimUtil:
                 return (d,ivt,ovt,c)
             
         if tripmode == 3: # shared ride 3
-            ivt = self.hwyskims[timeperiod].root._f_getChild("7")[otaz-1,dtaz-1]
+            ivt = self.skimMatrix("HWY", timeperiod, "7")[otaz-1,dtaz-1]
             ovt = termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("8")[otaz-1,dtaz-1]
-            f = self.hwyskims[timeperiod].root._f_getChild("9")[otaz-1,dtaz-1]/(100.0*3.5)
+            d = self.skimMatrix("HWY", timeperiod, "8")[otaz-1,dtaz-1]
+            f = self.skimMatrix("HWY", timeperiod, "9")[otaz-1,dtaz-1]/(100.0*3.5)
             opc = d*OPCOST
             c = f + opc + trppkcst
             if d < 0.01: # toll-paying?
@@ -923,29 +1396,29 @@ class SkimUtil:
                 return (d,ivt,ovt,c)
             
         if tripmode == 4: # toll-paying drive alone
-            ivt = self.hwyskims[timeperiod].root._f_getChild("10")[otaz-1,dtaz-1] 
+            ivt = self.skimMatrix("HWY", timeperiod, "10")[otaz-1,dtaz-1] 
             ovt = termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("11")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("12")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("13")[otaz-1,dtaz-1])/100.0
+            d = self.skimMatrix("HWY", timeperiod, "11")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "12")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "13")[otaz-1,dtaz-1])/100.0
             opc = d*OPCOST
             c = f + opc + trppkcst
             return (d,ivt,ovt,c)
         if tripmode == 5: # toll-paying SR2
-            ivt = self.hwyskims[timeperiod].root._f_getChild("14")[otaz-1,dtaz-1] 
+            ivt = self.skimMatrix("HWY", timeperiod, "14")[otaz-1,dtaz-1] 
             ovt = termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("15")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("16")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("17")[otaz-1,dtaz-1])/(100.0*2.0)
+            d = self.skimMatrix("HWY", timeperiod, "15")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "16")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "17")[otaz-1,dtaz-1])/(100.0*2.0)
             opc = d*OPCOST
             c = f + opc + trppkcst
             return (d,ivt,ovt,c)
         if tripmode == 6: # toll-paying SR3
-            ivt = self.hwyskims[timeperiod].root._f_getChild("18")[otaz-1,dtaz-1] 
+            ivt = self.skimMatrix("HWY", timeperiod, "18")[otaz-1,dtaz-1] 
             ovt = termtime
-            d = self.hwyskims[timeperiod].root._f_getChild("19")[otaz-1,dtaz-1]
-            f = (self.hwyskims[timeperiod].root._f_getChild("20")[otaz-1,dtaz-1] + \
-                 self.hwyskims[timeperiod].root._f_getChild("21")[otaz-1,dtaz-1])/(100.0*3.5)
+            d = self.skimMatrix("HWY", timeperiod, "19")[otaz-1,dtaz-1]
+            f = (self.skimMatrix("HWY", timeperiod, "20")[otaz-1,dtaz-1] + \
+                 self.skimMatrix("HWY", timeperiod, "21")[otaz-1,dtaz-1])/(100.0*3.5)
             opc = d*OPCOST
             c = f + opc + trppkcst
             return (d,ivt,ovt,c)
@@ -954,10 +1427,10 @@ class SkimUtil:
             return (0,0,0,0,0)       
         # Walk
         if tripmode == 10:
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return (d, 0, (d/WALKSPEED)*60, 0);
         if (tripmode == 11):
-            d = self.nonmotskims.root._f_getChild("1")[otaz-1][dtaz-1]
+            d = self.skimMatrix("NONMOT", None, "1")[otaz-1][dtaz-1]
             return (d, 0, (d/BIKESPEED)*60, 0)
         
         # Transit
@@ -967,10 +1440,10 @@ class SkimUtil:
         
         while (t<0.01 and tripmode >= 12):
             skimname = TRIPTRNSKIMMAP[(tripmode,segdir)]
-            d = self.trnDist[timeperiod][skimname][otaz-1,dtaz-1]
-            f = self.trnFare[timeperiod][skimname][otaz-1,dtaz-1]
-            opc = self.trnDrvDist[timeperiod][skimname][otaz-1,dtaz-1]*OPCOST
-            t = self.trnTime[timeperiod][skimname][otaz-1,dtaz-1]
+            d = self.skimMatrix("TRN", timeperiod, (skimname,"dist"))[otaz-1,dtaz-1]
+            f = self.skimMatrix("TRN", timeperiod, (skimname,"fare"))[otaz-1,dtaz-1]
+            opc = self.skimMatrix("TRN", timeperiod, (skimname,"drvdist"))[otaz-1,dtaz-1]*OPCOST
+            t = self.skimMatrix("TRN", timeperiod, (skimname,"time"))[otaz-1,dtaz-1]
             c = f + opc + trppkcst
             if t>0.01:
                 return (d/100.0, ivt/100.0, ovt/100.0, c/100.0)
@@ -980,4 +1453,204 @@ class SkimUtil:
             #       segdir, self.skimdir, d, t, f, opc/100.0)
             tripmode -= 1
 
-        return  (d/100.0, ivt/100.0, ovt/100.0, c/100.0)
\ No newline at end of file
+        return  (d/100.0, ivt/100.0, ovt/100.0, c/100.0)
+
+    def getTripTravelTimes(self, tripmode, segdir, otaz, dtaz, timeperiod):
+        """
+        Array version of :py:meth:`getTripTravelTime`.  The arguments are arrays (or scalars, which
+        apply to every trip), and an array of times is returned.  The lookups are grouped by
+        time period and matrix, so each matrix is read once.
+        """
+        (tripmode, segdir, otaz, dtaz, timeperiod) = self.batchArrays(tripmode, segdir, otaz, dtaz, timeperiod)
+        self.checkSkimMap(TRIPTRNSKIMMAP, tripmode[tripmode >= 12], segdir[tripmode >= 12])
+        t = numpy.zeros(len(tripmode))
+
+        road = (tripmode <= 6)
+        if road.any():
+            t[road] = self.termTimes(segdir[road], otaz[road], dtaz[road])
+        for m in [1,2,3,4,5,6]:
+            sel = (tripmode == m)
+            if not sel.any(): continue
+            t[sel] += self.lookupSkimArray("HWY", HWYSKIMMATS[m][0], otaz[sel], dtaz[sel], timeperiod[sel])
+
+        for (m, speed) in [(10, WALKSPEED), (11, BIKESPEED)]:
+            sel = (tripmode == m)
+            if not sel.any(): continue
+            t[sel] = self.lookupSkimArray("NONMOT", "1", otaz[sel], dtaz[sel])/speed
+
+        for ((m, sd), skimname) in TRIPTRNSKIMMAP.iteritems():
+            sel = (tripmode == m) & (segdir == sd)
+            if not sel.any(): continue
+            t[sel] = self.lookupSkimArray("TRN", (skimname,"time"), otaz[sel], dtaz[sel], timeperiod[sel])/100.0
+        return t
+
+    def getTripTravelDists(self, tripmode, segdir, otaz, dtaz, timeperiod):
+        """
+        Array version of :py:meth:`getTripTravelDist`; see :py:meth:`getTripTravelTimes`.
+        """
+        (tripmode, segdir, otaz, dtaz, timeperiod) = self.batchArrays(tripmode, segdir, otaz, dtaz, timeperiod)
+        self.checkSkimMap(TRIPTRNSKIMMAP, tripmode[tripmode >= 12], segdir[tripmode >= 12])
+        d = numpy.zeros(len(tripmode))
+
+        for m in [1,2,3,4,5,6]:
+            sel = (tripmode == m)
+            if not sel.any(): continue
+            d[sel] = self.lookupSkimArray("HWY", HWYSKIMMATS[m][1], otaz[sel], dtaz[sel], timeperiod[sel])
+
+        sel = (tripmode == 10) | (tripmode == 11)
+        if sel.any():
+            d[sel] = self.lookupSkimArray("NONMOT", "1", otaz[sel], dtaz[sel])
+
+        for ((m, sd), skimname) in TRIPTRNSKIMMAP.iteritems():
+            sel = (tripmode == m) & (segdir == sd)
+            if not sel.any(): continue
+            d[sel] = self.lookupSkimArray("TRN", (skimname,"dist"), otaz[sel], dtaz[sel], timeperiod[sel])/100.0  # hundredths of miles
+        return d
+
+    def getTripTravelTolls(self, tripmode, segdir, otaz, dtaz, timeperiod):
+        """
+        Array version of :py:meth:`getTripTravelToll`; see :py:meth:`getTripTravelTimes`.
+        Modes 7-9 get zero.
+        """
+        (tripmode, segdir, otaz, dtaz, timeperiod) = self.batchArrays(tripmode, segdir, otaz, dtaz, timeperiod)
+        self.checkSkimMap(TRIPTRNSKIMMAP, tripmode[tripmode >= 12], segdir[tripmode >= 12])
+        f = numpy.zeros(len(tripmode))
+
+        for m in [1,2,3,4,5,6]:
+            sel = (tripmode == m)
+            if not sel.any(): continue
+            (timemat, distmat, tollmats, tolldivisor) = HWYSKIMMATS[m]
+            for tollmat in tollmats:
+                f[sel] += self.lookupSkimArray("HWY", tollmat, otaz[sel], dtaz[sel], timeperiod[sel])
+            f[sel] /= tolldivisor
+
+        if ((tripmode >= 7) & (tripmode <= 9)).any():
+            print "Don't know how to handle modes 7-9"
+
+        for ((m, sd), skimname) in TRIPTRNSKIMMAP.iteritems():
+            sel = (tripmode == m) & (segdir == sd)
+            if not sel.any(): continue
+            f[sel] = self.lookupSkimArray("TRN", (skimname,"fare"), otaz[sel], dtaz[sel], timeperiod[sel])
+        return f
+
+    def getTourTravelAttrs(self, tourmode, segdir, otaz, dtaz, timeperiod,
+                           paysToPark, purpose, todepart, tddepart):
+        """
+        Array version of :py:meth:`getTourTravelAttr`; see :py:meth:`getTripTravelTimes`.
+        Returns a tuple of arrays: distance, time, out-of-pocket cost, operating cost, parking cost.
+        """
+        if self.skimtype != "tour": 
+            errorstr= "Getting tour travel attributes without opening tour skims..."
+            raise Exception(errorstr)
+
+        (tourmode, segdir, otaz, dtaz, timeperiod, paysToPark, purpose, todepart, tddepart) = \
+            self.batchArrays(tourmode, segdir, otaz, dtaz, timeperiod, paysToPark, purpose, todepart, tddepart)
+        numtrips = len(tourmode)
+        (d, t, f, opc, trippkcst) = [numpy.zeros(numtrips) for i in range(5)]
+
+        # Roadway
+        road = (tourmode <= 6)
+        if road.any():
+            (d[road], t[road], f[road]) = self.roadwayAttrs(tourmode[road], segdir[road], otaz[road], dtaz[road], timeperiod[road])
+            opc[road] = d[road]*OPCOST
+
+            # this is out of sftourmc\ModeChoiceModel.cpp
+            tdur  = numpy.minimum(DURATION_TOUR_ARRAY[todepart[road]-1, tddepart[road]-1], 8.0)
+            pkcst = numpy.zeros(len(tdur))
+            wh    = (paysToPark[road]==1) & (purpose[road]==1)
+            oh    = (purpose[road]!=1)
+            pkcst[wh] = self.prkcstwh[dtaz[road][wh]]
+            pkcst[oh] = self.prkcstoh[dtaz[road][oh]]
+            trippkcst[road] = pkcst*tdur
+
+        # Walk, Bike
+        for (m, speed) in [(7, WALKSPEED), (8, BIKESPEED)]:
+            sel = (tourmode == m)
+            if not sel.any(): continue
+            d[sel] = self.lookupSkimArray("NONMOT", "1", otaz[sel], dtaz[sel])
+            t[sel] = (d[sel]/speed)*60
+
+        # Transit
+        trn = (tourmode >= 9)
+        if trn.any():
+            (trnd, trnt, trnf, trndrv) = self.transitAttrs(TOURTRNSKIMMAP, tourmode[trn], segdir[trn], otaz[trn], dtaz[trn], timeperiod[trn])
+            d[trn]   = trnd/100.0               # hundredths of miles
+            t[trn]   = trnt/100.0               # hundredths of minutes
+            f[trn]   = trnf/100.0               # cents
+            opc[trn] = trndrv*OPCOST/100.0      # hundredths of miles x dollars = cents
+        return (d, t, f, opc, trippkcst)
+
+    def getTripTravelAttrs(self, tripmode, segdir, otaz, dtaz, timeperiod, lasttimeperiod,
+                           curr_seg, paysToPark, purpose, totalstops, todepart, tddepart, primdest,
+                           randseed=None, tour=0):
+        """
+        Array version of :py:meth:`getTripTravelAttr`; see :py:meth:`getTripTravelTimes`.
+        Returns a tuple of arrays: distance, time, out-of-pocket cost, operating cost, parking cost.
+        With *randseed* (and *tour*), the parking costs match getTripTravelAttr for the same trips.
+        """
+        (tripmode, segdir, otaz, dtaz, timeperiod, lasttimeperiod, curr_seg, paysToPark, purpose,
+         totalstops, todepart, tddepart, primdest) = \
+            self.batchArrays(tripmode, segdir, otaz, dtaz, timeperiod, lasttimeperiod, curr_seg, paysToPark,
+                             purpose, totalstops, todepart, tddepart, primdest)
+        numtrips = len(tripmode)
+        (d, t, f, opc, trippkcst) = [numpy.zeros(numtrips) for i in range(5)]
+
+        # Roadway
+        road = (tripmode <= 6)
+        if road.any():
+            (d[road], t[road], f[road]) = self.roadwayAttrs(tripmode[road], segdir[road], otaz[road], dtaz[road], timeperiod[road])
+            opc[road] = d[road]*OPCOST
+
+            # based on persdata.cpp. Uses the duration at the last stop, it seems to me...
+            fromperiod = numpy.where((segdir[road]==1) & (curr_seg[road]==0), todepart[road], lasttimeperiod[road])
+            segdur     = DURATION_TRIP_ARRAY[fromperiod-1, timeperiod[road]-1]
+
+            # reroll paysToPark -- the passed one is for tours
+            (rotaz, rdtaz, rseg, rpurpose, rstops) = (otaz[road], dtaz[road], curr_seg[road], purpose[road], totalstops[road])
+            pays     = numpy.zeros(len(rotaz), dtype=bool)
+            work     = (rpurpose <= 4)
+            if randseed is None:
+                rnum = numpy.random.random(work.sum())
+            else:
+                (rseed, rtour) = self.batchArrays(randseed, tour, tripmode)[:2]
+                rnum = tripRandom(rseed[road][work], rtour[road][work], segdir[road][work], rseg[work])
+            pays[work] = rnum < self.ppaying[primdest[road][work]]
+
+            # school and work trips; other trips don't pay since paysToPark is only rerolled for these
+            pkcst    = numpy.zeros(len(rotaz))
+            notfirst = pays & (rseg > 0)
+            notlast  = pays & (rseg < (rstops+2)-1)
+            pkcst[notfirst] += self.prkcstwh[rotaz[notfirst]]/2.0
+            pkcst[notlast]  += self.prkcstwh[rdtaz[notlast]]/2.0
+
+            # jef 10/03  capped parking cost for trip at $20
+            trippkcst[road] = numpy.minimum(pkcst*segdur, 20.0)
+
+        if ((tripmode >= 7) & (tripmode <= 9)).any():
+            print "Don't know how to handle modes 7-9"
+
+        # Walk, Bike
+        for (m, speed) in [(10, WALKSPEED), (11, BIKESPEED)]:
+            sel = (tripmode == m)
+            if not sel.any(): continue
+            d[sel] = self.lookupSkimArray("NONMOT", "1", otaz[sel], dtaz[sel])
+            t[sel] = (d[sel]/speed)*60
+
+        # Transit: if there's no time for the mode, try the next mode down
+        pending = (tripmode >= 12)
+        trnmode = tripmode.copy()
+        for m in range(trnmode.max() if numtrips > 0 else 0, 11, -1):
+            sel = pending & (trnmode == m)
+            if not sel.any(): continue
+            (trnd, trnt, trnf, trndrv) = self.transitAttrs(TRIPTRNSKIMMAP, trnmode[sel], segdir[sel], otaz[sel], dtaz[sel], timeperiod[sel])
+            found = (trnt > 0.01)
+            done  = (trnt >= 0.01)
+            rows  = numpy.nonzero(sel)[0]
+            d[rows]   = trnd/100.0
+            t[rows]   = trnt/100.0
+            f[rows]   = trnf/100.0
+            # like getTripTravelAttr, opc isn't converted if no mode had a time
+            opc[rows] = numpy.where(found, trndrv*OPCOST/100.0, trndrv*OPCOST)
+            pending[rows[done]] = False
+            trnmode[rows[numpy.logical_not(done)]] -= 1
+        return (d, t, f, opc, trippkcst)
\ No newline at end of file
@@ -0,0 +1,163 @@
+import os, shutil, sys, tempfile, unittest
+import numpy
+from tables import openFile, Float32Atom
+from dbfpy import dbf
+
+# test this version of champUtil
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..")))
+
+import champUtil
+
+ZONES     = 12
+TERMZONES = 10      # OPTERM is smaller, like the real one
+MAXSFTAZ  = 9       # the last zones aren't in tazdata.dbf
+NUMTRIPS  = 2000
+
+def writeSkim(filename, numtables, zones, randstate, zeros=0.0):
+    """ Writes an H5 skim with tables "1" to *numtables* of random values, *zeros* of them zero
+    """
+    h5file = openFile(filename, mode="w")
+    h5file.setNodeAttr('/','zones', numpy.array([zones], numpy.int32))
+    h5file.setNodeAttr('/','tables', numpy.array([numtables], numpy.int32))
+    for t in range(1, numtables+1):
+        values = randstate.rand(zones, zones)*100
+        values[randstate.rand(zones, zones) < zeros] = 0
+        h5file.createCArray(h5file.root, str(t), Float32Atom(), (zones, zones))[:] = values
+    h5file.close()
+
+def writeSkimDir(skimdir):
+    """ Writes a set of random skims and tazdata.dbf to *skimdir*
+    """
+    rs = numpy.random.RandomState(1)
+    for tp in champUtil.TIMEPERIODS.values():
+        writeSkim(os.path.join(skimdir, "HWYALL" + tp + ".h5"), 21, ZONES, rs, zeros=0.2)
+        for (skimname, key) in champUtil.TRNSKIMKEY.iteritems():
+            writeSkim(os.path.join(skimdir, "TRN" + skimname + tp + ".h5"), max(key.values()), ZONES, rs, zeros=0.5)
+    writeSkim(os.path.join(skimdir, "NONMOT.h5"), 1, ZONES, rs)
+    writeSkim(os.path.join(skimdir, "OPTERM.h5"), 1, TERMZONES, rs)
+
+    tazdata = dbf.Dbf(os.path.join(skimdir, "tazdata.dbf"), new=True)
+    tazdata.addField(("SFTAZ", "N", 5, 0), ("PRKCSTWH", "N", 10, 2), ("PRKCSTOH", "N", 10, 2), ("PPAYING", "N", 6, 3))
+    for taz in range(1, MAXSFTAZ+1):
+        rec = tazdata.newRecord()
+        rec["SFTAZ"]    = taz
+        rec["PRKCSTWH"] = round(rs.rand()*500, 2)
+        rec["PRKCSTOH"] = round(rs.rand()*200, 2)
+        rec["PPAYING"]  = round(rs.rand(), 3)
+        rec.store()
+    tazdata.close()
+
+class TestSkimUtil(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ Write the skims once, and make the temp transit skims for trips and tours
+        """
+        cls.skimdir = tempfile.mkdtemp()
+        writeSkimDir(cls.skimdir)
+        cls.tripSkims = champUtil.SkimUtil(cls.skimdir)
+        cls.tourSkims = champUtil.SkimUtil(cls.skimdir, skimtype="tour", trnskims=champUtil.TOURSKIMS)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tripSkims.close()
+        cls.tourSkims.close()
+        shutil.rmtree(cls.skimdir)
+
+    def setUp(self):
+        rs = numpy.random.RandomState(2)
+        self.mode     = rs.randint(1, 18, NUMTRIPS)
+        # modes 7-9 aren't handled
+        self.mode[(self.mode >= 7) & (self.mode <= 9)] -= 6
+        self.segdir   = rs.randint(1, 3, NUMTRIPS)
+        self.otaz     = rs.randint(1, ZONES+1, NUMTRIPS)
+        self.dtaz     = rs.randint(1, ZONES+1, NUMTRIPS)
+        self.tp       = rs.randint(1, 6, NUMTRIPS)
+        self.lasttp   = rs.randint(1, 6, NUMTRIPS)
+        self.currseg  = rs.randint(0, 4, NUMTRIPS)
+        self.pays     = rs.randint(0, 2, NUMTRIPS)
+        self.purpose  = rs.randint(1, 7, NUMTRIPS)
+        self.stops    = rs.randint(0, 3, NUMTRIPS)
+        self.todepart = rs.randint(1, 6, NUMTRIPS)
+        self.tddepart = rs.randint(1, 6, NUMTRIPS)
+        self.primdest = rs.randint(1, ZONES+1, NUMTRIPS)
+        self.randseed = rs.randint(-2**31, 2**31-1, NUMTRIPS)
+        self.tour     = rs.randint(1, 4, NUMTRIPS)
+
+    def assertArraysClose(self, scalars, array):
+        self.assertEqual(len(scalars), len(array))
+        self.assertTrue(numpy.allclose(numpy.array(scalars, dtype=numpy.float64), array, rtol=1e-5, atol=1e-6))
+
+    def test_trip_time_dist_toll(self):
+        args = (self.mode, self.segdir, self.otaz, self.dtaz, self.tp)
+        for attr in ["Time", "Dist", "Toll"]:
+            scalars = [getattr(self.tripSkims, "getTripTravel" + attr)(*trip) for trip in zip(*args)]
+            self.assertArraysClose(scalars, getattr(self.tripSkims, "getTripTravel" + attr + "s")(*args))
+
+    def test_trip_attrs(self):
+        args = (self.mode, self.segdir, self.otaz, self.dtaz, self.tp, self.lasttp, self.currseg, self.pays,
+                self.purpose, self.stops, self.todepart, self.tddepart, self.primdest, self.randseed, self.tour)
+        scalars = numpy.array([self.tripSkims.getTripTravelAttr(*trip) for trip in zip(*args)])
+        arrays  = self.tripSkims.getTripTravelAttrs(*args)
+        for i in range(5):
+            self.assertArraysClose(scalars[:,i], arrays[i])
+
+    def test_tour_attrs(self):
+        tourmode = self.mode % 10 + 1
+        args = (tourmode, self.segdir, self.otaz, self.dtaz, self.tp, self.pays, self.purpose,
+                self.todepart, self.tddepart)
+        scalars = numpy.array([self.tourSkims.getTourTravelAttr(*tour) for tour in zip(*args)])
+        arrays  = self.tourSkims.getTourTravelAttrs(*args)
+        for i in range(5):
+            self.assertArraysClose(scalars[:,i], arrays[i])
+
+    def test_unmapped_transit_modes(self):
+        # the scalar and array versions both raise for a transit mode and segdir without a skim
+        for (mode, segdir) in [(12, 3), (18, 1)]:
+            for attr in ["Time", "Dist", "Toll"]:
+                self.assertRaises(KeyError, getattr(self.tripSkims, "getTripTravel" + attr), mode, segdir, 1, 2, 2)
+                self.assertRaises(KeyError, getattr(self.tripSkims, "getTripTravel" + attr + "s"),
+                                  [1, mode], [1, segdir], 1, 2, 2)
+            args = (mode, segdir, 1, 2, 2, 2, 0, 1, 1, 0, 2, 4, 2, 5, 1)
+            self.assertRaises(KeyError, self.tripSkims.getTripTravelAttr, *args)
+            self.assertRaises(KeyError, self.tripSkims.getTripTravelAttrs, [mode], *args[1:])
+        args = (11, 1, 1, 2, 2, 1, 1, 2, 4)
+        self.assertRaises(KeyError, self.tourSkims.getTourTravelAttr, *args)
+        self.assertRaises(KeyError, self.tourSkims.getTourTravelAttrs, [11], *args[1:])
+
+    def test_cache(self):
+        args = (self.mode, self.segdir, self.otaz, self.dtaz, self.tp)
+        cached = champUtil.SkimUtil(self.skimdir, cacheMB=1)
+        cached.pinSkim("HWY", 2, "1")
+        for attr in ["Times", "Dists", "Tolls"]:
+            self.assertArraysClose(getattr(self.tripSkims, "getTripTravel" + attr)(*args),
+                                   getattr(cached, "getTripTravel" + attr)(*args))
+        cached.close()
+
+    def test_zones_beyond_tazdata(self):
+        self.assertEqual(len(self.tripSkims.prkcstwh), ZONES+1)
+        self.assertEqual(self.tripSkims.prkcstwh[ZONES], 0)
+        attrs = self.tripSkims.getTripTravelAttr(1, 1, 1, ZONES, 2, 2, 0, 1, 1, 0, 2, 4, ZONES, 5, 1)
+        self.assertEqual(attrs[4], 0)
+
+    def test_zones_read_lazily(self):
+        skims = champUtil.SkimUtil(self.skimdir)
+        self.assertEqual(skims.zones, None)
+        self.assertEqual(len(skims.openFiles), 0)
+        self.assertEqual(skims.getMaxTAZnum(), ZONES)
+        self.assertEqual(skims.shape, (ZONES, ZONES))
+        skims.close()
+        self.assertEqual(champUtil.SkimUtil(self.skimdir, useTempTrn=False, zones=ZONES).getMaxTAZnum(), ZONES)
+
+    def test_read_skim_values(self):
+        matrix = self.tripSkims.skimMatrix("HWY", 2, "1")
+        values = matrix[:]
+        rows   = numpy.array([5, 0, 5, 11, 6, 0, 3])
+        cols   = numpy.array([1, 2, 3, 4, 5, 6, 7])
+        self.assertTrue(numpy.array_equal(self.tripSkims.readSkimValues(matrix, rows, cols), values[rows, cols]))
+        self.assertEqual(len(self.tripSkims.readSkimValues(matrix, rows[:0], cols[:0])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
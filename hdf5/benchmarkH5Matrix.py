@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""Compares H5Matrix storage settings (dtype, compression codec and level, chunk shape) by
+write time, read time and file size, to help pick the defaults for skims.
+"""
+
+import getopt, numpy, os, sys, time
+import tables
+from hdf5 import H5Matrix
+
+__license__= "GPL"
+
+USAGE = """
+
+ python benchmarkH5Matrix.py [-i input_h5] [-z zones] [-t tables] [workdir]
+
+ Writes the same tables with each of the SETTINGS below into workdir (default: the current
+ directory), then times reading them back by origin row (like SkimUtil and h5matrixToDbf)
+ and by random O-D pairs, and reports the file sizes.
+
+ The tables are the first tables of input_h5 (an H5Matrix, such as a converted skim) if given,
+ otherwise random skim-like tables with the given number of zones (default 2475).
+"""
+
+# (dtype, codec, level, chunkshape); see H5Matrix.create
+SETTINGS = [ (numpy.float64, "zlib",  7, None),
+             (numpy.float64, "zlib",  1, None),
+             (numpy.float32, "zlib",  7, None),
+             (numpy.float32, "zlib",  1, None),
+             (numpy.float32, "zlib",  1, "rows"),
+             (numpy.float32, "blosc", 5, "rows"),
+             (numpy.float32, "lz4",   5, "rows"),
+             (numpy.float32, "zstd",  3, "rows"),
+             (numpy.float32, None,    0, "rows") ]
+
+# random O-D pairs read from each table
+NUM_LOOKUPS = 2000
+
+def sampleTables(infilename, zones, numtables):
+    """
+    Returns a list of (name, array) to write.
+    """
+    if infilename:
+        h5 = H5Matrix.open(infilename)
+        sample = [(str(h5[t].attrs.name), h5[t][:]) for t in sorted(h5.keys())[:numtables]]
+        h5.close()
+        return sample
+
+    rs = numpy.random.RandomState(0)
+    sample = []
+    for t in range(numtables):
+        # travel times: smooth-ish values, some unconnected (zero) pairs
+        values = numpy.round(rs.gamma(4.0, 5.0, (zones, zones)), 2)
+        values[rs.rand(zones, zones) < 0.1] = 0
+        sample.append(("table%d" % (t+1), values))
+    return sample
+
+def benchmark(fname, sample, dtype, codec, level, chunkshape):
+    """
+    Returns (write seconds, row read seconds, O-D read seconds, file bytes) for the setting.
+    """
+    zones  = sample[0][1].shape[0]
+
+    start  = time.time()
+    h5     = H5Matrix.create(fname, zones=zones, tnames=[name for (name, values) in sample],
+                             dtype=dtype, codec=codec, level=level, chunkshape=chunkshape)
+    for t in range(1, len(sample)+1):
+        h5[t][:] = sample[t-1][1]
+    h5.close()
+    write  = time.time() - start
+    size   = os.path.getsize(fname)
+
+    h5file = tables.openFile(fname, mode="r")
+    start  = time.time()
+    for t in range(1, len(sample)+1):
+        node = h5file.root._f_getChild(str(t))
+        for row in range(zones):
+            node[row, :]
+    rowread = time.time() - start
+
+    rs     = numpy.random.RandomState(1)
+    start  = time.time()
+    for t in range(1, len(sample)+1):
+        node = h5file.root._f_getChild(str(t))
+        for (o, d) in rs.randint(0, zones, (NUM_LOOKUPS, 2)):
+            node[o, d]
+    odread = time.time() - start
+    h5file.close()
+
+    return (write, rowread, odread, size)
+
+if __name__ == '__main__':
+
+    try:
+        optlist,args = getopt.getopt(sys.argv[1:],"i:z:t:")
+    except getopt.GetoptError, err:
+        print str(err)
+        print USAGE
+        sys.exit(2)
+
+    infilename = None
+    zones      = 2475
+    numtables  = 3
+    for o,a in optlist:
+        if o=="-i": infilename = a
+        if o=="-z": zones = int(a)
+        if o=="-t": numtables = int(a)
+    workdir = args[0] if len(args) > 0 else "."
+
+    sample = sampleTables(infilename, zones, numtables)
+    print "%d tables of %d zones" % (len(sample), sample[0][1].shape[0])
+    print "%-8s %-6s %5s %-6s %9s %9s %9s %9s" % \
+        ("dtype", "codec", "level", "chunks", "write s", "rows s", "o-d s", "MB")
+
+    fname = os.path.join(workdir, "benchmarkH5Matrix.h5")
+    for (dtype, codec, level, chunkshape) in SETTINGS:
+        label = "%-8s %-6s %5d %-6s" % (numpy.dtype(dtype).name, codec, level, chunkshape)
+        try:
+            (write, rowread, odread, size) = benchmark(fname, sample, dtype, codec, level, chunkshape)
+        except (ValueError, tables.exceptions.HDF5ExtError), err:
+            # e.g. a codec this PyTables doesn't have
+            print "%s skipped: %s" % (label, err)
+            continue
+        finally:
+            if os.path.exists(fname): os.remove(fname)
+        print "%s %9.2f %9.2f %9.2f %9.1f" % (label, write, rowread, odread, size/1048576.0)
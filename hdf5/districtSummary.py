@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""Summarizes every zone-to-zone table in an H5 matrix or skim file to district-to-district
+sums, averages and counts.
+"""
+
+import getopt, numpy, os, sys
+DISAGGREGATE_DIR = os.path.realpath(os.path.join(os.path.split(__file__)[0], "..", "disaggregate"))
+sys.path.insert(0, DISAGGREGATE_DIR)
+from champUtil import readDistrictsEqv
+from tables import openFile,Float64Atom,Filters
+from dbfpy import dbf
+
+__license__= "GPL"
+
+USAGE = """
+
+ python districtSummary.py [-w weights_h5:table] districts.eqv input_h5 output_file
+
+ Reads the district equivalency file and each zone-to-zone table in input_h5, such as an
+ H5Matrix written by hdf5.py or a skim, and writes for each table:
+   SUM : the sum of the O-D values for each pair of districts
+   AVG : the average O-D value for each pair of districts; weighted by the given weights table
+         (e.g. trips) if -w is passed, otherwise over all of the O-D pairs
+   CNT : the number of O-D pairs with non-zero values
+ Zones not in the equivalency file are left out.
+
+ output_file is an .h5 (a DIST x DIST table for each statistic and table, named like
+ "time_SUM", with the district numbers in the districts attribute) or a .dbf (a record for each
+ pair of districts, with ORIG, DEST and a field for each statistic and table).
+"""
+
+STATISTICS = ["SUM", "AVG", "CNT"]
+
+# rows of each table read at a time
+BLOCK_ROWS = 500
+
+def districtGroups(tazToDist, zones):
+    """
+    Returns (districts, zoneDists), where *districts* is the sorted list of district numbers and
+    *zoneDists* is the index in *districts* of the district of each zone (zone z is zoneDists[z-1]),
+    or -1 for zones that aren't in a district.
+    """
+    districts = sorted(set(tazToDist.values()))
+    distIndex = dict((dist, idx) for (idx, dist) in enumerate(districts))
+    zoneDists = -numpy.ones(zones, dtype=numpy.int64)
+    for (taz, dist) in tazToDist.iteritems():
+        if 1 <= taz <= zones: zoneDists[taz-1] = distIndex[dist]
+    return (districts, zoneDists)
+
+def groupIndex(groups):
+    """
+    Returns (order, starts, ids) for summing by the group numbers *groups* with numpy.add.reduceat:
+    *order* is the positions sorted by group, each group's run in it begins at *starts*, and *ids*
+    are the groups of the runs.  Positions in group -1 are left out.
+    """
+    inGroup = numpy.nonzero(groups >= 0)[0]
+    order   = inGroup[numpy.argsort(groups[inGroup], kind="mergesort")]
+    sortedGroups = groups[order]
+    if len(order) == 0: return (order, order, order)
+    starts  = numpy.nonzero(numpy.concatenate(([True], sortedGroups[1:] != sortedGroups[:-1])))[0]
+    return (order, starts, sortedGroups[starts])
+
+def groupSums(values, index, numgroups, axis):
+    """
+    Returns the sums of the 2-d array *values* along *axis* by the groups in *index* (see groupIndex),
+    with *numgroups* entries along that axis.
+    """
+    (order, starts, ids) = index
+    shape = list(values.shape)
+    shape[axis] = numgroups
+    sums  = numpy.zeros(shape)
+    if len(order) == 0: return sums
+    grouped = numpy.add.reduceat(values.take(order, axis=axis), starts, axis=axis)
+    if axis == 0:
+        sums[ids, :] = grouped
+    else:
+        sums[:, ids] = grouped
+    return sums
+
+def zoneTables(h5file):
+    """
+    Returns the list of (name, node) for the square tables in *h5file*.  The names are the
+    H5Matrix name attributes if there are any, otherwise the node names.
+    """
+    tables = []
+    for node in h5file.root:
+        if len(getattr(node, "shape", ())) != 2 or node.shape[0] != node.shape[1]: continue
+        tables.append((str(getattr(node.attrs, "name", node.name)), node))
+    return tables
+
+def summarize(zoneDists, numdists, matrix, weights=None):
+    """
+    Returns a dictionary of statistic -> district x district array for the zone *matrix*
+    (which can be a PyTables node), reading it a block of rows at a time.
+    Each statistic is P.X.P' for the right X, where P is the district x zone 0/1 matrix from
+    *zoneDists* (see districtGroups).  Multiplying by P just sums the rows (or columns) of each
+    district, so that's done with grouped sums (see groupSums), first of each block's rows and
+    then of the columns, rather than with a dense product.
+    """
+    zones    = len(zoneDists)
+    colIndex = groupIndex(zoneDists)
+    sums     = dict((stat, numpy.zeros((numdists, numdists))) for stat in ["SUM", "CNT", "SUMW", "SUMMW"])
+
+    def districtSums(rowIndex, values):
+        return groupSums(groupSums(values, rowIndex, numdists, 0), colIndex, numdists, 1)
+
+    for row in range(0, zones, BLOCK_ROWS):
+        rows     = slice(row, min(row+BLOCK_ROWS, zones))
+        rowIndex = groupIndex(zoneDists[rows])
+        if len(rowIndex[0]) == 0: continue
+        block    = numpy.asarray(matrix[rows, :zones], dtype=numpy.float64)
+        sums["SUM"] += districtSums(rowIndex, block)
+        sums["CNT"] += districtSums(rowIndex, (block != 0).astype(numpy.float64))
+        if weights is not None:
+            wblock  = numpy.asarray(weights[rows, :zones], dtype=numpy.float64)
+            sums["SUMMW"] += districtSums(rowIndex, block*wblock)
+            sums["SUMW"]  += districtSums(rowIndex, wblock)
+
+    stats = { "SUM":sums["SUM"], "CNT":sums["CNT"] }
+    if weights is not None:
+        (numer, denom) = (sums["SUMMW"], sums["SUMW"])
+    else:
+        zonesPerDist   = numpy.bincount(zoneDists[zoneDists >= 0], minlength=numdists).astype(numpy.float64)
+        (numer, denom) = (stats["SUM"], numpy.outer(zonesPerDist, zonesPerDist))
+    stats["AVG"] = numpy.where(denom != 0, numer/numpy.where(denom != 0, denom, 1.0), 0.0)
+    return stats
+
+def writeH5(outfilename, districts, summaries):
+    """
+    Writes the *summaries* (a list of (table name, statistics dictionary)) to an H5 file.
+    """
+    outfile = openFile(outfilename, mode="w")
+    outfile.setNodeAttr('/','zones', numpy.array([len(districts)], numpy.int32))
+    outfile.setNodeAttr('/','districts', numpy.array(districts, numpy.int32))
+    filters = Filters(complevel=1, complib='zlib')
+    shape   = (len(districts), len(districts))
+    for (name, stats) in summaries:
+        for stat in STATISTICS:
+            carray = outfile.createCArray(outfile.root, "%s_%s" % (name, stat), Float64Atom(), shape, filters=filters)
+            carray[:] = stats[stat]
+    outfile.close()
+
+def dbfFieldNames(names, used=[]):
+    """
+    Returns the list of DBF field names for *names*: upper case (as dbfpy makes them) and at most
+    10 characters, with the end replaced by a number where that would repeat an earlier name or
+    one of the names in *used*.
+    """
+    used       = set(used)
+    fieldnames = []
+    for name in names:
+        fieldname = name[0:10].upper()
+        num       = 1
+        while fieldname in used:
+            fieldname = name[0:10-len(str(num))].upper() + str(num)
+            num      += 1
+        used.add(fieldname)
+        fieldnames.append(fieldname)
+    return fieldnames
+
+def writeDbf(outfilename, districts, summaries):
+    """
+    Writes the *summaries* (a list of (table name, statistics dictionary)) to a DBF file,
+    with a record per pair of districts.
+    """
+    outdbf = dbf.Dbf(outfilename, new=True)
+    outdbf.addField(("ORIG", "N", 5, 0))
+    outdbf.addField(("DEST", "N", 5, 0))
+    names  = []
+    arrays = []
+    for (name, stats) in summaries:
+        for stat in STATISTICS:
+            names.append(stat[0] + "_" + name)
+            arrays.append(stats[stat])
+    fieldnames = dbfFieldNames(names, ["ORIG", "DEST"])
+    for (name, fieldname) in zip(names, fieldnames):
+        if fieldname != name.upper(): print "Writing %s as field %s" % (name, fieldname)
+        outdbf.addField((fieldname, "N", 15, 4))
+    fields = zip(fieldnames, arrays)
+
+    for (oidx, orig) in enumerate(districts):
+        for (didx, dest) in enumerate(districts):
+            rec = outdbf.newRecord()
+            rec["ORIG"] = orig
+            rec["DEST"] = dest
+            for (fieldname, values) in fields:
+                rec[fieldname] = values[oidx, didx]
+            rec.store()
+    outdbf.close()
+
+def districtSummary(eqvfilename, infilename, outfilename, weightsfilename=None, weightstable=None):
+    """
+    Summarizes all of the tables in *infilename* by the districts in *eqvfilename* and writes
+    them to *outfilename* (.h5 or .dbf).  Pass *weightsfilename* and *weightstable* to weight
+    the averages.
+    """
+    (tazToDist, distToTaz, distToName) = readDistrictsEqv(eqvfilename)
+
+    h5file  = openFile(infilename, mode="r")
+    tables  = zoneTables(h5file)
+    if len(tables) == 0:
+        print "No zone tables found in " + infilename
+        sys.exit(1)
+    zones   = tables[0][1].shape[0]
+    if "zones" in h5file.root._v_attrs._v_attrnames:
+        zones = int(h5file.getNodeAttr('/','zones')[0])
+    (districts, zoneDists) = districtGroups(tazToDist, zones)
+
+    weightsfile = None
+    weights     = None
+    if weightsfilename:
+        weightsfile = openFile(weightsfilename, mode="r")
+        weights     = dict(zoneTables(weightsfile))[weightstable]
+
+    summaries = []
+    for (name, node) in tables:
+        print "Summarizing " + name
+        summaries.append((name, summarize(zoneDists, len(districts), node, weights)))
+    h5file.close()
+    if weightsfile: weightsfile.close()
+
+    print "Writing " + outfilename
+    if outfilename.lower().endswith(".dbf"):
+        writeDbf(outfilename, districts, summaries)
+    else:
+        writeH5(outfilename, districts, summaries)
+
+if __name__ == '__main__':
+
+    try:
+        optlist,args    = getopt.getopt(sys.argv[1:],"w:")
+    except getopt.GetoptError, err:
+        print str(err)
+        print USAGE
+        sys.exit(2)
+
+    if len(args) != 3:
+        print USAGE
+        sys.exit(1)
+
+    weightsfilename = None
+    weightstable    = None
+    for o,a in optlist:
+        if o=="-w": (weightsfilename, weightstable) = a.rsplit(":",1)
+
+    districtSummary(args[0], args[1], args[2], weightsfilename, weightstable)
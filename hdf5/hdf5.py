@@ -1,13 +1,24 @@
 #!/usr/bin/env python
 
-""" Batch converts cube matrix files to HDF5 """
+""" Batch converts cube matrix files to HDF5
 
-import subprocess,os, types, warnings
+    Needs numpy and PyTables.  h5py is optional: it's only used by H5Matrix.open(mmap=True).
+"""
+
+import hashlib,multiprocessing,subprocess,os, time, traceback, types, warnings
 import tables
 import numpy
 
+try:
+    import h5py     # only needed for H5Matrix.open(mmap=True)
+except ImportError:
+    h5py = None
+
 warnings.filterwarnings("ignore", category=tables.NaturalNameWarning) # Pytables doesn't like our table numbering scheme
-MAT2H5_BIN = "Y:\\champ\util\bin\\mat2h5.exe"
+MAT2H5_BIN = os.environ.get("MAT2H5_BIN", "Y:\\champ\\util\\bin\\mat2h5.exe")
+
+# rows read or written at a time by the H5Matrix whole-table methods
+MAT_BLOCK_ROWS = 256
 
 __author__ = "Elizabeth Sall and Lisa Zorn, San Francisco County Transportation Authority"
 __license__= "GPL"
@@ -15,9 +26,11 @@ __email__  = "elizabeth@sfcta.org"
 __date__   = "2008-07-07"
 
 def h5mat(convertFile):
-    """ calls the executable that changes between .MAT and .h5 files
+    """ calls the executable that changes between .MAT and .h5 files; returns its exit code.
+        There's no native .MAT reader or writer, since the TP+ matrix format isn't published,
+        so conversion needs mat2h5 (MAT2H5_BIN, which can be set in the environment).
     """
-    subprocess.call([MAT2H5_BIN,convertFile])
+    return subprocess.call([MAT2H5_BIN,convertFile])
 
 def convertSet(fileList):
     """ calls the executable that changes between .MAT and .h5 files
@@ -27,29 +40,214 @@ def convertSet(fileList):
         print "converting %s" % (file)
         h5mat(file)
 
-def convertTransit(path,tod):
-    """converts all transit skim files for a numeric time period
+def transitFiles(path,tod):
+    """returns the transit skim files for a numeric time period
     """
     timePeriods = {1:'EA', 2:'AM', 3:'MD', 4:'PM', 5:'EV'}
     tlist=['WLW','WMW','WPW','WBW','APW','ABW','WPA','WBA']
     convlist = []
     for item in tlist:
         convlist.append(os.path.join(path,"TRN"+item+timePeriods[tod]+".MAT"))
-    convertSet(convlist)
+    return convlist
+
+def hwyFiles(path,tod):
+    """returns the hwyskim file for a numeric time period, in a list
+    """
+    timePeriods = {1:'EA', 2:'AM', 3:'MD', 4:'PM', 5:'EV'}
+    return [os.path.join(path,"HWYALL"+timePeriods[tod]+".MAT")]
+
+def convertTransit(path,tod):
+    """converts all transit skim files for a numeric time period
+    """
+    convertSet(transitFiles(path,tod))
 
 def convertHwy(path,tod):
     """converts  hwyskim file for a numeric time period
     """
-    timePeriods = {1:'EA', 2:'AM', 3:'MD', 4:'PM', 5:'EV'}
-    item = os.path.join(path,"HWYALL"+timePeriods[tod]+".MAT")
-    h5mat (item)
+    h5mat(hwyFiles(path,tod)[0])
+
+def h5Name(matfile):
+    """returns the name of the .h5 version of *matfile*
+    """
+    return os.path.splitext(matfile)[0] + ".h5"
+
+def fileHash(fname):
+    """returns the md5 hex digest of the contents of *fname*
+    """
+    md5 = hashlib.md5()
+    f   = open(fname, "rb")
+    for block in iter(lambda: f.read(1024*1024), ""):
+        md5.update(block)
+    f.close()
+    return md5.hexdigest()
+
+def upToDate(matfile, check="mtime"):
+    """returns True if the .h5 version of *matfile* doesn't need converting.
+       check is "mtime" (the .h5 is newer than the .MAT) or "hash" (the .MAT has the same
+       contents as when the .h5 was made, according to the .h5.md5 file written by convertFiles).
+       An .h5 that convertFile didn't finish (it left a .h5.partial file) is never up to date.
+    """
+    h5file = h5Name(matfile)
+    if not os.path.exists(h5file): return False
+    if os.path.exists(h5file + ".partial"): return False
+    if check == "hash":
+        if not os.path.exists(h5file + ".md5"): return False
+        f = open(h5file + ".md5", "r")
+        madeFrom = f.read().strip()
+        f.close()
+        return madeFrom == fileHash(matfile)
+    return os.path.getmtime(h5file) >= os.path.getmtime(matfile)
+
+def replaceFile(src, dst):
+    """renames *src* to *dst*, replacing *dst* if it exists (which os.rename won't do on Windows)
+    """
+    if os.path.exists(dst): os.remove(dst)
+    os.rename(src, dst)
+
+def convertFile(args):
+    """converts one .MAT file; for convertFiles' workers.
+       Returns (matfile, seconds taken, .MAT size in bytes, True if the .h5 was made)
+       and doesn't raise, so one bad file doesn't stop the others.
+
+       mat2h5 picks the .h5 name itself, so the .h5 can't be written to a temporary name.
+       Instead the old .h5 is kept as .h5.old until the new one is done, and put back if the
+       conversion fails, and the .h5.partial file marks the .h5 as unfinished (see upToDate)
+       in case this process is killed.
+    """
+    (matfile, check) = args
+    start   = time.time()
+    h5file  = h5Name(matfile)
+    made    = False
+    try:
+        open(h5file + ".partial", "w").close()
+        if os.path.exists(h5file): replaceFile(h5file, h5file + ".old")
+
+        made = (h5mat(matfile) == 0) and os.path.exists(h5file)
+        if made and check == "hash":
+            f = open(h5file + ".md5.tmp", "w")
+            f.write(fileHash(matfile) + "\n")
+            f.close()
+            replaceFile(h5file + ".md5.tmp", h5file + ".md5")
+    except Exception:
+        print "Error converting %s" % (matfile)
+        traceback.print_exc()
+        made = False
+
+    try:
+        if made:
+            for oldfile in [h5file + ".old", h5file + ".partial"]:
+                if os.path.exists(oldfile): os.remove(oldfile)
+        else:
+            for oldfile in [h5file, h5file + ".md5.tmp"]:
+                if os.path.exists(oldfile): os.remove(oldfile)
+            if os.path.exists(h5file + ".old"): os.rename(h5file + ".old", h5file)
+            if os.path.exists(h5file + ".partial"): os.remove(h5file + ".partial")
+        nbytes = os.path.getsize(matfile)
+    except Exception:
+        traceback.print_exc()
+        (made, nbytes) = (False, 0)
+    return (matfile, time.time()-start, nbytes, made)
+
+def convertFiles(fileList, numWorkers=4, check="mtime"):
+    """converts the .MAT files in *fileList* using *numWorkers* processes, skipping those that
+       are up to date (see upToDate; pass check=None to convert them all), and reports the
+       throughput for each file and overall.  Returns the list of files that failed to convert.
+    """
+    todo = []
+    for matfile in fileList:
+        if check and upToDate(matfile, check):
+            print "%s is up to date" % (matfile)
+        else:
+            todo.append((matfile, check))
+    if len(todo) == 0: return []
+
+    start = time.time()
+    if numWorkers > 1:
+        pool    = multiprocessing.Pool(processes=min(numWorkers, len(todo)))
+        results = pool.imap_unordered(convertFile, todo)
+    else:
+        pool    = None
+        results = (convertFile(args) for args in todo)
+
+    failed     = []
+    totalbytes = 0
+    try:
+        for (matfile, seconds, nbytes, made) in results:
+            if not made:
+                print "FAILED converting %s" % (matfile)
+                failed.append(matfile)
+                continue
+            totalbytes += nbytes
+            print "converted %s: %.1f MB in %.1f s (%.1f MB/s)" % \
+                (matfile, nbytes/1048576.0, seconds, nbytes/1048576.0/max(seconds, 0.001))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    seconds = time.time()-start
+    print "converted %d files: %.1f MB in %.1f s (%.1f MB/s)" % \
+        (len(todo)-len(failed), totalbytes/1048576.0, seconds, totalbytes/1048576.0/max(seconds, 0.001))
+    return failed
+
+def convertSkims(path, tods=[1,2,3,4,5], numWorkers=4, check="mtime"):
+    """converts the transit and highway skims for all of the numeric time periods *tods*
+       in parallel; see convertFiles
+    """
+    fileList = []
+    for tod in tods:
+        fileList.extend(transitFiles(path,tod))
+        fileList.extend(hwyFiles(path,tod))
+    return convertFiles(fileList, numWorkers, check)
+
+# compression codecs for H5Matrix tables -> PyTables complib.  lz4 and zstd go through blosc, and need a
+# PyTables version that has those blosc compressors
+CODECS = { "zlib":"zlib", "blosc":"blosc", "lz4":"blosc:lz4", "zstd":"blosc:zstd", "lzo":"lzo", "bzip2":"bzip2" }
+
+# approximate size of each chunk with the "rows" chunkshape
+ROW_CHUNK_BYTES = 64*1024
+
+def tableFilters(codec, level):
+    """ Returns the PyTables Filters for H5Matrix tables compressed with *codec* (one of CODECS, or None)
+        at *level*.  Raises a ValueError for an unknown codec.
+    """
+    if not codec: return tables.Filters(complevel=0)
+    if codec not in CODECS:
+        raise ValueError("Unknown codec %s; use one of %s" % (codec, ", ".join(sorted(CODECS.keys()))))
+    return tables.Filters(complevel=level, complib=CODECS[codec])
+
+def dataOffset(dataset):
+    """ Returns the offset in the file of the h5py *dataset*'s data if it's stored uncompressed in one
+        piece (contiguous, or in a single unfiltered chunk), or None otherwise.
+    """
+    if dataset.id.get_create_plist().get_nfilters() > 0: return None
+    if dataset.chunks == None:
+        return dataset.id.get_offset()
+
+    # a single chunk covering the whole dataset; needs an h5py with chunk queries
+    if dataset.chunks != dataset.shape or not hasattr(dataset.id, "get_chunk_info"): return None
+    if dataset.id.get_num_chunks() != 1: return None
+    info = dataset.id.get_chunk_info(0)
+    if info.size != dataset.dtype.itemsize*numpy.prod(dataset.shape): return None
+    return info.byte_offset
 
 class H5Matrix(dict):
     """H5Matrix mimics a TP+ matrix file"""
 
+    # table storage used by create_tables; see create
+    dtype      = numpy.float64
+    codec      = "zlib"
+    level      = 7
+    chunkshape = None
+
     @classmethod
-    def open(self, fname):
-        """ Open an existing H5Matrix file for reading."""
+    def open(self, fname, mmap=False):
+        """ Open an existing H5Matrix file for reading.
+            With mmap=True, each table stored uncompressed in one piece (contiguous, or a single chunk
+            as made by create with codec=None and chunkshape="table") is a read-only numpy.memmap
+            of the file rather than a PyTables node, so processes reading the same file share the
+            OS page cache instead of each decompressing their own copies.  This needs h5py.
+        """
         h5 = self()
 
         h5.h5file = tables.openFile(fname, mode='r')
@@ -57,13 +255,26 @@ class H5Matrix(dict):
         h5.matrices = int(h5.h5file.getNodeAttr('/','tables')[0])
 
         h5.populate_tables()
+        if mmap:
+            try:
+                h5.map_tables(fname)
+            except:
+                h5.h5file.close()
+                raise
 
         return h5
 
     @classmethod
-    def create(self, fname, zones=0, matrices=0, tnames=None, template=None):
-        """ Create an H5 file for storing TP+ style matrices
+    def create(self, fname, zones=0, matrices=0, tnames=None, template=None,
+               dtype=numpy.float64, codec="zlib", level=7, chunkshape=None):
+        """ Create an H5 file for storing TP+ style matrices.
+            The tables are stored as *dtype*, compressed with *codec* (one of CODECS, or None)
+            at *level*.  *chunkshape* is None for the PyTables default, "rows" for blocks of whole
+            rows (best for reading origin rows), "table" for one chunk per table (which, uncompressed,
+            can be memory-mapped; see open), or a (rows, columns) tuple.
         """
+        tableFilters(codec, level)  # check the codec before making the file
+
         h5 = self()
 
         h5.h5file = tables.openFile(fname, mode='w')
@@ -71,10 +282,14 @@ class H5Matrix(dict):
         h5.matrices = matrices
         if matrices == 0 and len(tnames) > 0:
             h5.matrices = len(tnames)
+        h5.dtype = dtype
+        h5.codec = codec
+        h5.level = level
+        h5.chunkshape = chunkshape
 
         # Create attributes that are consistent with input file
         h5.h5file.setNodeAttr('/','zones', numpy.array([zones], numpy.int32))
-        h5.h5file.setNodeAttr('/','tables', numpy.array([matrices], numpy.int32))
+        h5.h5file.setNodeAttr('/','tables', numpy.array([h5.matrices], numpy.int32))
 
         if (tnames or matrices): h5.create_tables(tnames or matrices)
 
@@ -86,6 +301,26 @@ class H5Matrix(dict):
             node = self.h5file.getNode('/','%s' % (t))
             self[t] = node
 
+    def map_tables(self, fname):
+        """ Replaces the tables that are stored uncompressed in one piece with read-only numpy.memmaps
+            of *fname*, finding where their data is with h5py.  Other tables are left as they are,
+            with a warning.
+        """
+        if h5py == None:
+            raise ImportError("H5Matrix.open(mmap=True) needs h5py, which isn't installed")
+
+        h5pyfile = h5py.File(fname, 'r')
+        try:
+            for t in self.keys():
+                dataset = h5pyfile['/%s' % t]
+                offset  = dataOffset(dataset)
+                if offset == None:
+                    warnings.warn("Table %s of %s isn't stored uncompressed in one piece so it isn't memory-mapped" % (t, fname))
+                    continue
+                self[t] = numpy.memmap(fname, mode='r', dtype=dataset.dtype, shape=dataset.shape, offset=offset)
+        finally:
+            h5pyfile.close()
+
 
     def create_tables(self, matrices):
         """ Create new set of tables in this H5Matrix.
@@ -93,26 +328,102 @@ class H5Matrix(dict):
             Pass a list of names to create that many tables with named attributes.
         """
 
-        atom = tables.Float64Atom()
+        atom = tables.Atom.from_dtype(numpy.dtype(self.dtype))
         shape = (self.zones, self.zones)
-        filters = tables.Filters(complevel=7, complib='zlib')
+        filters = tableFilters(self.codec, self.level)
+        chunkshape = self.chunkshape
+        if chunkshape == "table":
+            chunkshape = shape
+        elif chunkshape == "rows":
+            rows = ROW_CHUNK_BYTES // (atom.itemsize*max(self.zones, 1))
+            chunkshape = (max(1, min(rows, self.zones)), self.zones)
 
         if type(matrices) == types.IntType:
             # Pass an integer to create that number of new blank tables without table names.
             for t in range(1, 1+matrices):
-                tOut = self.h5file.createCArray(self.h5file.root, '%s' % t, atom, shape, filters=filters)
+                tOut = self.h5file.createCArray(self.h5file.root, '%s' % t, atom, shape, filters=filters,
+                                                chunkshape=chunkshape)
                 tOut.attrs.zones =  numpy.array([self.zones], numpy.int32)
                 tOut.attrs.name = '%s' % t
                 self[t] = tOut
         else:
             # Pass a list of names to create that many tables with named attributes.
             for t in range(1, 1+len(matrices)):
-                tOut = self.h5file.createCArray(self.h5file.root, '%s'% t, atom, shape, filters=filters)
+                tOut = self.h5file.createCArray(self.h5file.root, '%s'% t, atom, shape, filters=filters,
+                                                chunkshape=chunkshape)
                 tOut.attrs.zones =  numpy.array([self.zones], numpy.int32)
                 tOut.attrs.name = matrices[t-1]
                 self[t] = tOut
 
+    def table_list(self, tables=None):
+        """ Returns the given table numbers as a list, or all of them (in order) if *tables* is None.
+        """
+        if tables == None: return sorted(self.keys())
+        return list(tables)
+
+    def row_blocks(self, tables=None, numrows=MAT_BLOCK_ROWS):
+        """ Generator yielding (first row index (0-based), tables x rows x zones array) for the
+            *tables* (all of them by default), *numrows* rows at a time.
+        """
+        tlist = self.table_list(tables)
+        dtype = numpy.result_type(*[self[t].dtype for t in tlist])
+        for first in range(0, self.zones, numrows):
+            last  = min(first+numrows, self.zones)
+            block = numpy.empty((len(tlist), last-first, self.zones), dtype=dtype)
+            for (i, t) in enumerate(tlist):
+                block[i] = self[t][first:last, :]
+            yield (first, block)
+
+    def read_tables(self, tables=None):
+        """ Returns the *tables* (all of them by default) as one tables x zones x zones array.
+        """
+        tlist = self.table_list(tables)
+        out   = None
+        for (first, block) in self.row_blocks(tlist):
+            if out is None: out = numpy.empty((len(tlist), self.zones, self.zones), dtype=block.dtype)
+            out[:, first:first+block.shape[1], :] = block
+        return out
+
+    def write_tables(self, array, tables=None, numrows=MAT_BLOCK_ROWS):
+        """ Writes the tables x zones x zones *array* to the *tables* (all of them by default),
+            *numrows* rows at a time.
+        """
+        tlist = self.table_list(tables)
+        if len(array) != len(tlist):
+            raise ValueError("%d tables given for %d tables of data" % (len(tlist), len(array)))
+        for (i, t) in enumerate(tlist):
+            for first in range(0, self.zones, numrows):
+                self[t][first:first+numrows, :] = array[i, first:first+numrows, :]
+
+    def sum_tables(self, tables, factors=None, out=None, numrows=MAT_BLOCK_ROWS):
+        """ Returns the sum of the *tables*, each multiplied by its entry in *factors* if given,
+            working *numrows* rows at a time so there are no whole-table temporaries.
+            Pass a table number as *out* to write the sum to that table instead; it may be one of
+            the *tables*, so sum_tables([t, s], [1, f], out=t) adds f times table s to table t.
+        """
+        tlist = self.table_list(tables)
+        if factors is None: factors = [1]*len(tlist)
+        if len(factors) != len(tlist):
+            raise ValueError("%d factors given for %d tables" % (len(factors), len(tlist)))
+        if out == None: result = numpy.empty((self.zones, self.zones))
+
+        for first in range(0, self.zones, numrows):
+            last  = min(first+numrows, self.zones)
+            total = numpy.zeros((last-first, self.zones))
+            for (t, factor) in zip(tlist, factors):
+                if factor == 1:
+                    total += self[t][first:last, :]
+                else:
+                    total += factor*numpy.asarray(self[t][first:last, :], dtype=numpy.float64)
+            if out == None:
+                result[first:last, :] = total
+            else:
+                self[out][first:last, :] = total
+
+        if out == None: return result
+
     def close(self):
         for t in self:
+            if isinstance(self[t], numpy.memmap): continue
             self[t].flush()
         self.h5file.close()
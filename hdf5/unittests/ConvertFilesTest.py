@@ -0,0 +1,119 @@
+import os, shutil, sys, tempfile, unittest
+
+# test this version of hdf5
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..")))
+
+import hdf5
+
+class TestConvertFiles(unittest.TestCase):
+
+    def setUp(self):
+        """ Stubs out mat2h5: h5mat writes the .MAT's contents to the .h5, or fails if *fail* is set
+        """
+        self.tempdir   = tempfile.mkdtemp()
+        self.matfile   = os.path.join(self.tempdir, "HWYALLAM.MAT")
+        self.h5file    = os.path.join(self.tempdir, "HWYALLAM.h5")
+        self.converted = []
+        self.fail      = False
+        self.h5mat     = hdf5.h5mat
+        hdf5.h5mat     = self.stubH5mat
+        self.writeFile(self.matfile, "skims 1")
+
+    def tearDown(self):
+        hdf5.h5mat = self.h5mat
+        shutil.rmtree(self.tempdir)
+
+    def stubH5mat(self, matfile):
+        self.converted.append(matfile)
+        if self.fail:
+            self.writeFile(hdf5.h5Name(matfile), "half written")
+            return 1
+        self.writeFile(hdf5.h5Name(matfile), "h5 of " + self.readFile(matfile))
+        return 0
+
+    def writeFile(self, fname, contents, mtime=None):
+        f = open(fname, "w")
+        f.write(contents)
+        f.close()
+        if mtime != None: os.utime(fname, (mtime, mtime))
+
+    def readFile(self, fname):
+        f = open(fname, "r")
+        contents = f.read()
+        f.close()
+        return contents
+
+    def convert(self, check):
+        return hdf5.convertFiles([self.matfile], numWorkers=1, check=check)
+
+    def test_skip_up_to_date(self):
+        for check in ["mtime", "hash"]:
+            self.converted = []
+            self.assertEqual(self.convert(check), [])
+            self.assertEqual(self.convert(check), [])
+            self.assertEqual(self.converted, [self.matfile])
+            self.assertEqual(self.readFile(self.h5file), "h5 of skims 1")
+
+    def test_convert_changed_mtime(self):
+        self.convert("mtime")
+        self.writeFile(self.matfile, "skims 2", mtime=os.path.getmtime(self.h5file)+10)
+        self.convert("mtime")
+        self.assertEqual(len(self.converted), 2)
+        self.assertEqual(self.readFile(self.h5file), "h5 of skims 2")
+
+    def test_convert_changed_hash(self):
+        self.convert("hash")
+        mtime = os.path.getmtime(self.matfile)
+        self.writeFile(self.matfile, "skims 2", mtime=mtime)
+        self.convert("hash")
+        self.assertEqual(len(self.converted), 2)
+        self.assertEqual(self.readFile(self.h5file), "h5 of skims 2")
+        self.assertEqual(self.readFile(self.h5file + ".md5").strip(), hdf5.fileHash(self.matfile))
+
+        # the same contents again isn't converted, even though it's newer
+        self.writeFile(self.matfile, "skims 2", mtime=os.path.getmtime(self.h5file)+10)
+        self.convert("hash")
+        self.assertEqual(len(self.converted), 2)
+
+    def test_failed_conversion_keeps_h5(self):
+        self.convert("hash")
+        md5 = self.readFile(self.h5file + ".md5")
+        self.writeFile(self.matfile, "skims 2", mtime=os.path.getmtime(self.h5file)+10)
+        self.fail = True
+        self.assertEqual(self.convert("hash"), [self.matfile])
+        self.assertEqual(self.readFile(self.h5file), "h5 of skims 1")
+        self.assertEqual(self.readFile(self.h5file + ".md5"), md5)
+        self.assertEqual(sorted(os.listdir(self.tempdir)), ["HWYALLAM.MAT", "HWYALLAM.h5", "HWYALLAM.h5.md5"])
+
+        # and it's tried again next time
+        self.assertFalse(hdf5.upToDate(self.matfile, "hash"))
+        self.fail = False
+        self.assertEqual(self.convert("hash"), [])
+        self.assertEqual(self.readFile(self.h5file), "h5 of skims 2")
+
+    def test_unfinished_conversion_not_up_to_date(self):
+        self.convert("mtime")
+        self.assertTrue(hdf5.upToDate(self.matfile, "mtime"))
+        self.writeFile(self.h5file + ".partial", "")
+        self.assertFalse(hdf5.upToDate(self.matfile, "mtime"))
+
+    def test_convert_skims(self):
+        matfiles = hdf5.transitFiles(self.tempdir, 2) + hdf5.hwyFiles(self.tempdir, 2)
+        for matfile in matfiles:
+            self.writeFile(matfile, os.path.basename(matfile))
+        self.assertEqual(hdf5.convertSkims(self.tempdir, tods=[2], numWorkers=1), [])
+        self.assertEqual(hdf5.convertSkims(self.tempdir, tods=[2], numWorkers=1), [])
+        self.assertEqual(sorted(self.converted), sorted(matfiles))
+        self.assertEqual(self.readFile(self.h5file), "h5 of HWYALLAM.MAT")
+
+    def test_replace_file(self):
+        self.writeFile(self.h5file, "old")
+        self.writeFile(self.h5file + ".new", "new")
+        hdf5.replaceFile(self.h5file + ".new", self.h5file)
+        self.assertEqual(self.readFile(self.h5file), "new")
+        self.assertFalse(os.path.exists(self.h5file + ".new"))
+
+
+if __name__ == '__main__':
+    unittest.main()
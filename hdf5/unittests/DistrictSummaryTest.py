@@ -0,0 +1,82 @@
+import os, shutil, sys, tempfile, unittest
+import numpy
+from dbfpy import dbf
+
+# test this version of districtSummary
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..")))
+
+import districtSummary
+
+ZONES = 23
+
+class TestDistrictSummary(unittest.TestCase):
+
+    def setUp(self):
+        """ Zones 1-20 in districts 10, 20 and 40, and a district 30 with only a zone past the last one
+        """
+        rs = numpy.random.RandomState(1)
+        self.tazToDist = dict((taz, 10*rs.randint(1, 3)) for taz in range(1, 21))
+        self.tazToDist[5]  = 40
+        self.tazToDist[30] = 30
+        self.matrix  = rs.rand(ZONES, ZONES)*10
+        self.matrix[rs.rand(ZONES, ZONES) < 0.3] = 0
+        self.weights = rs.rand(ZONES, ZONES)
+
+        # the dense district x zone matrix P, so the summaries are P.M.P'
+        self.P = numpy.zeros((4, ZONES))
+        for (taz, dist) in self.tazToDist.iteritems():
+            if taz <= ZONES: self.P[dist/10-1, taz-1] = 1.0
+
+    def tearDown(self):
+        districtSummary.BLOCK_ROWS = 500
+
+    def product(self, matrix):
+        return numpy.dot(numpy.dot(self.P, matrix), self.P.T)
+
+    def test_district_groups(self):
+        (districts, zoneDists) = districtSummary.districtGroups(self.tazToDist, ZONES)
+        self.assertEqual(districts, [10, 20, 30, 40])
+        self.assertEqual(zoneDists[4], 3)
+        self.assertEqual(zoneDists[20:].tolist(), [-1, -1, -1])
+
+    def test_summarize(self):
+        (districts, zoneDists) = districtSummary.districtGroups(self.tazToDist, ZONES)
+        for blockRows in [4, 500]:
+            districtSummary.BLOCK_ROWS = blockRows
+            stats = districtSummary.summarize(zoneDists, len(districts), self.matrix)
+            self.assertTrue(numpy.allclose(stats["SUM"], self.product(self.matrix)))
+            self.assertTrue(numpy.allclose(stats["CNT"], self.product((self.matrix != 0)*1.0)))
+            counts = self.product(numpy.ones((ZONES, ZONES)))
+            has    = (counts > 0)
+            self.assertTrue(numpy.allclose(stats["AVG"][has], self.product(self.matrix)[has]/counts[has]))
+            self.assertTrue(numpy.all(stats["AVG"][2] == 0))
+
+            stats = districtSummary.summarize(zoneDists, len(districts), self.matrix, self.weights)
+            weighted = self.product(self.matrix*self.weights)[has]/self.product(self.weights)[has]
+            self.assertTrue(numpy.allclose(stats["AVG"][has], weighted))
+
+    def test_dbf_field_names(self):
+        self.assertEqual(districtSummary.dbfFieldNames(["S_time", "S_traveltime1", "S_traveltime2", "s_TRAVELTI"]),
+                         ["S_TIME", "S_TRAVELTI", "S_TRAVELT1", "S_TRAVELT2"])
+        self.assertEqual(districtSummary.dbfFieldNames(["ORIG"], ["ORIG", "DEST"]), ["ORIG1"])
+
+    def test_write_dbf(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tempdir, "summary.dbf")
+            stats = dict((stat, numpy.array([[1.0, 2.0], [3.0, 4.0]])) for stat in districtSummary.STATISTICS)
+            stats2 = dict((stat, 2*values) for (stat, values) in stats.iteritems())
+            districtSummary.writeDbf(fname, [1, 2], [("traveltime1", stats), ("traveltime2", stats2)])
+            outdbf = dbf.Dbf(fname, readOnly=True)
+            self.assertEqual(outdbf.fieldNames, ["ORIG", "DEST", "S_TRAVELTI", "A_TRAVELTI", "C_TRAVELTI",
+                                                 "S_TRAVELT1", "A_TRAVELT1", "C_TRAVELT1"])
+            self.assertEqual(outdbf[3]["S_TRAVELTI"], 4.0)
+            self.assertEqual(outdbf[3]["S_TRAVELT1"], 8.0)
+            outdbf.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import os, shutil, sys, tempfile, unittest, warnings
+import numpy
+import tables
+
+# test this version of hdf5
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..")))
+
+import hdf5
+from hdf5 import H5Matrix, CODECS, ROW_CHUNK_BYTES
+
+ZONES   = 10
+NUMROWS = 3     # block size, so the last block is partial
+
+class TestH5Matrix(unittest.TestCase):
+
+    def setUp(self):
+        """ An H5Matrix with three named tables of random values
+        """
+        self.tempdir = tempfile.mkdtemp()
+        self.fname   = os.path.join(self.tempdir, "test.h5")
+        self.values  = numpy.random.RandomState(1).rand(3, ZONES, ZONES)*100
+        self.h5      = H5Matrix.create(self.fname, zones=ZONES, tnames=["time", "dist", "toll"])
+        for t in range(1, 4):
+            self.h5[t][:] = self.values[t-1]
+
+    def tearDown(self):
+        self.h5.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_create_open(self):
+        self.h5.close()
+        self.h5 = H5Matrix.open(self.fname)
+        self.assertEqual(self.h5.zones, ZONES)
+        self.assertEqual(self.h5.matrices, 3)
+        self.assertEqual(sorted(self.h5.keys()), [1, 2, 3])
+        self.assertEqual([self.h5[t].attrs.name for t in range(1, 4)], ["time", "dist", "toll"])
+        self.assertTrue(numpy.array_equal(self.h5[2][:], self.values[1]))
+
+    def test_row_blocks(self):
+        blocks = list(self.h5.row_blocks([3, 1], numrows=NUMROWS))
+        self.assertEqual([first for (first, block) in blocks], [0, 3, 6, 9])
+        self.assertEqual(blocks[-1][1].shape, (2, 1, ZONES))
+        self.assertTrue(numpy.array_equal(numpy.concatenate([block for (first, block) in blocks], axis=1),
+                                          self.values[[2, 0]]))
+
+    def test_read_tables(self):
+        self.assertTrue(numpy.array_equal(self.h5.read_tables(), self.values))
+        self.assertTrue(numpy.array_equal(self.h5.read_tables([2]), self.values[1:2]))
+
+    def test_write_tables(self):
+        self.h5.write_tables(self.values[::-1], numrows=NUMROWS)
+        self.assertTrue(numpy.array_equal(self.h5.read_tables(), self.values[::-1]))
+        self.h5.write_tables(self.values[:1], tables=[2], numrows=NUMROWS)
+        self.assertTrue(numpy.array_equal(self.h5[2][:], self.values[0]))
+        self.assertRaises(ValueError, self.h5.write_tables, self.values[:2])
+
+    def test_sum_tables(self):
+        self.assertTrue(numpy.allclose(self.h5.sum_tables([1, 2], numrows=NUMROWS),
+                                       self.values[0] + self.values[1]))
+        self.assertTrue(numpy.allclose(self.h5.sum_tables([1, 2, 3], [1, 0.5, -2], numrows=NUMROWS),
+                                       self.values[0] + 0.5*self.values[1] - 2*self.values[2]))
+        self.assertRaises(ValueError, self.h5.sum_tables, [1, 2], [1])
+        self.assertRaises(ValueError, self.h5.sum_tables, [1], [1, 2])
+
+    def test_sum_tables_out(self):
+        self.h5.sum_tables([2, 3], [2, 1], out=1, numrows=NUMROWS)
+        self.assertTrue(numpy.allclose(self.h5[1][:], 2*self.values[1] + self.values[2]))
+
+        # in place: add 3 times table 3 to table 2
+        self.h5.sum_tables([2, 3], [1, 3], out=2, numrows=NUMROWS)
+        self.assertTrue(numpy.allclose(self.h5[2][:], self.values[1] + 3*self.values[2]))
+        self.assertTrue(numpy.array_equal(self.h5[3][:], self.values[2]))
+
+def codecAvailable(complib):
+    """ Returns True if this PyTables has the compression library *complib*
+    """
+    try:
+        return tables.whichLibVersion(complib) != None
+    except ValueError:
+        return False
+
+class TestH5MatrixStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname   = os.path.join(self.tempdir, "test.h5")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def roundTrip(self, zones=ZONES, **kwargs):
+        """ Writes a table with the create *kwargs*, checks it reads back the same, and returns
+            its (filters, chunkshape, dtype)
+        """
+        values = numpy.random.RandomState(2).rand(zones, zones)*100
+        h5 = H5Matrix.create(self.fname, zones=zones, tnames=["time"], **kwargs)
+        h5[1][:] = values
+        h5.close()
+        h5 = H5Matrix.open(self.fname)
+        read = h5[1][:]
+        (filters, chunkshape, dtype) = (h5[1].filters, h5[1].chunkshape, h5[1].dtype)
+        h5.close()
+        self.assertTrue(numpy.allclose(read, values.astype(kwargs.get("dtype", numpy.float64))))
+        return (filters, chunkshape, dtype)
+
+    def test_codecs(self):
+        for (codec, complib) in sorted(CODECS.items()):
+            if not codecAvailable(complib): continue
+            (filters, chunkshape, dtype) = self.roundTrip(codec=codec, level=3)
+            self.assertEqual((filters.complib, filters.complevel), (complib, 3))
+        (filters, chunkshape, dtype) = self.roundTrip(codec=None)
+        self.assertEqual(filters.complevel, 0)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, H5Matrix.create, self.fname, zones=ZONES, tnames=["time"], codec="gzip")
+        self.assertFalse(os.path.exists(self.fname))
+
+    def test_dtype(self):
+        (filters, chunkshape, dtype) = self.roundTrip(dtype=numpy.float32)
+        self.assertEqual(dtype, numpy.float32)
+
+    def test_chunkshape(self):
+        zones = 1000
+        (filters, chunkshape, dtype) = self.roundTrip(zones=zones, chunkshape="rows")
+        self.assertEqual(chunkshape, (ROW_CHUNK_BYTES//(8*zones), zones))
+        (filters, chunkshape, dtype) = self.roundTrip(chunkshape="table")
+        self.assertEqual(chunkshape, (ZONES, ZONES))
+        (filters, chunkshape, dtype) = self.roundTrip(chunkshape="rows")
+        self.assertEqual(chunkshape, (ZONES, ZONES))
+        (filters, chunkshape, dtype) = self.roundTrip(chunkshape=(2, 5))
+        self.assertEqual(chunkshape, (2, 5))
+
+class TestH5MatrixMmap(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname   = os.path.join(self.tempdir, "test.h5")
+        self.values  = numpy.random.RandomState(3).rand(ZONES, ZONES)*100
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def openMapped(self):
+        """ Returns (the H5Matrix opened with mmap=True, the warnings it gave)
+        """
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            h5 = H5Matrix.open(self.fname, mmap=True)
+        return (h5, caught)
+
+    @unittest.skipIf(hdf5.h5py == None, "needs h5py")
+    def test_contiguous(self):
+        # a contiguous (not chunked) table, which H5Matrix.create doesn't make
+        h5file = tables.openFile(self.fname, mode="w")
+        h5file.setNodeAttr('/','zones', numpy.array([ZONES], numpy.int32))
+        h5file.setNodeAttr('/','tables', numpy.array([1], numpy.int32))
+        h5file.createArray(h5file.root, "1", self.values)
+        h5file.close()
+
+        (h5, caught) = self.openMapped()
+        self.assertEqual(len(caught), 0)
+        self.assertTrue(isinstance(h5[1], numpy.memmap))
+        self.assertTrue(numpy.array_equal(h5[1], self.values))
+        self.assertTrue(numpy.array_equal(h5.read_tables()[0], self.values))
+        self.assertRaises((ValueError, RuntimeError), h5[1].__setitem__, (0, 0), 1.0)
+        h5.close()
+
+    @unittest.skipIf(hdf5.h5py == None, "needs h5py")
+    def test_single_chunk(self):
+        h5 = H5Matrix.create(self.fname, zones=ZONES, tnames=["time"], codec=None, chunkshape="table")
+        h5[1][:] = self.values
+        h5.close()
+
+        # mapped if this h5py can find the chunk, otherwise read as usual
+        (h5, caught) = self.openMapped()
+        self.assertEqual(len(caught), 0 if isinstance(h5[1], numpy.memmap) else 1)
+        self.assertTrue(numpy.array_equal(h5[1][:], self.values))
+        h5.close()
+
+    @unittest.skipIf(hdf5.h5py == None, "needs h5py")
+    def test_chunked(self):
+        for (codec, chunkshape) in [("zlib", None), (None, (3, ZONES))]:
+            h5 = H5Matrix.create(self.fname, zones=ZONES, tnames=["time", "dist"], codec=codec, chunkshape=chunkshape)
+            h5.write_tables(numpy.array([self.values, 2*self.values]))
+            h5.close()
+
+            (h5, caught) = self.openMapped()
+            self.assertEqual(len(caught), 2)
+            self.assertFalse(isinstance(h5[1], numpy.memmap))
+            self.assertTrue(numpy.array_equal(h5[2][:], 2*self.values))
+            h5.close()
+
+    def test_no_h5py(self):
+        h5 = H5Matrix.create(self.fname, zones=ZONES, tnames=["time"], codec=None, chunkshape="table")
+        h5.close()
+        h5py = hdf5.h5py
+        hdf5.h5py = None
+        try:
+            self.assertRaises(ImportError, H5Matrix.open, self.fname, mmap=True)
+        finally:
+            hdf5.h5py = h5py
+
+
+if __name__ == '__main__':
+    unittest.main()
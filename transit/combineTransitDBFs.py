@@ -2,10 +2,10 @@
 
 """ Combines DBFs from Cube TRNBUILD Output """
 
-import getopt,logging,os,sys,traceback
+import getopt,logging,multiprocessing,os,sys,traceback
 WRANGLER_DIR = os.path.realpath(os.path.join(os.path.split(__file__)[0], "..", "lib"))
 sys.path.insert(0, WRANGLER_DIR)
-from Wrangler import TransitAssignmentData, TransitCapacity
+from Wrangler import TransitAssignmentData, DailyTransitAssignmentData, TransitCapacity
 
 __author__ = "Lisa Zorn, San Francisco County Transportation Authority"
 __license__= "GPL"
@@ -14,13 +14,14 @@ __date__   = "2008-07-07"
 
 USAGE            = """
 Usage: 
-  python combineTransitDBFs.py [-a] timeperiod input_dir [outputfile] champtype runType
+  python combineTransitDBFs.py [-a] [-j workers] timeperiod input_dir [outputfile] champtype runType
 
   Opens local files SF[ABW,APW,WBA,WBW,WLW,WMW,WPA,WPW][timeperiod].dbf
      and outputs aggregate dbf file [outputfile]
   Uses local files transitLineToVehicle.csv and transitVehicleToCapacity.csv for capacity lookup.
      
   -a to add rows for "ALL" lines (e.g. aggregate for a given A,B)
+  -j to process the time periods in parallel with the given number of worker processes (for ALL)
   timeperiod can be AM,MD,PM,EV,EA, ALL or DAILY; 
                  If ALL then no outputfile need be specified they will be created in input_dir/transit_*.dbf
                  If DAILY then ALL will be created as described above, plus a DAILY version.
@@ -43,14 +44,19 @@ Usage:
 #   (3) had it pass the TAD the capacity info (previously it used a defunct default)
 # Revised 2011-01-2011 by LMZ to:
 #   Use CHAMP's TransitAssignmentData
+# Revised to optionally run the time periods in parallel in runAll, sharing the capacity lookup
 
 class TransitDbfCombiner:
     
+    # the "all" run type keeps every access, egress and transfer row, so read the csvs in chunks
+    ALL_CSV_CHUNK_SIZE = 500000
+
     def __init__(self, timeperiod,runDir,outFile,
-                 champType='champ4',runType='',includeAll=False):
+                 champType='champ4',runType='',includeAll=False,transitCapacity=None):
         """ 
         Interpret the args into my local variables.
         ALL CAPS class variables indicate arg-based constants.
+        Pass *transitCapacity* to reuse an already-read capacity lookup; otherwise it's read from *runDir*.
         """
         self.timeperiod = timeperiod
         if self.timeperiod not in ["AM", "MD", "PM", "EV", "EA"]:
@@ -67,6 +73,7 @@ class TransitDbfCombiner:
         self.OUTFILE    = outFile
         self.runType    = runType
         self.includeAll=bool(includeAll)
+        self.transitCapacity = transitCapacity
         self.PROFILENODE= 0           
         
         if self.runType not in ["muni","bigBA","all"] and self.runType[0:7] != "profile":
@@ -90,7 +97,11 @@ class TransitDbfCombiner:
         logging.info("CHAMPTYPE  = " + self.CHAMPTYPE)
         
     def readTransitNameMapping(self):
+        if not self.transitCapacity:
+            self.transitCapacity = TransitCapacity(self.DIR)
+
         if self.runType=="muni" or self.runType=="bigBA" or self.runType=="all":
+            csvChunkSize = None
             if self.runType == "muni": 
                 system=["SF MUNI"]
                 ignoreModes=[11,12,13,14,15,16,17]
@@ -100,14 +111,15 @@ class TransitDbfCombiner:
             else: # system == "all":
                 system = []
                 ignoreModes = []
+                csvChunkSize = TransitDbfCombiner.ALL_CSV_CHUNK_SIZE
             
-            self.transitCapacity = TransitCapacity(self.DIR)
             self.tad = TransitAssignmentData(directory=self.DIR, 
                                              timeperiod=self.timeperiod,
                                              champtype=self.CHAMPTYPE,
                                              transitCapacity=self.transitCapacity,
                                              ignoreModes=ignoreModes,
-                                             system=system)
+                                             system=system,
+                                             csvChunkSize=csvChunkSize)
         else:
             self.tad = TransitAssignmentData(directory=self.DIR, 
                                              timeperiod=self.timeperiod,
@@ -122,28 +134,106 @@ class TransitDbfCombiner:
         # logging.debug(str(self.tad.linenameToAttributes))
         # logging.debug(str(self.tad.vehicleTypeToCapacity))
 
-def runAll(runDir,champType='champ4',runType='bigBA',includeAll=False, includeDaily=False):
-    
+class LogRecordCollector(logging.Handler):
+    """
+    Keeps (level, message) for the log records emitted in a worker process so the parent
+    can log them, in order, in its own log.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        
+    def emit(self, record):
+        self.records.append((record.levelno, self.format(record)))
+
+# set in each worker process by initWorker()
+workerCapacity = None
+
+def initWorker(transitCapacity, loglevel):
+    """
+    Initializes a worker process for runAll() with the shared *transitCapacity*.  The worker's
+    records are collected by runTimePeriod() instead of going to the parent's handlers.
+    """
+    global workerCapacity
+    workerCapacity = transitCapacity
+
+    rootLogger = logging.getLogger()
+    for handler in list(rootLogger.handlers):
+        rootLogger.removeHandler(handler)
+    rootLogger.setLevel(loglevel)
+
+def runTimePeriod(args):
+    """
+    Runs the TransitDbfCombiner for one time period in a worker process.
+    *args* is (timeperiod, runDir, outFile, champType, runType, includeAll).
+    Returns (timeperiod, list of (level, message) log records).
+    """
+    (timeperiod, runDir, outFile, champType, runType, includeAll) = args
+    collector = LogRecordCollector()
+    logging.getLogger().addHandler(collector)
+    try:
+        tdc = TransitDbfCombiner(timeperiod=timeperiod, runDir=runDir, outFile=outFile,
+                                 champType=champType, runType=runType, 
+                                 includeAll=includeAll, transitCapacity=workerCapacity)
+        tdc.readTransitNameMapping()
+    finally:
+        logging.getLogger().removeHandler(collector)
+    return (timeperiod, collector.records)
+
+def runAll(runDir,champType='champ4',runType='bigBA',includeAll=False, includeDaily=False, numWorkers=1):
+    """
+    Runs the TransitDbfCombiner for all five time periods.  The capacity lookup is read once and shared.
+    If *numWorkers* > 1, the time periods are processed in parallel in that many worker processes,
+    and their log records are added to this process's log, one time period at a time.
+    If *includeDaily*, the time periods are combined into daily line-level and link-level dbfs.
+    """
     print "Running all transit combiners"
     if 'transit' not in os.listdir(runDir):
         os.mkdir(os.path.join(runDir,"transit"))
     outDir = os.path.join(runDir,"transit")
+    transitCapacity = TransitCapacity(runDir)
 
-    dailytdcs = {}
-    for tp in ['AM','MD','PM','EV','EA']:
-        print "Running ",tp
-        outFile= os.path.join(outDir,'vehicles_'+tp+'.dbf')
-        tdc = TransitDbfCombiner(timeperiod=tp, runDir=runDir, outFile=outFile,
-                                 champType=champType, runType=runType, 
-                                 includeAll=includeAll)
-        tdc.readTransitNameMapping()
-        
-        if includeDaily:
-            dailytdcs[tp] = tdc
+    timeperiods = ['AM','MD','PM','EV','EA']
+    dailytads = {}
+    if numWorkers > 1:
+        pool = multiprocessing.Pool(processes=min(numWorkers, len(timeperiods)),
+                                    initializer=initWorker,
+                                    initargs=(transitCapacity, logging.getLogger().getEffectiveLevel()))
+        try:
+            results = pool.map(runTimePeriod,
+                               [(tp, runDir, os.path.join(outDir,'vehicles_'+tp+'.dbf'), 
+                                 champType, runType, includeAll) for tp in timeperiods])
+        finally:
+            pool.close()
+            pool.join()
+
+        # merge the logs
+        for (tp, records) in results:
+            for (level, message) in records:
+                logging.log(level, "[%s] %s" % (tp, message))
+    else:
+        for tp in timeperiods:
+            print "Running ",tp
+            outFile= os.path.join(outDir,'vehicles_'+tp+'.dbf')
+            tdc = TransitDbfCombiner(timeperiod=tp, runDir=runDir, outFile=outFile,
+                                     champType=champType, runType=runType, 
+                                     includeAll=includeAll, transitCapacity=transitCapacity)
+            tdc.readTransitNameMapping()
+            
+            if includeDaily:
+                dailytads[tp] = tdc.tad
     
     if not includeDaily: return
     
-    # TODO make a daily!
+    print "Running DAILY"
+    for tp in timeperiods:
+        if tp in dailytads: continue
+        # processed in a worker -- read back the line-level dbf that it wrote
+        dailytads[tp] = TransitAssignmentData(timeperiod=tp, champtype=champType,
+                                              transitCapacity=transitCapacity,
+                                              lineLevelAggregateFilename=os.path.join(outDir,'vehicles_'+tp+'.dbf'))
+    dailytad = DailyTransitAssignmentData(*[dailytads[tp] for tp in timeperiods])
+    dailytad.writeDbfs(os.path.join(outDir,'vehicles_DAILY.dbf'), os.path.join(outDir,'agg_vehicles_DAILY.dbf'))
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, 
@@ -151,23 +241,21 @@ if __name__ == '__main__':
                         datefmt='%Y-%b-%d %H:%M:%S',)
     # python combineTransitDBFs.py [-a] timeperiod input_dir [outputfile] champtype runType
 
-    opts, args = getopt.getopt(sys.argv[1:], "a")
+    opts, args = getopt.getopt(sys.argv[1:], "aj:")
     
     includeAll = False
+    numWorkers = 1
     for o,a in opts:
         if o=="-a": includeAll = True
+        if o=="-j": numWorkers = int(a)
     
     if len(args) < 4: 
         print USAGE
         exit(1)
         
-    if args[0] == "DAILY":
-        print "DAILY not functional yet."
-        exit(1)
-        
-    if args[0] == "ALL":
+    if args[0] in ["ALL", "DAILY"]:
         runAll(runDir=args[1], champType=args[2], runType=args[3], includeAll=includeAll, 
-               includeDaily=(args[0]=="DAILY"))
+               includeDaily=(args[0]=="DAILY"), numWorkers=numWorkers)
 
     else:
         tdc = TransitDbfCombiner(timeperiod=args[0], runDir=args[1], outFile=args[2],
@@ -2,7 +2,7 @@
 # Original revision: Lisa Zorn 2010-8-5
 # based on old "combineTransitDBFs.py"
 #
-import csv,os,logging,string,sys,xlrd
+import csv,os,logging,numpy,string,sys,xlrd
 from dataTable import DataTable, dbfTableReader, FieldType
 from .TransitCapacity import TransitCapacity
 from .TransitLine import TransitLine
@@ -10,19 +10,55 @@ from .Logger import WranglerLogger
 from .NetworkException import NetworkException
 from collections import defaultdict
 
-__all__ = ['TransitAssignmentData', 'TransitAssignmentDataException']
+__all__ = ['TransitAssignmentData', 'DailyTransitAssignmentData', 'TransitAssignmentDataException',
+           'fleetCharacteristics']
 
 class TransitAssignmentDataException(Exception): pass
 
+def groupRows(tableArray, keyFields):
+    """
+    Groups the rows of the structured array *tableArray* by the values of *keyFields*.
+    Returns (*groupIds*, *firstRows*), where *groupIds* is the group number for each row and
+    *firstRows* is the first row of each group.  Groups are numbered in order of first appearance.
+    """
+    return groupKeys([tableArray[field] for field in keyFields])
+
+def groupKeys(keys):
+    """
+    Like :py:func:`groupRows`, but groups by the values of the list of equal-length arrays *keys*.
+    """
+    numRows    = len(keys[0])
+
+    # stable sort on the keys (last key is primary for lexsort)
+    order      = numpy.lexsort(list(reversed(keys)))
+    newGroup   = numpy.zeros(numRows, dtype=bool)
+    newGroup[:1] = True
+    for key in keys:
+        sortedKey = key[order]
+        newGroup[1:] |= (sortedKey[1:] != sortedKey[:-1])
+    groupIds   = numpy.zeros(numRows, dtype=numpy.int64)
+    groupIds[order] = numpy.cumsum(newGroup) - 1
+    firstRows  = order[newGroup]
+
+    # renumber in order of first appearance
+    appearance = numpy.argsort(firstRows, kind='mergesort')
+    rank       = numpy.zeros(len(firstRows), dtype=numpy.int64)
+    rank[appearance] = numpy.arange(len(firstRows))
+    return (rank[groupIds], firstRows[appearance])
+
+
 class TransitAssignmentData:
     
     TIMEPERIOD_TO_VEHTYPIDX = { "AM":2, "MD": 4, "PM":3, "EV":4, "EA":4 }
 
+    # for joining the csvs with the dbf; the most times an A,B can appear in one file
+    MAX_LINK_REPEATS = 2**20
     
     def __init__(self, directory=".", timeperiod="AM", champtype="champ4", muniTEP=True, ignoreModes=[], 
                  system=[], profileNode=False,tpfactor="quickboards",grouping=None,
                  transitCapacity=None,
-                 lineLevelAggregateFilename=None, linkLevelAggregateFilename=None):
+                 lineLevelAggregateFilename=None, linkLevelAggregateFilename=None,
+                 csvChunkSize=None):
         """
 
            * *directory* is the location of the transit assignment files
@@ -39,6 +75,8 @@ class TransitAssignmentData:
            * If *lineLevelAggregateFilename* or *linkLevelAggregateFilename* are passed in, then
              it is assumed that the many transit assignment dbfs have already been aggregated (likely
              by this very class!) and we should just read those instead of doing the work again.
+           * Pass *csvChunkSize* to read the transit assignment csvs that many rows at a time, for
+             very large runs; then memory use depends on the size of the tables rather than the csvs.
         """
         
              
@@ -64,6 +102,7 @@ class TransitAssignmentData:
         else:
             self.capacity   = TransitCapacity()
         self.csvColnames= None # uninitialized           
+        self.csvChunkSize = csvChunkSize
 
         if self.timeperiod not in ["AM", "MD", "PM", "EV", "EA"]:
             raise TransitAssignmentDataException("Invalid timeperiod "+str(timeperiod))
@@ -139,7 +178,7 @@ class TransitAssignmentData:
     def initializeFields(self, headerRow=None):
         """
         Initializes the *trnAsgnFields*, *trnAsgnCopyFields*, *trnAsgnAdditiveFields*,
-        and *aggregateFields*
+        *csvFields* and *aggregateFields*
         """
         if headerRow:
             self.csvColnames = headerRow
@@ -193,6 +232,17 @@ class TransitAssignmentData:
         for field in self.trnAsgnAdditiveFields:
             self.trnAsgnFields[field]='f4'
 
+        # the columns we read from the csv, and how we read them
+        self.csvFields = []
+        for field in self.trnAsgnCopyFields + self.trnAsgnAdditiveFields:
+            if field in ['TIME','DIST']:
+                self.csvFields.append((field, 'f8'))    # scaled to 100ths later
+            elif self.trnAsgnFields[field][0] in ['u','b']:
+                self.csvFields.append((field, 'i4'))
+            elif self.trnAsgnFields[field][0] == 'f':
+                self.csvFields.append((field, 'f8'))
+            else:
+                self.csvFields.append((field, 'S40'))   # don't truncate line names before lookups
 
         # Calculated at the end
         self.trnAsgnFields["LOAD"]      ='f4'
@@ -212,13 +262,321 @@ class TransitAssignmentData:
             self.aggregateFields[field]='f4'
 
 
+    def readTransitAssignmentCsv(self, filename):
+        """
+        Reads the given transit assignment csv in a single pass and returns a numpy structured
+        array with one column per field that we use (see *csvFields*).  Empty cells are read as zero,
+        and NAME and OWNER are stripped.  Initializes the fields if they haven't been yet.
+        """
+        return self.readTransitAssignmentCsvChunks(filename).next()
+
+    def readTransitAssignmentCsvChunks(self, filename, chunkSize=None):
+        """
+        Like :py:meth:`readTransitAssignmentCsv`, but yields arrays of at most *chunkSize* rows
+        (or one array for the whole file if *chunkSize* is None).  Always yields at least one array.
+        """
+        filereader = csv.reader(open(filename, 'rb'), delimiter=',', quoting=csv.QUOTE_NONE)
+        rows       = []
+        firstRow   = True
+        numChunks  = 0
+        for row in filereader:
+            # header row?
+            if firstRow:
+                firstRow = False
+                if row[0]=="A":
+                    if not self.csvColnames: self.initializeFields(row)
+                    continue
+            if not self.csvColnames: self.initializeFields()
+
+            rows.append(row)
+            if chunkSize and len(rows) == chunkSize:
+                yield self.csvRowsToArray(rows, filename)
+                numChunks += 1
+                rows = []
+        del filereader
+
+        if not self.csvColnames: self.initializeFields()
+        if len(rows) > 0 or numChunks == 0:
+            yield self.csvRowsToArray(rows, filename)
+
+    def csvRowsToArray(self, rows, filename):
+        """
+        Converts the list of csv *rows* (lists of strings) into columns; see :py:meth:`readTransitAssignmentCsv`.
+        """
+        csvArray = numpy.zeros(len(rows), dtype=self.csvFields)
+        if len(rows) == 0: return csvArray
+
+        columns = zip(*rows)
+        for (field, fieldtype) in self.csvFields:
+            column = numpy.array(columns[self.colnameToCsvIndex[field]])
+            try:
+                if fieldtype[0] == 'S':
+                    csvArray[field] = numpy.char.strip(column)
+                else:
+                    csvArray[field] = numpy.where(column=="", "0", column).astype(fieldtype)
+            except ValueError:
+                WranglerLogger.fatal("Error intepreting field %s: [%s] in %s" % (field, str(self.colnameToCsvIndex[field]), filename))
+                WranglerLogger.fatal(sys.exc_info()[1])
+                sys.exit(2)
+        return csvArray
+
+    def filterTransitAssignmentCsv(self, csvArray, mode):
+        """
+        Returns a boolean mask for the rows of *csvArray* (as returned by :py:meth:`readTransitAssignmentCsv`)
+        that we keep, based on the *profileNode*, *ignoreModes* and *system* configuration.
+        """
+        keep = numpy.ones(len(csvArray), dtype=bool)
+
+        if self.profileNode:
+            keep &= (csvArray["A"]==self.profileNode) | (csvArray["B"]==self.profileNode)
+            for row in csvArray[keep & (csvArray["AB_VOL"] > 0)]:
+                WranglerLogger.info("Link %d %d for mode %s has AB_VOL %s" % (row["A"], row["B"], mode, str(row["AB_VOL"])))
+
+        if len(self.ignoreModes)>0:
+            keep &= numpy.logical_not(numpy.in1d(csvArray["MODE"], self.ignoreModes))
+
+        # exclude this system?  Only look up each line once
+        if len(self.system)>0:
+            (linenames, lineIdx) = numpy.unique(csvArray["NAME"], return_inverse=True)
+            keepLine = numpy.array([self.capacity.getSystemAndVehicleType(linename, self.timeperiod)[0] in self.system
+                                    for linename in linenames], dtype=bool)
+            keep &= keepLine[lineIdx]
+        return keep
+
+    def readTransitAssignmentDbf(self):
+        """
+        Reads the columns we need from ``SFWBW[timeperiod].dbf`` once, since FREQ and SEQ are
+        missing from the csvs.  Returns a dictionary of column name -> numpy array, indexed for
+        joining by :py:meth:`indexTransitAssignmentDbf`.
+        """
+        indbf = dbfTableReader(os.path.join(self.assigndir, "SFWBW" + self.timeperiod + ".dbf"))
+        dbfColumns = {}
+        for field in ["A","B","FREQ","SEQ","NAME"]:
+            dbfColumns[field] = numpy.array(indbf._array[field])
+        del indbf
+        return self.indexTransitAssignmentDbf(dbfColumns)
+
+    def indexTransitAssignmentDbf(self, dbfColumns):
+        """
+        Adds the join index to *dbfColumns* (A, B and NAME arrays from the dbf) and returns it:
+        the sorted upper-case line names as LINENAMES, the sorted ids from :py:meth:`linkIds` as LINKS,
+        and the keys from :py:meth:`linkKeys` sorted as KEYSORTED with their row order in KEYORDER.
+        """
+        dbfColumns["NAME"]      = numpy.char.upper(numpy.char.strip(dbfColumns["NAME"]))
+        dbfColumns["LINENAMES"] = numpy.unique(dbfColumns["NAME"])
+        dbfLinkIds              = self.linkIds(dbfColumns["A"], dbfColumns["B"], dbfColumns["NAME"], dbfColumns["LINENAMES"])
+        (dbfColumns["LINKS"], dbfLinkIds) = numpy.unique(dbfLinkIds, return_inverse=True)
+
+        dbfKey = self.linkKeys(dbfLinkIds)
+        dbfColumns["KEYORDER"]  = numpy.argsort(dbfKey, kind='mergesort')
+        dbfColumns["KEYSORTED"] = dbfKey[dbfColumns["KEYORDER"]]
+        return dbfColumns
+
+    def joinTransitAssignmentDbf(self, csvArray, keep, dbfColumns, filename, joinState=None):
+        """
+        Aligns the rows of *csvArray* with the rows of the dbf (as returned by 
+        :py:meth:`readTransitAssignmentDbf`) with a sorted join on the keys from :py:meth:`linkKeys`,
+        so each csv row is matched with the same occurrence of its A,B on the same line.
+        Node numbers 100000 and above aren't compared, so rows with those are matched by walking
+        forward from the previous matched row to the next dbf row for the same line,
+        as the dbf and csvs are in the same order.
+        
+        If *csvArray* is one chunk of the file, pass the same *joinState* dictionary for each chunk,
+        in order; it keeps track of where we are in the file.
+        
+        Returns an array of dbf row numbers, one for each row in *csvArray*.  Raises
+        a :py:class:`NetworkException` listing all of the kept rows that couldn't be matched.
+        """
+        if joinState is None: joinState = {}
+        rowOffset    = joinState.get("ROWOFFSET", 0)
+        numDbfRows   = len(dbfColumns["A"])
+
+        csvNames     = numpy.char.upper(csvArray["NAME"])
+        csvBig       = (csvArray["A"] >= 100000) | (csvArray["B"] >= 100000)
+        csvLinkIds   = self.linkIds(csvArray["A"], csvArray["B"], csvNames, dbfColumns["LINENAMES"], dbfColumns["LINKS"])
+        csvKey       = self.linkKeys(csvLinkIds, joinState.setdefault("LINKCOUNTS", {}))
+
+        dbfKeySorted = dbfColumns["KEYSORTED"]
+        pos          = numpy.searchsorted(dbfKeySorted, csvKey)
+        matched      = (pos < numDbfRows) & (csvLinkIds >= 0)
+        matched[matched] = dbfKeySorted[pos[matched]] == csvKey[matched]
+        matched     &= numpy.logical_not(csvBig)
+        dbfRowNums   = numpy.zeros(len(csvKey), dtype=numpy.int64)
+        dbfRowNums[matched] = dbfColumns["KEYORDER"][pos[matched]]
+
+        # rows with big node numbers are rare; walk forward from the previous matched row
+        # until the line and the node numbers we can compare agree
+        prevRowNums  = numpy.maximum.accumulate(numpy.where(matched, numpy.arange(len(csvKey)), -1))
+        lastBigRow   = -1
+        for rownum in numpy.nonzero(csvBig)[0]:
+            prevRow = max(prevRowNums[rownum], lastBigRow)
+            if prevRow >= 0:
+                dbfRowNum = dbfRowNums[prevRow] + 1
+            elif "LASTMATCH" in joinState:
+                dbfRowNum = joinState["LASTMATCH"][1] + 1
+            else:
+                dbfRowNum = 0
+            (A, B, name) = (csvArray["A"][rownum], csvArray["B"][rownum], csvNames[rownum])
+            while (dbfRowNum < numDbfRows and
+                   ((dbfColumns["NAME"][dbfRowNum] != name) or
+                    ((A < 100000) and (dbfColumns["A"][dbfRowNum] != A)) or
+                    ((B < 100000) and (dbfColumns["B"][dbfRowNum] != B)))):
+                dbfRowNum += 1
+            if dbfRowNum < numDbfRows:
+                dbfRowNums[rownum] = dbfRowNum
+                matched[rownum]    = True
+                lastBigRow         = rownum
+
+        unmatched = numpy.nonzero(keep & numpy.logical_not(matched))[0]
+        if len(unmatched) > 0:
+            for rownum in unmatched:
+                WranglerLogger.fatal("No dbf row for %s row %d: A=%d B=%d NAME=%s" % 
+                                     (filename, rowOffset + rownum, csvArray["A"][rownum], csvArray["B"][rownum],
+                                      csvArray["NAME"][rownum]))
+            raise NetworkException("%d rows of %s couldn't be matched with SFWBW%s.dbf" % 
+                                   (len(unmatched), filename, self.timeperiod))
+
+        # for the next chunk
+        matchedRows = numpy.nonzero(matched)[0]
+        if len(matchedRows) > 0:
+            joinState["LASTMATCH"] = (rowOffset + matchedRows[-1], dbfRowNums[matchedRows[-1]])
+        joinState["ROWOFFSET"] = rowOffset + len(csvKey)
+        return dbfRowNums
+
+    def linkIds(self, A, B, names, lineNames, links=None):
+        """
+        Given arrays of node numbers *A* and *B* and upper-case line *names*, returns an int64 id
+        for the (A, B, line) of each row, with the lines numbered by their position in the sorted
+        array *lineNames*.  Node numbers 100000 and above are lumped together.
+        
+        If the sorted array of ids *links* is passed, the ids are renumbered to their positions in it.
+        Rows whose line or (A, B, line) isn't there get -1.
+        """
+        lineIds   = numpy.searchsorted(lineNames, names)
+        found     = lineIds < len(lineNames)
+        found[found] = lineNames[lineIds[found]] == names[found]
+        ids       = (numpy.minimum(A, 100000).astype(numpy.int64)*100001 + numpy.minimum(B, 100000))*len(lineNames) + lineIds
+        if links is not None:
+            pos   = numpy.searchsorted(links, ids)
+            found&= pos < len(links)
+            found[found] = links[pos[found]] == ids[found]
+            ids   = pos
+        ids[numpy.logical_not(found)] = -1
+        return ids
+
+    def linkKeys(self, linkIds, linkCounts=None):
+        """
+        Given an array of *linkIds* (see :py:meth:`linkIds`), returns an int64 key for each row that
+        combines the id with the number of times that id occurred in earlier rows.
+        
+        To continue counting from a previous call (e.g. for the next chunk of a file), pass the
+        same *linkCounts* dictionary each time; it's updated with the counts so far.
+        """
+        linkKey   = linkIds.astype(numpy.int64)
+        order     = numpy.argsort(linkKey, kind='mergesort')  # stable, so file order is kept within a link
+        sortedKey = linkKey[order]
+        positions = numpy.arange(len(linkKey))
+        newLink   = numpy.ones(len(linkKey), dtype=bool)
+        newLink[1:] = sortedKey[1:] != sortedKey[:-1]
+        linkStart = numpy.maximum.accumulate(numpy.where(newLink, positions, 0))
+        ordinals  = numpy.zeros(len(linkKey), dtype=numpy.int64)
+        ordinals[order] = positions - linkStart
+
+        if linkCounts is not None:
+            prevKeys   = linkCounts.get("KEYS",   numpy.zeros(0, dtype=numpy.int64))
+            prevCounts = linkCounts.get("COUNTS", numpy.zeros(0, dtype=numpy.int64))
+            pos        = numpy.searchsorted(prevKeys, linkKey)
+            found      = pos < len(prevKeys)
+            found[found] = prevKeys[pos[found]] == linkKey[found]
+            ordinals[found] += prevCounts[pos[found]]
+
+            # add this call's counts
+            starts     = positions[newLink]
+            allKeys    = numpy.concatenate((prevKeys, sortedKey[newLink]))
+            allCounts  = numpy.concatenate((prevCounts, numpy.diff(numpy.append(starts, len(linkKey)))))
+            (linkCounts["KEYS"], inverse) = numpy.unique(allKeys, return_inverse=True)
+            linkCounts["COUNTS"] = numpy.bincount(inverse, weights=allCounts).astype(numpy.int64)
+        return linkKey*TransitAssignmentData.MAX_LINK_REPEATS + ordinals
+
+    def buildLinkIndex(self, A, B, names, seq):
+        """
+        Builds *linkIndex*, a dictionary mapping (A, B, line id, SEQ) integers to row numbers in
+        *trnAsgnTable*.  Line names are interned to small ints in *lineNames* and *lineNameToId*.
+        The line id and SEQ of each row are kept in *rowLineIds* and *rowLinkSeq*.
+        
+        A/B/NAME/SEQ aren't always unique, so where a nonzero SEQ is repeated, the next unused SEQ is used.
+        Returns the (possibly faked) SEQ for each row.
+        """
+        (self.lineNames, lineIds) = numpy.unique(numpy.char.upper(names), return_inverse=True)
+        self.lineNames   = self.lineNames.tolist()
+        self.lineNameToId= dict((linename, lineId) for (lineId, linename) in enumerate(self.lineNames))
+        self.rowLineIds  = lineIds
+
+        linkSeq   = seq.astype(numpy.int64)
+        self.rowLinkSeq  = linkSeq
+        keys      = zip(A.tolist(), B.tolist(), lineIds.tolist(), linkSeq.tolist())
+        self.linkIndex = dict(zip(keys, xrange(len(keys))))
+        if len(self.linkIndex) == len(keys): return linkSeq
+
+        # This line seems to be a problem... A/B/NAME/SEQ are not unique
+        self.linkIndex = {}
+        duplicates = False
+        for (rownum, (a, b, lineId, trySeq)) in enumerate(keys):
+            if (a, b, lineId, trySeq) in self.linkIndex:
+                if trySeq == 0:
+                    WranglerLogger.warn("Duplicate A/B/Name: %d %d %s" % (a, b, self.lineNames[lineId]))
+                    duplicates = True
+                    continue
+                WranglerLogger.warn("Non-Unique A/B/Name/Seq: %d %d %s %d; faking SEQ!" % (a, b, self.lineNames[lineId], trySeq))
+            # Find one that works
+            while (a, b, lineId, trySeq) in self.linkIndex:
+                trySeq += 1
+            self.linkIndex[(a, b, lineId, trySeq)] = rownum
+            linkSeq[rownum] = trySeq
+        if duplicates: exit(1)
+        return linkSeq
+
+    def formatLinkKeys(self, A, B, names=None, seq=None):
+        """
+        Returns a string array of "A B" keys or, if *names* and *seq* are passed, "A B NAME SEQ" keys
+        (with SEQ left off where it's zero).  These are the AB and ABNAMESEQ fields.
+        """
+        keys = numpy.char.add(numpy.char.add(A.astype(str), " "), B.astype(str))
+        if names is None: return keys
+
+        keys = numpy.char.add(numpy.char.add(keys, " "), names)
+        seqstr = numpy.char.add(" ", seq.astype(str))
+        seqstr[seq <= 0] = ""
+        return numpy.char.add(keys, seqstr)
+
+    def linkRow(self, linename, a, b, seq):
+        """
+        Returns the row number in *trnAsgnTable* for the link (*a*, *b*) with sequence number *seq*
+        on line *linename*.  Throws an exception if it's not there.
+        """
+        if linename not in self.lineNameToId:
+            if linename.upper() in self.lineNameToId:
+                self.lineNameToId[linename] = self.lineNameToId[linename.upper()]
+            else:
+                raise TransitAssignmentDataException("Line [%s] not found in transit assignment data" % linename.upper())
+        try:
+            return self.linkIndex[(a, b, self.lineNameToId[linename], seq)]
+        except KeyError:
+            raise TransitAssignmentDataException("Key [%d %d %s %d] not found in transit assignment data" % 
+                                                 (a, b, linename.upper(), seq))
+
     def readTransitAssignmentCsvs(self):
         """
-        Read the transit assignment dbfs, the direct output of Cube's transit assignment.
+        Read the transit assignment csvs, the direct output of Cube's transit assignment.
+        Each is read once into columns (see :py:meth:`readTransitAssignmentCsv`) and filtered
+        with boolean masks.  With *csvChunkSize*, the csvs are read and added in in chunks.
         """
         self.trnAsgnTable   = False
         self.aggregateTable = False
         warnline = {}
+
+        # FREQ and SEQ are only in the dbf
+        dbfColumns = self.readTransitAssignmentDbf()
                 
         # open the input assignment files
         for mode in self.MODES:
@@ -229,340 +587,314 @@ class TransitAssignmentData:
             else:
                 filename = os.path.join(self.assigndir, "SF" + mode + self.timeperiod + ".csv")
                 
-            # Read the DBF file into datatable
+            # Read the csv file into columns
             WranglerLogger.info("Reading "+filename)
+            joinState   = {}
+            keptChunks  = []
+            numRead     = 0
+            for csvArray in self.readTransitAssignmentCsvChunks(filename, self.csvChunkSize):
+                keep        = self.filterTransitAssignmentCsv(csvArray, mode)
+                dbfRowNums  = self.joinTransitAssignmentDbf(csvArray, keep, dbfColumns, filename, joinState)[keep]
+                kept        = csvArray[keep]
+                numRead    += len(csvArray)
+                del csvArray
 
-            # Create our table data structure once
-            if mode == self.MODES[0]:
-                # figure out how many records
-                numrecs = 0
-                totalrows = 0
-                                
-                filereader = csv.reader(open(filename, 'rb'), delimiter=',', quoting=csv.QUOTE_NONE)
-                for row in filereader:
-                    
-                    # header row?
-                    if row[0]=="A": 
-                        self.initializeFields(row)
-                        continue
-                    elif totalrows==0 and not self.csvColnames:
-                        self.initializeFields()
-
-                    
-                    totalrows += 1
-                    if self.profileNode and \
-                       (int(row[self.colnameToCsvIndex["A"]]) != self.profileNode and
-                        int(row[self.colnameToCsvIndex["B"]]) != self.profileNode): continue
-                    
-                    if int(row[self.colnameToCsvIndex["MODE"]]) in self.ignoreModes: continue
-                    
-                    linename = row[self.colnameToCsvIndex["NAME"]].strip()
-
-                    # exclude this system?
-                    (system, vehicletype) = self.capacity.getSystemAndVehicleType(linename, self.timeperiod)
+                # the first file's rows become the table; keep them until it's all read
+                if mode == self.MODES[0]:
+                    keptChunks.append((kept, dbfRowNums))
+                    continue
 
-                    if len(self.system)>0 and system not in self.system: continue
+                # Add in the subsequent assignment files
+                tableRowNums = dbfRowToTableRow[dbfRowNums]
+                unmatched    = numpy.nonzero(tableRowNums < 0)[0]
+                if len(unmatched) > 0:
+                    for idx in unmatched:
+                        WranglerLogger.fatal("%s row: A=%d B=%d NAME=%s isn't in %s" % 
+                                             (filename, kept["A"][idx], kept["B"][idx], kept["NAME"][idx], self.MODES[0]))
+                    raise NetworkException("%d rows of %s aren't in the %s assignment" % (len(unmatched), filename, self.MODES[0]))
 
-                    numrecs += 1
-                WranglerLogger.info("Keeping %d records out of %d" % (numrecs, totalrows))
-                
-                self.trnAsgnTable = DataTable(numRecords=numrecs,
+                for field in self.trnAsgnAdditiveFields:
+                    tableArray[field] += numpy.bincount(tableRowNums, weights=kept[field], minlength=len(tableArray))
+
+                # we're done with this; free it up
+                del kept
+
+            # Initial table fill: Special stuff for the first time through
+            if mode == self.MODES[0]:
+                if len(keptChunks) == 1:
+                    (kept, dbfRowNums) = keptChunks[0]
+                else:
+                    kept       = numpy.concatenate([chunk[0] for chunk in keptChunks])
+                    dbfRowNums = numpy.concatenate([chunk[1] for chunk in keptChunks])
+                del keptChunks
+                WranglerLogger.info("Keeping %d records out of %d" % (len(kept), numRead))
+
+                self.trnAsgnTable = DataTable(numRecords=len(kept),
                                               fieldNames=self.trnAsgnFields.keys(),
                                               numpyFieldTypes=self.trnAsgnFields.values())
-                ABNameSeqSet = set()
-                ABSet = set()
-            
-            
-            # Go through the records
-            newrownum = 0
-            oldrownum = 0
-            
-            filereader = csv.reader(open(filename, 'rb'), delimiter=',', quoting=csv.QUOTE_NONE)
-            indbf = dbfTableReader(os.path.join(self.assigndir, "SFWBW" + self.timeperiod + ".dbf"))
-            
-            for row in filereader:
-                # header row?
-                if row[0]=="A": continue
-                                       
-                oldrownum += 1
-                
-                if self.profileNode:
-                    if (int(row[self.colnameToCsvIndex["A"]]) != self.profileNode and
-                        int(row[self.colnameToCsvIndex["B"]]) != self.profileNode): continue
-                    elif int(row[self.colnameToCsvIndex["AB_VOL"]]) > 0:
-                        WranglerLogger.info("Link %s %s for mode %s has AB_VOL %s" % 
-                                     (row[self.colnameToCsvIndex["A"]], 
-                                      row[self.colnameToCsvIndex["B"]], mode, 
-                                      row[self.colnameToCsvIndex["AB_VOL"]]))
-            
-                if int(row[self.colnameToCsvIndex["MODE"]]) in self.ignoreModes: continue
-                     
-                linename = row[self.colnameToCsvIndex["NAME"]].strip()
-                
-                # exclude this system?
-                (system, vehicletype) = self.capacity.getSystemAndVehicleType(linename, self.timeperiod)
-                if len(self.system)>0 and system not in self.system: continue
-            
-                # Initial table fill: Special stuff for the first time through
-                if mode == self.MODES[0]:
+                tableArray = self.trnAsgnTable._array
 
-                    # ------------ these fields just get used directly
-                    for field in self.trnAsgnCopyFields:
-                        
-                        try:
-                            
-                            # integer fields
-                            if self.trnAsgnFields[field][0] in ['u','b']:
-                                if row[self.colnameToCsvIndex[field]]=="":
-                                    self.trnAsgnTable[newrownum][field] = 0
-                                elif field in ['TIME','DIST']:
-                                    # backwards compatibility - dbfs were 100ths of a mile/min
-                                    self.trnAsgnTable[newrownum][field] = float(row[self.colnameToCsvIndex[field]])*100.0
-                                else:
-                                    self.trnAsgnTable[newrownum][field] = int(row[self.colnameToCsvIndex[field]])                               
-                            # float fields
-                            elif self.trnAsgnFields[field][0] == 'f':
-                                if row[self.colnameToCsvIndex[field]]=="":
-                                    self.trnAsgnTable[newrownum][field] = 0.0
-                                else:
-                                    self.trnAsgnTable[newrownum][field] = float(row[self.colnameToCsvIndex[field]])
-                            # text fields
-                            else:
-                                self.trnAsgnTable[newrownum][field] = row[self.colnameToCsvIndex[field]]
-                        
-                        except:
-                            WranglerLogger.fatal("Error intepreting field %s: [%s]" % (field, str(self.colnameToCsvIndex[field])))
-                            WranglerLogger.fatal("row=%s" % str(row))
-                            WranglerLogger.fatal(sys.exc_info()[0])
-                            WranglerLogger.fatal(sys.exc_info()[1])                        
-                            sys.exit(2)  
-                    # ------------ these fields come from the dbf because they're missing in the csv (sigh)
-                    dbfRow = indbf.__getitem__(oldrownum-1)
-                    if int(row[self.colnameToCsvIndex["A"]])<100000:
-                        if dbfRow["A"]!=int(row[self.colnameToCsvIndex["A"]]):
-                            raise NetworkException("Assertion error for A on row %d: %s != %s" % (oldrownum-1, str(dbfRow["A"]), str(row[self.colnameToCsvIndex["A"]])))
-                    if int(row[self.colnameToCsvIndex["B"]])<100000:
-                        if dbfRow["B"]!=int(row[self.colnameToCsvIndex["B"]]):
-                            raise NetworkException("Assertion error for B on row %d: %s != %s" % (oldrownum-1, str(dbfRow["B"]), str(row[self.colnameToCsvIndex["B"]])))
-                    self.trnAsgnTable[newrownum]["FREQ"] = dbfRow["FREQ"]
-                    self.trnAsgnTable[newrownum]["SEQ"]  = dbfRow["SEQ"]
-
-                    trySeq = dbfRow["SEQ"]
-                    # ------------ special one-time computed fields
-                    
-                    # ABNameSeq is more complicated because we want it to be unique 
-                    AB = row[self.colnameToCsvIndex["A"]] + " " + row[self.colnameToCsvIndex["B"]]
-                    self.trnAsgnTable[newrownum]["AB"] = AB
-                    
-                    ABNameSeq = AB + " " + linename
-                    if trySeq>0:
-                        tryABNameSeq = ABNameSeq + " " + str(trySeq)
-                    
-                        # This line seems to be a problem... A/B/NAME/SEQ are not unique
-                        if tryABNameSeq in ABNameSeqSet:
-                            WranglerLogger.warn("Non-Unique A/B/Name/Seq: " + tryABNameSeq + "; faking SEQ!")
-                        # Find one that works
-                        while tryABNameSeq in ABNameSeqSet:
-                            trySeq += 1
-                            tryABNameSeq = ABNameSeq + " " + str(trySeq)
-                        ABNameSeq = tryABNameSeq
-                    self.trnAsgnTable[newrownum]["ABNAMESEQ"] = ABNameSeq
-                    ABNameSeqSet.add(ABNameSeq)
-                    ABSet.add(AB)
-                    
-                    # ------------ straight lookup FULLNAME, VEHTYPE, VEHCAP; easy calc for PERIODCAP
-                    self.trnAsgnTable[newrownum]["SYSTEM"]  = system
-                    self.trnAsgnTable[newrownum]["VEHTYPE"] = vehicletype
-
-                    self.trnAsgnTable[newrownum]["FULLNAME"] = self.capacity.getFullname(linename, self.timeperiod)
-                        
-                    try:
-                       (vtype, vehcap) = self.capacity.getVehicleTypeAndCapacity(linename, self.timeperiod)
+                # ------------ these fields just get used directly
+                for field in self.trnAsgnCopyFields:
+                    if field in ['TIME','DIST']:
+                        # backwards compatibility - dbfs were 100ths of a mile/min
+                        tableArray[field] = kept[field]*100.0
+                    else:
+                        tableArray[field] = kept[field]
 
-                       self.trnAsgnTable[newrownum]["VEHCAP"] = vehcap
-                       self.trnAsgnTable[newrownum]["PERIODCAP"] = TransitLine.HOURS_PER_TIMEPERIOD[self.timeperiod] * 60.0 * vehcap/self.trnAsgnTable[newrownum]["FREQ"]
+                # initialize additive fields
+                for field in self.trnAsgnAdditiveFields:
+                    tableArray[field] = kept[field]
+
+                # ------------ these fields come from the dbf because they're missing in the csv (sigh)
+                tableArray["FREQ"] = dbfColumns["FREQ"][dbfRowNums]
+                tableArray["SEQ"]  = dbfColumns["SEQ"][dbfRowNums]
+
+                # so we can find these rows for the subsequent assignment files
+                dbfRowToTableRow = numpy.zeros(len(dbfColumns["A"]), dtype=numpy.int64) - 1
+                dbfRowToTableRow[dbfRowNums] = numpy.arange(len(kept))
+
+                # ------------ special one-time computed fields
+                # integer index on (A, B, line id, SEQ); SEQ is faked where that's not unique
+                linkSeq = self.buildLinkIndex(kept["A"], kept["B"], kept["NAME"], tableArray["SEQ"])
+                tableArray["AB"]        = self.formatLinkKeys(kept["A"], kept["B"])
+                tableArray["ABNAMESEQ"] = self.formatLinkKeys(kept["A"], kept["B"], kept["NAME"], linkSeq)
+
+                # ------------ straight lookup SYSTEM, FULLNAME, VEHTYPE, VEHCAP, GROUP; once per line
+                (linenames, lineIdx) = numpy.unique(kept["NAME"], return_inverse=True)
+                lineSystem  = []
+                lineVehType = []
+                lineFullname= []
+                lineVehCap  = []
+                lineGroup   = []
+                for linename in linenames:
+                    (system, vehicletype) = self.capacity.getSystemAndVehicleType(linename, self.timeperiod)
+                    lineSystem.append(system)
+                    lineVehType.append(vehicletype)
+                    lineFullname.append(self.capacity.getFullname(linename, self.timeperiod))
+                    try:
+                        (vtype, vehcap) = self.capacity.getVehicleTypeAndCapacity(linename, self.timeperiod)
                     except:
-                       self.trnAsgnTable[newrownum]["VEHCAP"] = 0
-                       self.trnAsgnTable[newrownum]["PERIODCAP"] = 0
+                        vehcap = 0
+                    lineVehCap.append(vehcap)
 
                     # if we still don't have a system, warn
-                    if self.trnAsgnTable[newrownum]["SYSTEM"] == "" and not warnline.has_key(linename):
+                    if system == "" and not warnline.has_key(linename):
                         WranglerLogger.warning("No default system: " + linename)
                         warnline[linename] =1
-                    
+
                     #---------add in any grouping that may want to use
                     if self.lineToGroup.has_key(linename):
-                        self.trnAsgnTable[newrownum]["GROUP"] = self.lineToGroup[linename]
+                        lineGroup.append(self.lineToGroup[linename])
                     else:
-                        self.trnAsgnTable[newrownum]["GROUP"] = ""
-                    
-                    # initialize additive fields
-                    for field in self.trnAsgnAdditiveFields:
-                        if row[self.colnameToCsvIndex[field]]=="":
-                            self.trnAsgnTable[newrownum][field] = 0.0
-                        else:
-                            self.trnAsgnTable[newrownum][field] = float(row[self.colnameToCsvIndex[field]])
-                        
+                        lineGroup.append("")
+
+                if len(linenames) > 0:
+                    tableArray["SYSTEM"]    = numpy.array(lineSystem)[lineIdx]
+                    tableArray["VEHTYPE"]   = numpy.array(lineVehType)[lineIdx]
+                    tableArray["FULLNAME"]  = numpy.array(lineFullname)[lineIdx]
+                    tableArray["GROUP"]     = numpy.array(lineGroup)[lineIdx]
+                    tableArray["VEHCAP"]    = numpy.array(lineVehCap)[lineIdx]
+
+                # easy calc for PERIODCAP
+                hasCap = (tableArray["VEHCAP"] > 0) & (tableArray["FREQ"] > 0)
+                tableArray["PERIODCAP"][hasCap] = TransitLine.HOURS_PER_TIMEPERIOD[self.timeperiod] * 60.0 * \
+                    tableArray["VEHCAP"][hasCap] / tableArray["FREQ"][hasCap]
                 # end initial table fill
-                
-                # Add in the subsequent assignment files
-                else:
-                    dbfRow = indbf.__getitem__(oldrownum-1)
-                    
-                    while (((int(row[self.colnameToCsvIndex["A"]])<100000) and
-                            (dbfRow["A"]!=int(row[self.colnameToCsvIndex["A"]]))) or
-                           ((int(row[self.colnameToCsvIndex["B"]])<100000) and
-                            (dbfRow["B"]!=int(row[self.colnameToCsvIndex["B"]])))):
-                        oldrownum += 1
-                        dbfRow = indbf.__getitem__(oldrownum-1)
-                    
-                    if int(row[self.colnameToCsvIndex["A"]])<100000:
-                        if dbfRow["A"]!=int(row[self.colnameToCsvIndex["A"]]):
-                            raise NetworkException("Assertion error for A on row %d: %s != %s" % (oldrownum-1, str(dbfRow["A"]), str(row[self.colnameToCsvIndex["A"]])))
-                    if int(row[self.colnameToCsvIndex["B"]])<100000:
-                        if dbfRow["B"]!=int(row[self.colnameToCsvIndex["B"]]):
-                            raise NetworkException("Assertion error for B on row %d: %s != %s" % (oldrownum-1, str(dbfRow["B"]), str(row[self.colnameToCsvIndex["B"]])))
-                    ABNameSeq = row[self.colnameToCsvIndex["A"]] + " " + \
-                                row[self.colnameToCsvIndex["B"]] + " " + \
-                                row[self.colnameToCsvIndex["NAME"]].rstrip()
-                    if dbfRow["SEQ"]>0:
-                        ABNameSeq += " " + str(dbfRow["SEQ"])                    
-                    for field in self.trnAsgnAdditiveFields:
-                        if row[self.colnameToCsvIndex[field]] !="":
-                            self.trnAsgnTable[ABNameSeq][field] += float(row[self.colnameToCsvIndex[field]])
-                        
-                newrownum += 1   
-
-            # we're done with this; free it up
-            del filereader
-            del indbf
-            
-            # Table is created and filled -- set the index
-            if mode == self.MODES[0]: 
-                try:
-                    self.trnAsgnTable.setIndex(fieldName="ABNAMESEQ")
-                except:
-                    # failure - try to figure out why
-                    ABNameSeqList = []
-                    for row in self.trnAsgnTable:
-                        ABNameSeqList.append(row["ABNAMESEQ"])
-                    ABNameSeqList.sort()
-                    for idx in range(len(ABNameSeqList)-1):
-                        if ABNameSeqList[idx]==ABNameSeqList[idx+1]:
-                            WranglerLogger.warn("Duplicate ABNAMESEQ at idx %d : [%s]" % (idx,ABNameSeqList[idx]))
-                    exit(1)
 
+                # we're done with this; free it up
+                del kept
+            
         # ok the table is all filled in -- fill in the LOAD
-        for row in self.trnAsgnTable:
-            if row["VEHCAP"] == 0: continue
-            row["LOAD"] = row["AB_VOL"] * self.TIMEPERIOD_FACTOR[self.timeperiod] * row["FREQ"] / (60.0 * row["VEHCAP"])
+        hasCap = tableArray["VEHCAP"] > 0
+        tableArray["LOAD"][hasCap] = tableArray["AB_VOL"][hasCap] * self.TIMEPERIOD_FACTOR[self.timeperiod] * \
+            tableArray["FREQ"][hasCap] / (60.0 * tableArray["VEHCAP"][hasCap])
 
         # build the aggregate table for key="A B"
         if self.aggregateAll:
-
-            self.aggregateTable = DataTable(numRecords=len(ABSet),
-                                            fieldNames=self.aggregateFields.keys(),
-                                            numpyFieldTypes=self.aggregateFields.values())
-            ABtoRowIndex = {}
-            rowsUsed = 0
-            for row in self.trnAsgnTable:
-                if row["AB"] not in ABtoRowIndex:
-                    rowIndex = rowsUsed
-                    self.aggregateTable[rowIndex]["AB"]     = row["AB"]
-                    self.aggregateTable[rowIndex]["A"]      = row["A"]
-                    self.aggregateTable[rowIndex]["B"]      = row["B"]
-                    self.aggregateTable[rowIndex]["DIST"]   = row["DIST"]
-                    self.aggregateTable[rowIndex]["FREQ"]       = 0.0
-                    self.aggregateTable[rowIndex]["PERIODCAP"]  = 0.0
-                    self.aggregateTable[rowIndex]["LOAD"]       = 0.0
-                    self.aggregateTable[rowIndex]["MAXLOAD"]    = 0.0
-                    for field in self.trnAsgnAdditiveFields:    # sum
-                        self.aggregateTable[rowIndex][field] = 0.0
-                    ABtoRowIndex[row["AB"]] = rowsUsed
-                    rowsUsed += 1
-                else:
-                    rowIndex = ABtoRowIndex[row["AB"]]
-                
-                for field in self.trnAsgnAdditiveFields:    # sum
-                    self.aggregateTable[rowIndex][field] += row[field]
-                self.aggregateTable[rowIndex]["AB_VOL"] += row["AB_VOL"]
-                self.aggregateTable[rowIndex]["BA_VOL"] += row["BA_VOL"]
-                self.aggregateTable[rowIndex]["PERIODCAP"] += row["PERIODCAP"]
-                self.aggregateTable[rowIndex]["MAXLOAD"] = max(row["LOAD"], self.aggregateTable[rowIndex]["MAXLOAD"])
-                self.aggregateTable[rowIndex]["FREQ"] += 1/row["FREQ"]  # combining -- will take reciprocal later
-            
+            self.aggregateTable = self.aggregateBy(["A","B"])
             self.aggregateTable.setIndex(fieldName="AB")
+            WranglerLogger.debug("count "+str(len(self.aggregateTable._array))+" lines in aggregate table")
+
+    def aggregateBy(self, keyFields=["A","B"]):
+        """
+        Aggregates the line-level *trnAsgnTable* to one row per unique value of the *keyFields*,
+        and returns it as a new DataTable.  ["A","B"] gives the link-level *aggregateTable*;
+        others such as ["SYSTEM"], ["GROUP"] or ["SYSTEM","VEHTYPE"] work too.
+        
+        The additive fields, VEHCAP and PERIODCAP are summed and MAXLOAD is the max LOAD of any line.
+        For links, FREQ combines the lines' headways (reciprocal of the summed reciprocals), LOAD is
+        AB_VOL / PERIODCAP, and AB and DIST come from the first line on the link.
+        Other groupings don't have FREQ or LOAD, since they only mean something for a link, and
+        their sums are 64-bit so they don't overflow the link-level field types.
+        """
+        tableArray  = self.trnAsgnTable._array
+        linkLevel   = (sorted(keyFields) == ["A","B"])
+        (groupIds, firstRows) = groupRows(tableArray, keyFields)
+        numGroups   = len(firstRows)
+
+        if linkLevel:
+            aggFields = dict(self.aggregateFields)
+        else:
+            aggFields = dict((field, 'f8') for field in self.trnAsgnAdditiveFields + ["PERIODCAP","MAXLOAD"])
+            aggFields["VEHCAP"] = 'i8'
+            for field in keyFields:
+                aggFields[field] = tableArray.dtype[field].str
+        aggTable = DataTable(numRecords=numGroups,
+                             fieldNames=aggFields.keys(),
+                             numpyFieldTypes=aggFields.values())
+        aggArray = aggTable._array
+        if numGroups == 0: return aggTable
+
+        # first
+        for field in keyFields + (["AB","DIST"] if linkLevel else []):
+            aggArray[field] = tableArray[field][firstRows]
+
+        # sum
+        for field in self.trnAsgnAdditiveFields + ["PERIODCAP"]:
+            aggArray[field] = numpy.bincount(groupIds, weights=tableArray[field], minlength=numGroups)
+        aggArray["VEHCAP"] = numpy.bincount(groupIds, weights=tableArray["VEHCAP"], minlength=numGroups).round()
 
-            count=0
-            for row in self.aggregateTable:
-                count += 1
-                if row["FREQ"]>0: 
-                    row["FREQ"] = 1/row["FREQ"]
-                if row["PERIODCAP"]>0:
-                    row["LOAD"] = float(row["AB_VOL"]) / row["PERIODCAP"]
-                    # print row["LOAD"]
-            WranglerLogger.debug("count "+str(count)+" lines in aggregate table")
+        # max
+        order = numpy.lexsort((tableArray["LOAD"], groupIds))
+        lastRows = numpy.searchsorted(groupIds[order], numpy.arange(numGroups), side='right') - 1
+        aggArray["MAXLOAD"] = tableArray["LOAD"][order[lastRows]]
+        if not linkLevel: return aggTable
+
+        # combining freq -- lines without service don't contribute
+        hasFreq  = tableArray["FREQ"] > 0
+        combined = numpy.bincount(groupIds[hasFreq], weights=1.0/tableArray["FREQ"][hasFreq], minlength=numGroups)
+        aggArray["FREQ"][combined > 0] = 1.0/combined[combined > 0]
+
+        hasCap   = aggArray["PERIODCAP"] > 0
+        aggArray["LOAD"][hasCap] = aggArray["AB_VOL"][hasCap] / aggArray["PERIODCAP"][hasCap]
+        return aggTable
 
     def calculateFleetCharacteristics(self):
-        """ Calculates the fleet characteristics - vehicle hours and vehicle miles - by vehicle type
+        """ Calculates the fleet characteristics - vehicle hours and vehicle miles - by vehicle type.
+            Sets *vehicleHours* and *vehicleMiles*, keyed by "SYSTEM,VEHTYPE", and returns the
+            table from :py:func:`fleetCharacteristics`.
         """
+        fleetTable = fleetCharacteristics([self])
         self.vehicleHours = defaultdict(float)
         self.vehicleMiles = defaultdict(float)
-        for key in self.trnAsgnTable._index.keys():
-            record = self.trnAsgnTable[key]
-            # don't process access, egress and transfer links
-            if record["MODE"]>9: continue
-            
-            # index by system, then by vehicle type
-            indexstr = record["SYSTEM"] + "," + record["VEHTYPE"]
-            
-            # number of vehicles = duration * 60 min/hour / freq
-            numveh = TransitLine.HOURS_PER_TIMEPERIOD[self.timeperiod] * 60.0 / record["FREQ"]
-            # vehicle hours = (# of vehicles) x time per link, or TIME * 1 hour/6000 hundredths of min
-            self.vehicleHours[indexstr] += numveh*(record["TIME"]/6000.0)
-            # vehicle miles = (# of vehicles) x dist per link, or DIST * 1 mile/100 hundredths of mile
-            self.vehicleMiles[indexstr] += numveh*(record["DIST"]/100.0)
+        for row in fleetTable._array:
+            indexstr = row["SYSTEM"] + "," + row["VEHTYPE"]
+            self.vehicleHours[indexstr] += row["VEHHOURS"]
+            self.vehicleMiles[indexstr] += row["VEHMILES"]
+        return fleetTable
 
-    def readAggregateDbfs(self, asgnFileName, aggregateFileName=None):
+    def readAggregateDbfs(self, asgnFileName, aggregateFileName=None, useCache=True):
         """
         This is essentially the reverse of writeDbfs() below.
+        
+        If *useCache*, the tables (with their text fields stripped) and the SEQ for the index are
+        kept in a binary cache next to *asgnFileName*, and read from there when the dbfs haven't changed.
         """
         self.initializeFields()  # this may be unnecessary
 
-        self.trnAsgnTable = dbfTableReader(asgnFileName)
-        self.trnAsgnTable.setIndex(fieldName="ABNAMESEQ")
-
-        # a little bit of cleanup
-        headerTuples = []
-        for headerFieldType in self.trnAsgnTable.header:
-            headerTuples.append(headerFieldType.toTuple())
+        if useCache and self.readAggregateCache(asgnFileName, aggregateFileName):
+            return
 
-        # rstrip spaces off the end of the text fields
-        for row in self.trnAsgnTable:
-            for headerTuple in headerTuples:
-                if headerTuple[1] == 'C': row[headerTuple[0]] = string.rstrip(row[headerTuple[0]])
+        self.trnAsgnTable = dbfTableReader(asgnFileName)
+        self.stripTextFields(self.trnAsgnTable)
 
-        # this is the index!
-        self.trnAsgnTable.setIndex(fieldName="ABNAMESEQ")
+        # this is the index!  SEQ may have been faked, so take it from ABNAMESEQ
+        tableArray = self.trnAsgnTable._array
+        linkSeq = numpy.array([int(key.split()[3]) if len(key.split()) > 3 else 0 for key in tableArray["ABNAMESEQ"]],
+                              dtype=numpy.int64)
+        self.buildLinkIndex(tableArray["A"], tableArray["B"], tableArray["NAME"], linkSeq)
 
         # the link-level aggregate table
         if not aggregateFileName:
             self.aggregateAll   = False
             self.aggregateTable = False
-            return
+        else:
+            self.aggregateAll   = True
+            self.aggregateTable = dbfTableReader(aggregateFileName)
+            self.stripTextFields(self.aggregateTable)
 
-        self.aggregateAll   = True
-        self.aggregateTable = dbfTableReader(aggregateFileName)
+        if useCache:
+            self.writeAggregateCache(asgnFileName, aggregateFileName)
+
+    def stripTextFields(self, table):
+        """
+        rstrip spaces off the end of the text fields of the given DataTable read from a dbf.
+        """
+        for headerFieldType in table.header:
+            headerTuple = headerFieldType.toTuple()
+            if headerTuple[1] == 'C':
+                table._array[headerTuple[0]] = numpy.char.rstrip(table._array[headerTuple[0]])
+
+    def aggregateCacheSources(self, asgnFileName, aggregateFileName):
+        """
+        Returns an array of (filename, mtime, size) for the dbfs read by :py:meth:`readAggregateDbfs`;
+        the cache is only good if these match.
+        """
+        sources = numpy.zeros(2 if aggregateFileName else 1,
+                              dtype=[("FILE",'S260'), ("MTIME",'f8'), ("SIZE",'i8')])
+        for (idx, filename) in enumerate([asgnFileName, aggregateFileName][:len(sources)]):
+            stat = os.stat(filename)
+            sources[idx] = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+        return sources
+
+    def readAggregateCache(self, asgnFileName, aggregateFileName):
+        """
+        Reads the tables and index from the cache for *asgnFileName* if it matches the dbfs.
+        The tables are memory-mapped, copy-on-write.  Returns True if the cache was used.
+        """
+        cachedir = asgnFileName + ".npycache"
+        try:
+            sources = self.aggregateCacheSources(asgnFileName, aggregateFileName)
+            cachedSources = numpy.load(os.path.join(cachedir, "sources.npy"))
+        except (IOError, OSError, ValueError):
+            return False
+        if cachedSources.dtype != sources.dtype or not numpy.array_equal(cachedSources, sources):
+            WranglerLogger.debug("Cache %s is out of date" % cachedir)
+            return False
+
+        tableArray = numpy.load(os.path.join(cachedir, "line.npy"), mmap_mode='c')
+        self.trnAsgnTable = self.tableFromArray(tableArray)
+        self.buildLinkIndex(tableArray["A"], tableArray["B"], tableArray["NAME"],
+                            numpy.load(os.path.join(cachedir, "linkSeq.npy")))
+
+        if aggregateFileName:
+            self.aggregateAll   = True
+            self.aggregateTable = self.tableFromArray(numpy.load(os.path.join(cachedir, "agg.npy"), mmap_mode='c'))
+        else:
+            self.aggregateAll   = False
+            self.aggregateTable = False
+        WranglerLogger.debug("Read %s from cache %s" % (asgnFileName, cachedir))
+        return True
+
+    def writeAggregateCache(self, asgnFileName, aggregateFileName):
+        """
+        Writes the cache read by :py:meth:`readAggregateCache`.  The sources go last, so a partly
+        written cache won't be used.  Failing to write the cache is only a warning.
+        """
+        cachedir = asgnFileName + ".npycache"
+        try:
+            if not os.path.exists(cachedir): os.mkdir(cachedir)
+            sourcesFile = os.path.join(cachedir, "sources.npy")
+            if os.path.exists(sourcesFile): os.remove(sourcesFile)
 
-        # cleanup again
-        headerTuples = []
-        for headerFieldType in self.aggregateTable.header:
-            headerTuples.append(headerFieldType.toTuple())
+            numpy.save(os.path.join(cachedir, "line.npy"), self.trnAsgnTable._array)
+            numpy.save(os.path.join(cachedir, "linkSeq.npy"), self.rowLinkSeq)
+            if aggregateFileName:
+                numpy.save(os.path.join(cachedir, "agg.npy"), self.aggregateTable._array)
+            numpy.save(sourcesFile, self.aggregateCacheSources(asgnFileName, aggregateFileName))
+        except (IOError, OSError):
+            WranglerLogger.warning("Couldn't write cache %s: %s" % (cachedir, str(sys.exc_info()[1])))
 
-        # rstrip spaces off the end of the text fields
-        for row in self.aggregateTable:
-            for headerTuple in headerTuples:
-                if headerTuple[1] == 'C': row[headerTuple[0]] = string.rstrip(row[headerTuple[0]])
+    def tableFromArray(self, array):
+        """
+        Returns a DataTable for the given numpy structured array.
+        """
+        table = DataTable(numRecords=0,
+                          fieldNames=list(array.dtype.names),
+                          numpyFieldTypes=[array.dtype[field].str for field in array.dtype.names])
+        table._array = array
+        return table
 
     def writePnrDrivers(self, pnrFileName):
         """
@@ -612,7 +944,7 @@ class TransitAssignmentData:
              FieldType("GROUP",      "C", 20,0),
              FieldType("VEHTYPE",    "C", 40,0),
              FieldType("VEHCAP",     "F", 8, 2),
-             FieldType("PERIODCAP",  "F", 8, 2),
+             FieldType("PERIODCAP",  "F", 10,2),
              FieldType("LOAD",       "F", 7, 3),
              FieldType("AB_VOL",     addtype, addlen, addnumdec),
              FieldType("AB_BRDA",    addtype, addlen, addnumdec),
@@ -636,7 +968,7 @@ class TransitAssignmentData:
              FieldType("FREQ",      "F", 6, 2),
              FieldType("DIST",      "N", 4, 0),
              FieldType("VEHCAP",    "F", 8, 2),
-             FieldType("PERIODCAP", "F", 8, 2),
+             FieldType("PERIODCAP", "F", 10,2),
              FieldType("LOAD",      "F", 7, 3),
              FieldType("MAXLOAD",   "F", 7, 3),
              FieldType("AB_VOL",    addtype, addlen, addnumdec),
@@ -660,18 +992,12 @@ class TransitAssignmentData:
             Returns an int representing number of boards in the whole time period.
             Throws an exception if linename isnt recognized or if nodenum is not part of the line.
         """
-        key = "%d %d %s %d" % (nodenum, nodenum_next, linename.upper(), seq)
-        if key in self.trnAsgnTable:
-            return self.trnAsgnTable[key]["AB_BRDA"]
-        raise TransitAssignmentDataException("key [%s] not found in transit assignment data" % key)
+        return self.trnAsgnTable._array["AB_BRDA"][self.linkRow(linename, nodenum, nodenum_next, seq)]
     
     def numExits(self, linename, nodenum_prev, nodenum, seq):
         """ See numBoards
         """
-        key = "%d %d %s %d" % (nodenum_prev, nodenum, linename.upper(), seq)
-        if key in self.trnAsgnTable:
-            return self.trnAsgnTable[key]["AB_XITB"]
-        raise TransitAssignmentDataException("key [%s] not found in transit assignment data" % key)
+        return self.trnAsgnTable._array["AB_XITB"][self.linkRow(linename, nodenum_prev, nodenum, seq)]
     
     def loadFactor(self, linename, a,b, seq):
         """ Returns a fraction: peak hour pax per vehicle / vehicle capacity
@@ -681,50 +1007,159 @@ class TransitAssignmentData:
             the simple peak hour factors that quickboards uses but this could be refined
             in the future.
         """
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["LOAD"]
+        return self.trnAsgnTable._array["LOAD"][self.linkRow(linename, a, b, seq)]
     
     def linkVolume(self,linename,a,b,seq):
         """Return number of people on a given link a b"""
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["AB_VOL"]
+        return self.trnAsgnTable._array["AB_VOL"][self.linkRow(linename, a, b, seq)]
     
     def linkTime(self,linename,a,b,seq): 
         """Return time in minutes on a given link a b"""
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["TIME"]
+        return self.trnAsgnTable._array["TIME"][self.linkRow(linename, a, b, seq)]
 
     
     def linkDistance(self,linename,a,b,seq):
         """Return distance in miles on a given link a b"""
-        key = "%d %d %s %d" % (a, b, linename.upper(), seq)
-        if key not in self.trnAsgnTable:
-            raise TransitAssignmentDataException("Key [%s] not found in transit assignment data" % key)
-        return self.trnAsgnTable[key]["DIST"]
+        return self.trnAsgnTable._array["DIST"][self.linkRow(linename, a, b, seq)]
         
 
-# Not complete.... TODO if it makes sense....
-class DailyTransitAssignmentData:
+def fleetCharacteristics(tads):
+    """
+    Calculates the fleet characteristics by time period, system and vehicle type for the list of
+    time period :py:class:`TransitAssignmentData` instances *tads* (e.g. one, or all five).
+    Access, egress and transfer links and links without service are skipped.
     
+    Returns a DataTable with one row per (TIMEPERIOD, SYSTEM, VEHTYPE) and the fields
+    VEHICLES (vehicle trips on the lines, from their frequencies), VEHHOURS and VEHMILES.
+    """
+    timeperiods = []
+    systems     = []
+    vehtypes    = []
+    numVehicles = []    # per link
+    lineFirsts  = []    # first link of each line
+    vehHours    = []
+    vehMiles    = []
+    offset      = 0
+    for tad in tads:
+        tableArray = tad.trnAsgnTable._array
+        inService  = (tableArray["MODE"] <= 9) & (tableArray["FREQ"] > 0)
+
+        # number of vehicles = duration * 60 min/hour / freq
+        numveh     = TransitLine.HOURS_PER_TIMEPERIOD[tad.timeperiod] * 60.0 / tableArray["FREQ"][inService]
+        timeperiods.append(numpy.repeat(numpy.array([tad.timeperiod]), len(numveh)))
+        systems.append(tableArray["SYSTEM"][inService])
+        vehtypes.append(tableArray["VEHTYPE"][inService])
+        numVehicles.append(numveh)
+        lineFirsts.append(offset + numpy.unique(tableArray["NAME"][inService], return_index=True)[1])
+        # vehicle hours = (# of vehicles) x time per link, or TIME * 1 hour/6000 hundredths of min
+        vehHours.append(numveh*(tableArray["TIME"][inService]/6000.0))
+        # vehicle miles = (# of vehicles) x dist per link, or DIST * 1 mile/100 hundredths of mile
+        vehMiles.append(numveh*(tableArray["DIST"][inService]/100.0))
+        offset    += len(numveh)
+
+    fleetTable = DataTable(numRecords=0,
+                           fieldNames=["TIMEPERIOD","SYSTEM","VEHTYPE","VEHICLES","VEHHOURS","VEHMILES"],
+                           numpyFieldTypes=['a5','a25','a40','f8','f8','f8'])
+    if offset == 0: return fleetTable
+
+    keys       = [numpy.concatenate(timeperiods), numpy.concatenate(systems), numpy.concatenate(vehtypes)]
+    (groupIds, firstRows) = groupKeys(keys)
+    numGroups  = len(firstRows)
+    lineFirsts = numpy.concatenate(lineFirsts)
+
+    fleetTable = DataTable(numRecords=numGroups,
+                           fieldNames=fleetTable._array.dtype.names,
+                           numpyFieldTypes=[fleetTable._array.dtype[field].str for field in fleetTable._array.dtype.names])
+    fleetArray = fleetTable._array
+    for (field, key) in zip(["TIMEPERIOD","SYSTEM","VEHTYPE"], keys):
+        fleetArray[field] = key[firstRows]
+    fleetArray["VEHICLES"] = numpy.bincount(groupIds[lineFirsts], weights=numpy.concatenate(numVehicles)[lineFirsts],
+                                            minlength=numGroups)
+    fleetArray["VEHHOURS"] = numpy.bincount(groupIds, weights=numpy.concatenate(vehHours), minlength=numGroups)
+    fleetArray["VEHMILES"] = numpy.bincount(groupIds, weights=numpy.concatenate(vehMiles), minlength=numGroups)
+    return fleetTable
+
+
+class DailyTransitAssignmentData(TransitAssignmentData):
+    """
+    Daily transit assignment data, built from the five time period :py:class:`TransitAssignmentData`
+    instances using their tables as they are, so nothing is read again.  The lookups such as
+    :py:meth:`linkVolume`, :py:meth:`aggregateBy` and :py:meth:`writeDbfs` work the same way.
+    """
+    TIMEPERIODS = ["AM", "MD", "PM", "EV", "EA"]
+
     def __init__(self, tadAM, tadMD, tadPM, tadEV, tadEA):
         """
-        For aggregating into a single version!
+        The line-level rows of the time periods are aligned on their (A, B, line, SEQ) integer keys.
+        The additive fields are summed, as is PERIODCAP, which gives the daily capacity.  FREQ is the
+        average headway over the time periods with service, and LOAD is AB_VOL / PERIODCAP, as for the
+        link-level aggregate.  The other fields come from the first time period with the row.
         """
-        keys = set(tadAM.trnAsgnTable._index.keys())
-        keys = keys.union(tadMD.trnAsgnTable._index.keys())
-        keys = keys.union(tadPM.trnAsgnTable._index.keys())
-        keys = keys.union(tadEV.trnAsgnTable._index.keys())
-        keys = keys.union(tadEA.trnAsgnTable._index.keys())
+        tads = [tadAM, tadMD, tadPM, tadEV, tadEA]
+        self.timeperiod     = "DAILY"
+        self.capacity       = tadAM.capacity
+        self.lineToGroup    = tadAM.lineToGroup
+        self.trnAsgnFields  = dict(tadAM.trnAsgnFields)
+        self.trnAsgnAdditiveFields = list(tadAM.trnAsgnAdditiveFields)
+        self.aggregateFields= dict(tadAM.aggregateFields)
+        self.aggregateAll   = True
+
+        # line ids for the union of the time periods' lines
+        allLineNames = numpy.unique(numpy.concatenate([numpy.array(tad.lineNames, dtype=str) for tad in tads]))
+        allLineIds   = []
+        for tad in tads:
+            tadToAll = numpy.searchsorted(allLineNames, numpy.array(tad.lineNames, dtype=str))
+            allLineIds.append(tadToAll[tad.rowLineIds])
+        allLinkSeq   = numpy.concatenate([tad.rowLinkSeq for tad in tads])
+
+        # daily row for each time period row
+        offsets = numpy.cumsum([0] + [len(tad.trnAsgnTable._array) for tad in tads])
+        (dailyRows, firstRows) = groupKeys(
+            [numpy.concatenate([tad.trnAsgnTable._array["A"].astype(numpy.int64) for tad in tads]),
+             numpy.concatenate([tad.trnAsgnTable._array["B"].astype(numpy.int64) for tad in tads]),
+             numpy.concatenate(allLineIds), allLinkSeq])
+        firstPeriod = numpy.searchsorted(offsets, firstRows, side='right') - 1
+        numRows     = len(firstRows)
+        WranglerLogger.info("Combining %s line-level rows into %d daily rows" % (str(list(numpy.diff(offsets))), numRows))
+
+        self.trnAsgnTable = DataTable(numRecords=numRows,
+                                      fieldNames=self.trnAsgnFields.keys(),
+                                      numpyFieldTypes=self.trnAsgnFields.values())
+        dailyArray = self.trnAsgnTable._array
+
+        sumFields   = self.trnAsgnAdditiveFields + ["PERIODCAP"]
+        firstFields = [field for field in self.trnAsgnFields.keys() if field not in sumFields + ["FREQ","LOAD"]]
+        minutesServed = numpy.zeros(numRows)
+        numVehicles   = numpy.zeros(numRows)
+        for (tpIdx, tad) in enumerate(tads):
+            tadArray = tad.trnAsgnTable._array
+            tadRows  = dailyRows[offsets[tpIdx]:offsets[tpIdx+1]]
+            if len(tadRows) == 0: continue
+
+            isFirst  = (firstPeriod == tpIdx)
+            for field in firstFields:
+                dailyArray[field][isFirst] = tadArray[field][firstRows[isFirst] - offsets[tpIdx]]
+
+            for field in sumFields:
+                dailyArray[field] += numpy.bincount(tadRows, weights=tadArray[field], minlength=numRows)
+
+            # number of vehicles = duration * 60 min/hour / freq
+            hasFreq = tadArray["FREQ"] > 0
+            periodMinutes  = TransitLine.HOURS_PER_TIMEPERIOD[tad.timeperiod] * 60.0
+            minutesServed += periodMinutes*numpy.bincount(tadRows[hasFreq], minlength=numRows)
+            numVehicles   += numpy.bincount(tadRows[hasFreq], weights=periodMinutes/tadArray["FREQ"][hasFreq],
+                                            minlength=numRows)
+
+        hasVehicles = numVehicles > 0
+        dailyArray["FREQ"][hasVehicles] = minutesServed[hasVehicles] / numVehicles[hasVehicles]
+        hasCap = dailyArray["PERIODCAP"] > 0
+        dailyArray["LOAD"][hasCap] = dailyArray["AB_VOL"][hasCap] / dailyArray["PERIODCAP"][hasCap]
+
+        self.buildLinkIndex(dailyArray["A"], dailyArray["B"], dailyArray["NAME"], allLinkSeq[firstRows])
 
-        # self.trnAsgnTable = DataTable(numRecords=numrecs,
-        #                              fieldNames=self.trnAsgnFields.keys(),
-        #                              numpyFieldTypes=self.trnAsgnFields.values())
+        self.aggregateTable = self.aggregateBy(["A","B"])
+        self.aggregateTable.setIndex(fieldName="AB")
+        WranglerLogger.debug("count "+str(len(self.aggregateTable._array))+" lines in daily aggregate table")
 
 
 if __name__ == '__main__':
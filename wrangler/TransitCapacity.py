@@ -1,4 +1,5 @@
 import copy,csv,os,re,string
+from .Logger import WranglerLogger
 from .NetworkException import NetworkException
 
 __all__ = ['TransitCapacity']
@@ -26,6 +27,14 @@ class TransitCapacity:
     DELAY_PERBOARD  = 2
     DELAY_PERALIGHT = 3
 
+    # for self.lineRecords
+    # (linename, timeperiod) -> [ system, vehicletype, full name, capacity or None, delays or None ]
+    REC_SYSTEM      = 0
+    REC_VEHTYPE     = 1
+    REC_FULLNAME    = 2
+    REC_CAPACITY    = 3
+    REC_DELAYS      = 4
+
     def __init__(self, directory=".",
                  transitLineToVehicle="transitLineToVehicle.csv",
                  transitVehicleToCapacity="transitVehicleToCapacity.csv",
@@ -39,6 +48,7 @@ class TransitCapacity:
         self.linenameToAttributes   = {}
         self.linenameToSimple       = {}
         self.prefixToVehicleType    = {}
+        self.lineRecords            = {}
 
         self.readTransitLineToVehicle(directory, filename=transitLineToVehicle)
         self.readTransitVehicleToCapacity(directory, filename=transitVehicleToCapacity)
@@ -60,6 +70,7 @@ class TransitCapacity:
         lines = f.readlines()
         f.close()
         
+        self.lineRecords.clear()
         for line in lines:
             tokens = line.split(",")
             if tokens[0]=="VehicleType": continue # header
@@ -97,6 +108,7 @@ class TransitCapacity:
            e.g. "MUN91I" -> [ "91I", "91" ]
         """
         l2vReader = csv.reader(open(os.path.join(directory,filename)))
+        self.lineRecords.clear()
         for name,system,stripped,simplename,fullLineName,vehicleTypeAM,vehicleTypePM,vehicleTypeOP in l2vReader:
             self.linenameToAttributes[name] = [system, fullLineName, vehicleTypeAM,vehicleTypePM,vehicleTypeOP]
             self.linenameToSimple[name] = [stripped, simplename]
@@ -125,6 +137,7 @@ class TransitCapacity:
             prefix -> [ system, vehicletype ]
         """
         p2vReader = csv.reader(open(os.path.join(directory,filename)))
+        self.lineRecords.clear()
         for prefix, system, vehicleType in p2vReader:
             self.prefixToVehicleType[prefix] = [system, vehicleType]
 
@@ -140,72 +153,92 @@ class TransitCapacity:
             f.write(self.prefixToVehicleType[prefix][1] + "\n")   # vehicleType
         f.close()
         
-    def getSystemAndVehicleType(self, linename, timeperiod):
+    def getLineRecord(self, linename, timeperiod):
         """
-        Convenience function.  Returns tuple: best guess of (system, vehicletype)
+        Returns the record for *linename* in *timeperiod*:
+           [ system, vehicletype, full name, vehicle capacity, delays ]
+        where capacity and delays (see *vehicleTypeToDelays*) are None if the vehicle type's are unknown.
+        Each (linename, timeperiod) is only looked up once; the records are cached in *lineRecords*
+        until the line, vehicle type or prefix mappings change.
         """
+        key = (linename, timeperiod)
+        if key in self.lineRecords: return self.lineRecords[key]
+
         linenameU = linename.upper()
         if self.linenameToAttributes.has_key(linenameU):
-            return (self.linenameToAttributes[linenameU][TransitCapacity.ATTR_SYSTEM], 
-                    self.linenameToAttributes[linenameU][TransitCapacity.TIMEPERIOD_TO_VEHTYPIDX[timeperiod]])
-
-        if linename[:4] in self.prefixToVehicleType:
-            return ( self.prefixToVehicleType[linenameU[:4]][0], self.prefixToVehicleType[linenameU[:4]][1])
+            system      = self.linenameToAttributes[linenameU][TransitCapacity.ATTR_SYSTEM]
+            vehicleType = self.linenameToAttributes[linenameU][TransitCapacity.TIMEPERIOD_TO_VEHTYPIDX[timeperiod]]
+            fullname    = self.linenameToAttributes[linenameU][TransitCapacity.ATTR_FULLNAME]
+        elif linename[:4] in self.prefixToVehicleType:
+            (system, vehicleType) = self.prefixToVehicleType[linenameU[:4]]
+            fullname    = ""
+        elif linename[:3] in self.prefixToVehicleType:
+            (system, vehicleType) = self.prefixToVehicleType[linenameU[:3]]
+            fullname    = ""
+        else:
+            (system, vehicleType, fullname) = ("", "", "")
 
-        if linename[:3] in self.prefixToVehicleType:
-            return ( self.prefixToVehicleType[linenameU[:3]][0], self.prefixToVehicleType[linenameU[:3]][1])
+        record = [system, vehicleType, fullname,
+                  self.vehicleTypeToCapacity.get(vehicleType),
+                  self.vehicleTypeToDelays.get(vehicleType)]
+        self.lineRecords[key] = record
+        return record
 
-        return ("", "")
+    def getSystemAndVehicleType(self, linename, timeperiod):
+        """
+        Convenience function.  Returns tuple: best guess of (system, vehicletype)
+        """
+        record = self.getLineRecord(linename, timeperiod)
+        return (record[TransitCapacity.REC_SYSTEM], record[TransitCapacity.REC_VEHTYPE])
 
 
     def getVehicleTypeAndCapacity(self, linename, timeperiod):
         """ returns (vehicletype, vehiclecapacity)
         """        
-        (system, vehicleType) = self.getSystemAndVehicleType(linename, timeperiod)
+        record = self.getLineRecord(linename, timeperiod)
         
-        if vehicleType not in self.vehicleTypeToCapacity:
-            raise NetworkException("Vehicle type [%s] of system [%s] characteristics unknown; line name = [%s]" % (vehicleType, system, linename.upper()))
+        if record[TransitCapacity.REC_CAPACITY] == None:
+            raise NetworkException("Vehicle type [%s] of system [%s] characteristics unknown; line name = [%s]" % 
+                                   (record[TransitCapacity.REC_VEHTYPE], record[TransitCapacity.REC_SYSTEM], linename.upper()))
 
-        capacity = self.vehicleTypeToCapacity[vehicleType]
-        return (vehicleType, capacity)
+        return (record[TransitCapacity.REC_VEHTYPE], record[TransitCapacity.REC_CAPACITY])
 
     def getFullname(self, linename, timeperiod):
         """
         Returns best guess of fullname, or empty string if unknown
         """
-        linenameU = linename.upper()
-        if self.linenameToAttributes.has_key(linenameU):
-            return self.linenameToAttributes[linenameU][TransitCapacity.ATTR_FULLNAME]
-        else:
-            return ""
+        return self.getLineRecord(linename, timeperiod)[TransitCapacity.REC_FULLNAME]
 
     def getSimpleDwell(self, linename, timeperiod):
         """
         Returns a number
         """
-        (system, vehicleType) = self.getSystemAndVehicleType(linename, timeperiod)
-        if vehicleType not in self.vehicleTypeToDelays:
-            raise NetworkException("Vehicle type [%s] of system [%s] simple dwell unknown; line name = [%s]" % (vehicleType, system, linename.upper()))
+        record = self.getLineRecord(linename, timeperiod)
+        if record[TransitCapacity.REC_DELAYS] == None:
+            raise NetworkException("Vehicle type [%s] of system [%s] simple dwell unknown; line name = [%s]" % 
+                                   (record[TransitCapacity.REC_VEHTYPE], record[TransitCapacity.REC_SYSTEM], linename.upper()))
 
-        return self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_SIMPLE]
+        return record[TransitCapacity.REC_DELAYS][TransitCapacity.DELAY_SIMPLE]
 
     def getComplexDwells(self, linename, timeperiod):
         """
         Returns (constant, perboard, peralight), all three are numbers
         """
-        (system, vehicleType) = self.getSystemAndVehicleType(linename, timeperiod)
-        if vehicleType not in self.vehicleTypeToDelays:
-            raise NetworkException("Vehicle type [%s] of system [%s] simple dwell unknown; line name = [%s]" % (vehicleType, system, linename.upper()))
+        record = self.getLineRecord(linename, timeperiod)
+        if record[TransitCapacity.REC_DELAYS] == None:
+            raise NetworkException("Vehicle type [%s] of system [%s] simple dwell unknown; line name = [%s]" % 
+                                   (record[TransitCapacity.REC_VEHTYPE], record[TransitCapacity.REC_SYSTEM], linename.upper()))
 
-        return (self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_CONST],
-                self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_PERBOARD],
-                self.vehicleTypeToDelays[vehicleType][TransitCapacity.DELAY_PERALIGHT])        
+        return (record[TransitCapacity.REC_DELAYS][TransitCapacity.DELAY_CONST],
+                record[TransitCapacity.REC_DELAYS][TransitCapacity.DELAY_PERBOARD],
+                record[TransitCapacity.REC_DELAYS][TransitCapacity.DELAY_PERALIGHT])        
 
     def addVehicleType(self, newVehicleType, newVehicleCapacity):
         """
         Self explanatory
         """
         self.vehicleTypeToCapacity[newVehicleType] = newVehicleCapacity
+        self.lineRecords.clear()
 
     def addLinename(self, newLine, templateLine):
         """
@@ -216,6 +249,7 @@ class TransitCapacity:
 
         self.linenameToAttributes[newLine] = copy.deepcopy(self.linenameToAttributes[templateLine])
         self.linenameToSimple[newLine]     = copy.deepcopy(self.linenameToSimple[templateLine])
+        self.lineRecords.clear()
 
     def setAllVehicleTypes(self, linename, vehicleType, lineNameIsRegex = False):
         """
@@ -224,7 +258,7 @@ class TransitCapacity:
         """
         if vehicleType not in self.vehicleTypeToCapacity:
             WranglerLogger.warn("Setting vehicle type for line %s but vehicleType %s unknown" % (linename, vehicleType))
-        
+        self.lineRecords.clear()
 
         if lineNameIsRegex:
             linename_re = re.compile(linename, flags=re.IGNORECASE)
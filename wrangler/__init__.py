@@ -3,7 +3,7 @@ from .Network import Network
 from .NetworkException import NetworkException
 from .PNRLink import PNRLink
 from .Supplink import Supplink
-from .TransitAssignmentData import TransitAssignmentData
+from .TransitAssignmentData import TransitAssignmentData, DailyTransitAssignmentData, fleetCharacteristics
 from .TransitCapacity import TransitCapacity
 from .TransitLine import TransitLine
 from .TransitLink import TransitLink
@@ -16,9 +16,9 @@ from .HwySpecsRTP import HwySpecsRTP
 
 
 __all__ = ['NetworkException', 'setupLogging', 'WranglerLogger',
-           'Network', 'TransitAssignmentData', 'TransitNetwork', 'TransitLine', 'TransitParser',
+           'Network', 'TransitAssignmentData', 'DailyTransitAssignmentData', 'TransitNetwork', 'TransitLine', 'TransitParser',
            'Node', 'TransitLink', 'Linki', 'PNRLink', 'Supplink', 'HighwayNetwork', 'HwySpecsRTP',
-           'TransitCapacity',
+           'TransitCapacity', 'fleetCharacteristics',
 ]
 
 
@@ -0,0 +1,151 @@
+import os, sys, unittest
+import numpy
+
+# test this version of Wrangler
+curdir = os.path.dirname(__file__)
+sys.path.insert(1, os.path.normpath(os.path.join(curdir, "..", "..")))
+
+import Wrangler
+from Wrangler.TransitAssignmentData import groupKeys
+from dataTable import DataTable
+
+class JoinTestData(Wrangler.TransitAssignmentData):
+    """ TransitAssignmentData with just the fields set up, so the join can be tested without files
+    """
+    def __init__(self):
+        self.csvColnames = None
+        self.timeperiod  = "AM"
+        self.initializeFields()
+
+    def csvArray(self, rows):
+        """ Returns the csv columns for the list of (A, B, NAME) *rows*, with AB_VOL 10, 20, 30...
+        """
+        csvArray = numpy.zeros(len(rows), dtype=self.csvFields)
+        for (rownum, (a, b, name)) in enumerate(rows):
+            csvArray["A"][rownum]      = a
+            csvArray["B"][rownum]      = b
+            csvArray["NAME"][rownum]   = name
+            csvArray["AB_VOL"][rownum] = 10*(rownum+1)
+        return csvArray
+
+class TestTransitAssignmentJoin(unittest.TestCase):
+
+    def setUp(self):
+        """ A dbf with the 1-2 link on two lines
+        """
+        self.tad = JoinTestData()
+        self.dbfColumns = self.tad.indexTransitAssignmentDbf(
+            {"A":    numpy.array([1, 2, 1, 2]),
+             "B":    numpy.array([2, 3, 2, 4]),
+             "NAME": numpy.array(["L1", "L1", "L2", "L2"]),
+             "FREQ": numpy.array([10.0, 10.0, 15.0, 15.0]),
+             "SEQ":  numpy.array([1, 2, 1, 2])})
+
+    def join(self, rows, chunkSize=None):
+        csvArray = self.tad.csvArray(rows)
+        if not chunkSize:
+            return self.tad.joinTransitAssignmentDbf(csvArray, numpy.ones(len(rows), dtype=bool),
+                                                     self.dbfColumns, "test.csv").tolist()
+        joinState  = {}
+        dbfRowNums = []
+        for start in range(0, len(rows), chunkSize):
+            chunk = csvArray[start:start+chunkSize]
+            dbfRowNums.extend(self.tad.joinTransitAssignmentDbf(chunk, numpy.ones(len(chunk), dtype=bool),
+                                                                self.dbfColumns, "test.csv", joinState).tolist())
+        return dbfRowNums
+
+    def test_join_all_rows(self):
+        rows = [(1,2,"L1"), (2,3,"L1"), (1,2,"L2"), (2,4,"L2")]
+        self.assertEqual(self.join(rows), [0,1,2,3])
+        self.assertEqual(self.join(rows, chunkSize=1), [0,1,2,3])
+
+    def test_join_missing_row_of_other_line(self):
+        # the later mode csv doesn't have L1's 1-2 row; L2's 1-2 row still goes to L2
+        rows = [(2,3,"L1"), (1,2,"L2"), (2,4,"L2")]
+        self.assertEqual(self.join(rows), [1,2,3])
+        self.assertEqual(self.join(rows, chunkSize=2), [1,2,3])
+
+    def test_join_line_name_case(self):
+        self.assertEqual(self.join([(1,2,"l2")]), [2])
+
+    def test_join_repeated_link_on_line(self):
+        self.dbfColumns = self.tad.indexTransitAssignmentDbf(
+            {"A":    numpy.array([1, 2, 1, 2]),
+             "B":    numpy.array([2, 1, 2, 1]),
+             "NAME": numpy.array(["L1", "L1", "L1", "L1"])})
+        self.assertEqual(self.join([(1,2,"L1"), (2,1,"L1"), (1,2,"L1")]), [0,1,2])
+        self.assertEqual(self.join([(1,2,"L1"), (2,1,"L1"), (1,2,"L1")], chunkSize=1), [0,1,2])
+
+    def test_join_big_node_numbers(self):
+        # the dbf doesn't have node numbers 100000 and above, so those rows follow the line
+        self.dbfColumns = self.tad.indexTransitAssignmentDbf(
+            {"A":    numpy.array([1, 5, 1, 5]),
+             "B":    numpy.array([2, 3, 2, 3]),
+             "NAME": numpy.array(["L1", "L1", "L2", "L2"])})
+        self.assertEqual(self.join([(1,2,"L1"), (100001,3,"L1"), (1,2,"L2"), (100001,3,"L2")]), [0,1,2,3])
+        self.assertEqual(self.join([(1,2,"L2"), (100001,3,"L2")]), [2,3])
+        self.assertEqual(self.join([(100001,3,"L2")], chunkSize=1), [3])
+
+    def test_join_unmatched(self):
+        self.assertRaises(Wrangler.NetworkException, self.join, [(1,2,"L3")])
+        self.assertRaises(Wrangler.NetworkException, self.join, [(2,3,"L2")])
+        self.assertRaises(Wrangler.NetworkException, self.join, [(1,2,"L1"), (1,2,"L1")])
+
+class TestGroupKeys(unittest.TestCase):
+
+    def test_group_keys(self):
+        (groupIds, firstRows) = groupKeys([numpy.array(["b", "a", "b", "a", "b"]),
+                                           numpy.array([2, 1, 2, 2, 1])])
+        self.assertEqual(groupIds.tolist(), [0, 1, 0, 2, 3])
+        self.assertEqual(firstRows.tolist(), [0, 1, 3, 4])
+
+class TestTransitAssignmentAggregate(unittest.TestCase):
+
+    def setUp(self):
+        """ 1200 rows on the 1-2 link (two lines, alternating) and one on the 2-3 link
+        """
+        self.tad = JoinTestData()
+        rows     = [(1,2,"L%d" % (rownum%2 + 1)) for rownum in range(1200)] + [(2,3,"L3")]
+        table    = DataTable(numRecords=len(rows), fieldNames=self.tad.trnAsgnFields.keys(),
+                             numpyFieldTypes=self.tad.trnAsgnFields.values())
+        tableArray = table._array
+        tableArray["A"]         = [row[0] for row in rows]
+        tableArray["B"]         = [row[1] for row in rows]
+        tableArray["AB"]        = ["%d %d" % (row[0], row[1]) for row in rows]
+        tableArray["NAME"]      = [row[2] for row in rows]
+        tableArray["SYSTEM"]    = "SF MUNI"
+        tableArray["VEHCAP"]    = 80
+        tableArray["PERIODCAP"] = 100.0
+        tableArray["FREQ"]      = [(10.0 if row[2]=="L1" else 15.0) for row in rows]
+        tableArray["AB_VOL"]    = 1.0
+        tableArray["LOAD"]      = numpy.arange(len(rows))/1000.0
+        self.tad.trnAsgnTable   = table
+
+    def test_aggregate_links(self):
+        aggArray = self.tad.aggregateBy(["A","B"])._array
+        self.assertEqual(aggArray["AB"].tolist(), ["1 2", "2 3"])
+        self.assertEqual(aggArray["AB_VOL"].tolist(), [1200.0, 1.0])
+        self.assertEqual(aggArray["PERIODCAP"].tolist(), [120000.0, 100.0])
+        self.assertAlmostEqual(aggArray["FREQ"][0], 1.0/(600/10.0 + 600/15.0), places=4)
+        self.assertAlmostEqual(aggArray["FREQ"][1], 15.0, places=4)
+        self.assertAlmostEqual(aggArray["LOAD"][0], 0.01)
+        self.assertAlmostEqual(aggArray["MAXLOAD"][0], 1.199)
+        self.assertAlmostEqual(aggArray["MAXLOAD"][1], 1.2)
+
+    def test_aggregate_system(self):
+        aggArray = self.tad.aggregateBy(["SYSTEM"])._array
+        self.assertEqual(len(aggArray), 1)
+        self.assertEqual(aggArray["VEHCAP"][0], 1201*80)
+        self.assertEqual(aggArray["AB_VOL"][0], 1201.0)
+        self.assertAlmostEqual(aggArray["MAXLOAD"][0], 1.2)
+        self.assertTrue("FREQ" not in aggArray.dtype.names)
+        self.assertTrue("LOAD" not in aggArray.dtype.names)
+
+    def test_aggregate_lines(self):
+        aggArray = self.tad.aggregateBy(["NAME"])._array
+        self.assertEqual(aggArray["NAME"].tolist(), ["L1", "L2", "L3"])
+        self.assertEqual(aggArray["VEHCAP"].tolist(), [600*80, 600*80, 80])
+
+
+if __name__ == '__main__':
+    unittest.main()